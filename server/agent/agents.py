@@ -7,8 +7,16 @@ from dataclasses import dataclass, field
 from typing import Callable, Tuple
 
 from dotenv import load_dotenv
+import logging
 import os
 
+from .cassette import through_cassette
+from .ratelimit import get_limiter
+from .tracing import span
+from .usage import record_llm_usage, record_tool_call
+
+logger = logging.getLogger(__name__)
+
 #MODEL_ID = "mistral.mistral-large-2407-v1:0"
 MODEL_ID = "anthropic.claude-3-5-sonnet-20241022-v2:0"
 
@@ -25,13 +33,66 @@ if not aws_region_name:
     raise ValueError("BR_AWS_DEFAULT_REGION is not set in the environment variables")
 search_api_key = os.getenv("SERPERDEV_API_KEY")
 
+# Model asked first by the tool agent, escalating to MODEL_ID (see routing.py); empty
+# to ask every field to MODEL_ID
+FAST_MODEL_ID = os.getenv("BEDROCK_FAST_MODEL_ID", "anthropic.claude-3-5-haiku-20241022-v1:0")
+
+# Retries are done by the shared limiter (see ratelimit.py), not by botocore
+BEDROCK_BOTO3_CONFIG = {"retries": {"mode": "standard", "total_max_attempts": 1}}
+# Output tokens reserved in the tokens-per-minute bucket for each call
+EXPECTED_OUTPUT_TOKENS = 512
+
+
+def _estimate_tokens(messages: list[ChatMessage]) -> int:
+    """Rough token count of a request (about 4 characters per token) plus the expected output"""
+    characters = sum(len(str(message.to_dict())) for message in messages)
+    return characters // 4 + EXPECTED_OUTPUT_TOKENS
+
+
+def _reply_tokens(reply: ChatMessage) -> int:
+    usage = reply.meta.get("usage") or {}
+    return usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+
+
+def _generate(llm, messages: list[ChatMessage], tools=None) -> ChatMessage:
+    """Get the first reply of the chat generator (recorded/replayed by an active cassette).
+
+    Real calls go through the shared Bedrock limiter, which retries throttled calls.
+    """
+    model = getattr(llm, "model", None)
+    with span("llm.generate", "llm", model=model, messages=len(messages)) as llm_span:
+        reply = through_cassette(
+            "bedrock",
+            lambda: {
+                "model": model,
+                "messages": [message.to_dict() for message in messages],
+                "tools": [tool.name for tool in tools] if tools else None,
+            },
+            lambda: get_limiter().call(
+                lambda: llm.run(messages=messages, tools=tools)["replies"][0],
+                estimated_tokens=_estimate_tokens(messages),
+                used_tokens=_reply_tokens,
+                on_retry=lambda error: llm_span.add("retries"),
+            ),
+            encode=lambda reply: reply.to_dict(),
+            decode=ChatMessage.from_dict,
+        )
+        usage = reply.meta.get("usage") or {}
+        input_tokens = usage.get("prompt_tokens", 0)
+        output_tokens = usage.get("completion_tokens", 0)
+        record_llm_usage(model, input_tokens, output_tokens)
+        llm_span.set_attribute("input_tokens", input_tokens)
+        llm_span.set_attribute("output_tokens", output_tokens)
+        llm_span.set_attribute("tool_calls", len(reply.tool_calls))
+    return reply
+
 # Implementations adapted from https://haystack.deepset.ai/cookbook/swarm
 
 # Simple Agent without tools
 @dataclass
 class Agent:
     name: str = "Agent"
-    llm: object = AmazonBedrockChatGenerator(model=MODEL_ID)
+    llm: object = AmazonBedrockChatGenerator(model=MODEL_ID, boto3_config=BEDROCK_BOTO3_CONFIG)
     instructions: str = (
         "You are a helpful assistant tasked with finding answers to questions. Keep the answers as short as possible, never longer than one sentence and idealy only one words if it is just a fact."
     )
@@ -40,12 +101,10 @@ class Agent:
         self._system_message = ChatMessage.from_system(self.instructions)
 
     def run(self, messages: list[ChatMessage]) -> list[ChatMessage]:
-        new_message = self.llm.run(messages=[self._system_message] + messages)[
-            "replies"
-        ][0]
+        new_message = _generate(self.llm, [self._system_message] + messages)
 
         if new_message.text:
-            print(f"{self.name}: {new_message.text}")
+            logger.debug(f"{self.name}: {new_message.text}")
 
         return [new_message]
 
@@ -53,7 +112,12 @@ class Agent:
 @dataclass
 class ToolCallingAgent:
     name: str = "ToolCallingAgent"
-    llm: object = AmazonBedrockChatGenerator(model=MODEL_ID)
+    llm: object = AmazonBedrockChatGenerator(model=MODEL_ID, boto3_config=BEDROCK_BOTO3_CONFIG)
+    # Fast tier used by run(fast=True), None to always use `llm`
+    fast_llm: object = (
+        AmazonBedrockChatGenerator(model=FAST_MODEL_ID, boto3_config=BEDROCK_BOTO3_CONFIG)
+        if FAST_MODEL_ID else None
+    )
     instructions: str = (
         "You are a helpful assistant with tools at your disposal tasked with finding answers to questions. Keep the answres as short as possible, never longer than one sentence and idealy only one words if it is just a fact."
     )
@@ -73,23 +137,35 @@ class ToolCallingAgent:
             else None
         )
 
-    def run(self, messages: list[ChatMessage]) -> Tuple[str, list[ChatMessage]]:
-        # generate response
-        agent_message = self.llm.run(
-            messages=[self._system_message] + messages, tools=self.tools
-        )["replies"][0]
+    @property
+    def has_fast_model(self) -> bool:
+        return self.fast_llm is not None
+
+    def run(self, messages: list[ChatMessage], fast: bool = False) -> Tuple[str, list[ChatMessage]]:
+        # generate response, with the fast model when asked and available
+        llm = self.fast_llm if fast and self.fast_llm is not None else self.llm
+        agent_message = _generate(
+            llm, [self._system_message] + messages, tools=self.tools
+        )
         new_messages = [agent_message]
 
         if agent_message.text:
-            print(f"{self.name}: {agent_message.text}")
+            logger.debug(f"{self.name}: {agent_message.text}")
 
         
         if not agent_message.tool_calls:
             return new_messages
 
         # handle tool calls
-        print(f"{self.name}: {agent_message.tool_calls}")
-        tool_results = self._tool_invoker.run(messages=[agent_message])["tool_messages"]
+        logger.debug(f"{self.name}: {agent_message.tool_calls}")
+        tool_names = [tool_call.tool_name for tool_call in agent_message.tool_calls]
+        for tool_name in tool_names:
+            record_tool_call(tool_name)
+        with span(",".join(tool_names), "tool", calls=len(tool_names)) as tool_span:
+            tool_results = self._tool_invoker.run(messages=[agent_message])["tool_messages"]
+            tool_span.set_attribute(
+                "errors", sum(1 for result in tool_results if result.tool_call_result.error)
+            )
         new_messages.extend(tool_results)
 
         return new_messages
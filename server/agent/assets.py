@@ -0,0 +1,235 @@
+"""Local cache of the remote images of the fiche (the logo of the commune).
+
+The logo URL is whatever the LLM found. Left to WeasyPrint, it would be fetched during
+`write_pdf()`, synchronously, without timeout nor cache, so a slow or dead host stalls
+the render. Instead the orchestrator prefetches the logo as soon as its field is
+answered, while the other sections are still running, and the rendering gives
+WeasyPrint a `url_fetcher` serving only cached assets (see api/rendering.py).
+
+`AssetCache.fetch` downloads an image with a timeout and a size limit, checks that it
+is an image, downscales raster images larger than ASSET_MAX_PIXELS and stores the
+result under the SHA-256 of its content. URLs are indexed on disk too, so warm workers
+reuse the assets of previous jobs. Concurrent fetches of a URL are single-flighted and
+failures are remembered for ASSET_FAILURE_TTL_SECONDS.
+"""
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "h-genai-assets"))
+# Download limits of one asset
+ASSET_FETCH_TIMEOUT_SECONDS = float(os.getenv("ASSET_FETCH_TIMEOUT_SECONDS", "5"))
+ASSET_MAX_BYTES = int(os.getenv("ASSET_MAX_BYTES", str(5 * 1024 * 1024)))
+# Raster images are downscaled to this size (largest side, in pixels)
+ASSET_MAX_PIXELS = int(os.getenv("ASSET_MAX_PIXELS", "512"))
+# How long a URL that failed is not downloaded again
+ASSET_FAILURE_TTL_SECONDS = float(os.getenv("ASSET_FAILURE_TTL_SECONDS", "600"))
+ASSET_PREFETCH_WORKERS = int(os.getenv("ASSET_PREFETCH_WORKERS", "4"))
+
+SVG_MIME_TYPE = "image/svg+xml"
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "WEBP": "image/webp"}
+
+
+@dataclass(frozen=True)
+class Asset:
+    """A cached image.
+
+    Attributes:
+        digest: SHA-256 of the stored body
+        mime_type: Type of the stored body (e.g. "image/png")
+        path: File of the body in the cache directory
+    """
+
+    digest: str
+    mime_type: str
+    path: str
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as file:
+            return file.read()
+
+
+def download(url: str, timeout: float = ASSET_FETCH_TIMEOUT_SECONDS, max_bytes: int = ASSET_MAX_BYTES) -> bytes:
+    """Body of an http(s) URL, raising when it fails, is too slow or too large"""
+    with requests.get(url, timeout=timeout, stream=True, headers={"User-Agent": "h-genai-server"}) as response:
+        response.raise_for_status()
+        body = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            body.extend(chunk)
+            if len(body) > max_bytes:
+                raise ValueError(f"Asset larger than {max_bytes} bytes")
+    return bytes(body)
+
+
+def _is_svg(body: bytes) -> bool:
+    head = body[:1024].lstrip().lower()
+    return head.startswith((b"<svg", b"<?xml", b"<!doctype svg")) and b"<svg" in head
+
+
+def prepare_image(body: bytes, max_pixels: int = ASSET_MAX_PIXELS) -> Tuple[bytes, str]:
+    """Check that a body is an image and downscale it, returning (body, mime type).
+
+    Raises:
+        ValueError: The body is not an image
+    """
+    if _is_svg(body):
+        return body, SVG_MIME_TYPE
+    try:
+        with Image.open(io.BytesIO(body)) as image:
+            image.verify()
+        # verify() leaves the image unusable, it is opened again to be resized
+        image = Image.open(io.BytesIO(body))
+        image.load()
+    except Exception as e:
+        raise ValueError(f"Not an image: {type(e).__name__}: {e}")
+
+    image_format = image.format or "PNG"
+    if image_format not in _MIME_TYPES:
+        # e.g. ICO or BMP, converted to a format every PDF renderer reads
+        image_format = "PNG"
+    elif max(image.size) <= max_pixels:
+        return body, _MIME_TYPES[image_format]
+
+    image.thumbnail((max_pixels, max_pixels))
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue(), _MIME_TYPES[image_format]
+
+
+class AssetCache:
+    """Content-addressed cache of remote images, filled ahead of the rendering.
+
+    Args:
+        directory: Where the assets and the URL index are stored
+        fetch: Function returning the body of a URL (`download` by default)
+        max_pixels: Raster images are downscaled to this size (largest side)
+        failure_ttl: Seconds during which a URL that failed is not downloaded again
+        workers: Threads downloading the prefetched URLs
+    """
+
+    def __init__(
+        self,
+        directory: str = ASSET_CACHE_DIR,
+        fetch: Callable[[str], bytes] = download,
+        max_pixels: int = ASSET_MAX_PIXELS,
+        failure_ttl: float = ASSET_FAILURE_TTL_SECONDS,
+        workers: int = ASSET_PREFETCH_WORKERS,
+    ):
+        self.directory = directory
+        self._fetch = fetch
+        self.max_pixels = max_pixels
+        self.failure_ttl = failure_ttl
+        self._assets: Dict[str, Asset] = {}
+        self._failures: Dict[str, float] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asset-prefetch")
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "urls"), exist_ok=True)
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.directory, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest)
+
+    @staticmethod
+    def _write(path: str, body: bytes) -> None:
+        # Written aside then renamed, so concurrent workers never read a partial file
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(body)
+        os.replace(temporary, path)
+
+    def get(self, url: str) -> Optional[Asset]:
+        """The cached asset of a URL, None when it isn't cached (never downloads)"""
+        with self._lock:
+            asset = self._assets.get(url)
+        if asset is not None:
+            return asset
+        try:
+            with open(self._url_path(url), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        asset = Asset(entry["digest"], entry["mime_type"], self._object_path(entry["digest"]))
+        if not os.path.exists(asset.path):
+            return None
+        with self._lock:
+            self._assets[url] = asset
+        return asset
+
+    def _download(self, url: str) -> Optional[Asset]:
+        try:
+            body, mime_type = prepare_image(self._fetch(url), self.max_pixels)
+        except Exception as e:
+            logger.warning(f"Asset {url} not cached: {type(e).__name__}: {e}")
+            with self._lock:
+                self._failures[url] = time.monotonic()
+            return None
+
+        digest = hashlib.sha256(body).hexdigest()
+        asset = Asset(digest, mime_type, self._object_path(digest))
+        if not os.path.exists(asset.path):
+            self._write(asset.path, body)
+        self._write(self._url_path(url), json.dumps({"digest": digest, "mime_type": mime_type}).encode("utf-8"))
+        with self._lock:
+            self._assets[url] = asset
+        logger.info(f"Asset {url} cached as {digest[:12]} ({mime_type}, {len(body)} bytes)")
+        return asset
+
+    def _run(self, url: str) -> Optional[Asset]:
+        try:
+            return self.get(url) or self._download(url)
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def prefetch(self, url: str) -> "Future[Optional[Asset]]":
+        """Start caching a URL in the background (once, however many callers ask)"""
+        future: Future = Future()
+        with self._lock:
+            if url in self._assets:
+                future.set_result(self._assets[url])
+                return future
+            failed_at = self._failures.get(url)
+            if failed_at is not None and time.monotonic() - failed_at < self.failure_ttl:
+                future.set_result(None)
+                return future
+            if url in self._inflight:
+                return self._inflight[url]
+            future = self._executor.submit(self._run, url)
+            self._inflight[url] = future
+        return future
+
+    def fetch(self, url: str, timeout: Optional[float] = ASSET_FETCH_TIMEOUT_SECONDS) -> Optional[Asset]:
+        """The asset of a URL, waiting at most `timeout` seconds for its download.
+        None when the URL isn't an image, failed or is too slow"""
+        try:
+            return self.prefetch(url).result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.warning(f"Asset {url} not cached after {timeout}s")
+            return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_asset_cache(directory: str = ASSET_CACHE_DIR) -> AssetCache:
+    """The asset cache of the process"""
+    return AssetCache(directory)
@@ -0,0 +1,217 @@
+"""Record/replay cassettes for the external calls made while generating a fiche.
+
+In record mode every Bedrock reply, Perplexity tool call and OFGL HTTP exchange is
+captured into a gzipped JSON lines file. In replay mode they are served from that
+file, optionally sleeping for the originally recorded latency, so a production fiche
+can be reproduced and profiled offline.
+
+Enable it with environment variables (read once, on first use):
+    HGENAI_CASSETTE=lehavre.cassette.jsonl.gz
+    HGENAI_CASSETTE_MODE=record|replay
+    HGENAI_CASSETTE_LATENCY=1   # replay with the recorded latencies
+
+or programmatically with `use_cassette(path, mode)`.
+"""
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a request was not recorded"""
+
+
+class RecordedCallError(RuntimeError):
+    """Re-raised in replay mode for a call that failed while recording"""
+
+
+def request_key(kind: str, request: Any) -> str:
+    """Stable hash of a request, used to match replayed calls"""
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{kind}:{payload}".encode("utf-8")).hexdigest()[:32]
+
+
+class Cassette:
+    """A set of recorded interactions, keyed by a hash of the request.
+
+    Identical requests recorded several times are replayed in the recorded order (the
+    last one is repeated if the replay makes more calls than the recording).
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY, simulate_latency: bool = False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.simulate_latency = simulate_latency
+        self.meta: Dict[str, Any] = {}
+        # Number of calls served/recorded per kind
+        self.calls: Counter = Counter()
+        self._interactions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._replay_positions: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._seq = 0
+
+        if mode == REPLAY:
+            self._load()
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            for line in file:
+                entry = json.loads(line)
+                if entry.get("kind") == "meta":
+                    self.meta.update(entry["meta"])
+                else:
+                    self._interactions[entry["key"]].append(entry)
+
+    def save(self) -> None:
+        """Write the recorded interactions to the cassette file"""
+        if self.mode != RECORD:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [entry for recorded in self._interactions.values() for entry in recorded]
+            meta = dict(self.meta)
+            self._dirty = False
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path, "wt", encoding="utf-8") as file:
+            file.write(json.dumps({"kind": "meta", "meta": meta}, default=str) + "\n")
+            for entry in sorted(entries, key=lambda e: e["seq"]):
+                file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+
+    def annotate(self, **meta: Any) -> None:
+        """Store metadata (e.g. the city_info of the recorded fiche) with the cassette"""
+        with self._lock:
+            self.meta.update(meta)
+            self._dirty = True
+
+    def __len__(self) -> int:
+        return sum(len(recorded) for recorded in self._interactions.values())
+
+    def call(
+        self,
+        kind: str,
+        request: Any,
+        perform: Callable[[], Any],
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+    ) -> Any:
+        key = request_key(kind, request)
+        with self._lock:
+            self.calls[kind] += 1
+        if self.mode == REPLAY:
+            return self._replay(kind, key, decode)
+
+        start = time.perf_counter()
+        try:
+            result = perform()
+        except Exception as e:
+            self._record(kind, key, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+            raise
+        self._record(kind, key, time.perf_counter() - start, response=encode(result))
+        return result
+
+    def _record(self, kind: str, key: str, latency: float, **outcome: Any) -> None:
+        with self._lock:
+            entry = {"kind": kind, "key": key, "latency": round(latency, 4), "seq": self._seq}
+            self._seq += 1
+            entry.update(outcome)
+            self._interactions[key].append(entry)
+            self._dirty = True
+
+    def _replay(self, kind: str, key: str, decode: Callable[[Any], Any]) -> Any:
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise CassetteMissError(f"No recorded {kind} call matches request {key}")
+            position = self._replay_positions[key]
+            self._replay_positions[key] = position + 1
+            entry = recorded[min(position, len(recorded) - 1)]
+
+        if self.simulate_latency:
+            time.sleep(entry.get("latency", 0.0))
+        if "error" in entry:
+            raise RecordedCallError(entry["error"])
+        return decode(entry["response"])
+
+
+_active: Optional[Cassette] = None
+_env_loaded = False
+_active_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Return the active cassette, creating it from the environment on first use"""
+    global _active, _env_loaded
+    if _env_loaded:
+        return _active
+
+    with _active_lock:
+        if not _env_loaded:
+            path = os.getenv("HGENAI_CASSETTE")
+            if path and _active is None:
+                _active = Cassette(
+                    path,
+                    mode=os.getenv("HGENAI_CASSETTE_MODE", REPLAY),
+                    simulate_latency=os.getenv("HGENAI_CASSETTE_LATENCY", "0") == "1",
+                )
+                atexit.register(_active.save)
+            _env_loaded = True
+    return _active
+
+
+@contextmanager
+def use_cassette(
+    path: str, mode: str = REPLAY, simulate_latency: bool = False
+) -> Iterator[Cassette]:
+    """Activate a cassette for the duration of the block (saved on exit when recording)"""
+    global _active, _env_loaded
+    cassette = Cassette(path, mode=mode, simulate_latency=simulate_latency)
+    with _active_lock:
+        previous, previous_loaded = _active, _env_loaded
+        _active, _env_loaded = cassette, True
+    try:
+        yield cassette
+    finally:
+        cassette.save()
+        with _active_lock:
+            _active, _env_loaded = previous, previous_loaded
+
+
+def through_cassette(
+    kind: str,
+    request: Any,
+    perform: Callable[[], Any],
+    encode: Callable[[Any], Any] = lambda result: result,
+    decode: Callable[[Any], Any] = lambda response: response,
+) -> Any:
+    """Run an external call through the active cassette (or directly if there is none).
+
+    Args:
+        kind: Type of call ("bedrock", "perplexity", "ofgl")
+        request: JSON-serialisable description of the request, used to match replays.
+            May be a callable so it's only built when a cassette is active
+        perform: Performs the real call
+        encode: Converts the result to a JSON-serialisable value for recording
+        decode: Converts a recorded value back to a result
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return perform()
+    if callable(request):
+        request = request()
+    return cassette.call(kind, request, perform, encode, decode)
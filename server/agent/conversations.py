@@ -0,0 +1,180 @@
+"""Bounded memory of the tool agent conversations of a job.
+
+Each field is asked in a conversation so that the agent sees the previous questions of
+its section, but the tool calls and Perplexity payloads of an answered field are only
+needed to produce that answer. `ConversationStore` therefore reduces every finished
+exchange to the question and the final answer, drops the oldest exchanges above
+CONVERSATION_MAX_CHARS, and evicts a conversation once its last field is answered. The
+largest size held at once is the job's memory figure in its usage (see `memory_usage`).
+
+Finished conversations are logged as one JSON line with their size and number of tool
+calls: at INFO for a sample of them (CONVERSATION_LOG_SAMPLE_RATE), at DEBUG otherwise.
+The texts of the messages, truncated, are only logged at DEBUG.
+"""
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from haystack.dataclasses import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Characters kept per conversation (the Q/A pairs of its answered fields)
+CONVERSATION_MAX_CHARS = int(os.getenv("CONVERSATION_MAX_CHARS", "20000"))
+# Fraction of the finished conversations logged at INFO
+CONVERSATION_LOG_SAMPLE_RATE = float(os.getenv("CONVERSATION_LOG_SAMPLE_RATE", "0.05"))
+# Characters of every message text in the DEBUG logs
+LOG_TEXT_CHARS = 200
+
+
+def message_chars(message: ChatMessage) -> int:
+    """Approximate size of a message: its text, tool call arguments and tool results"""
+    size = len(message.text or "")
+    for tool_call in message.tool_calls:
+        size += len(json.dumps(tool_call.arguments, ensure_ascii=False, default=str))
+    if message.tool_call_result is not None:
+        size += len(message.tool_call_result.result)
+    return size
+
+
+def log_event(level: int, event: str, **fields: Any) -> None:
+    """Log an event as a JSON line (parsed as fields by CloudWatch Logs Insights)"""
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+def process_peak_rss_mb() -> float:
+    """Peak resident memory of the whole process since it started, in MB. It is shared by
+    the jobs running in the process and never decreases, so it isn't a figure of a job"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return round(peak / (1_048_576 if sys.platform == "darwin" else 1024), 1)
+
+
+class ConversationStore:
+    """Messages of the open conversations of a job.
+
+    Args:
+        max_chars: Size above which the oldest exchanges of a conversation are dropped
+        log_sample_rate: Fraction of the finished conversations logged at INFO
+    """
+
+    def __init__(
+        self,
+        max_chars: int = CONVERSATION_MAX_CHARS,
+        log_sample_rate: float = CONVERSATION_LOG_SAMPLE_RATE,
+    ):
+        self.max_chars = max_chars
+        self.log_sample_rate = log_sample_rate
+        self._conversations: Dict[str, List[ChatMessage]] = {}
+        self._chars: Dict[str, int] = {}
+        # Tool calls made in each open conversation (their messages are compacted away)
+        self._tool_calls: Dict[str, int] = {}
+        self.held_chars = 0
+        self.peak_chars = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._conversations
+
+    def __getitem__(self, conversation_id: str) -> List[ChatMessage]:
+        return self._conversations[conversation_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._conversations))
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def open(self, conversation_id: str) -> List[ChatMessage]:
+        """Messages of a conversation, started empty if it isn't open.
+        Only the thread running the conversation modifies the list."""
+        with self._lock:
+            return self._conversations.setdefault(conversation_id, [])
+
+    def _resize(self, conversation_id: str, chars: int) -> None:
+        """Record the new size of a conversation (under the lock)"""
+        self.held_chars += chars - self._chars.get(conversation_id, 0)
+        self._chars[conversation_id] = chars
+        self.peak_chars = max(self.peak_chars, self.held_chars)
+
+    def measure(self, conversation_id: str) -> None:
+        """Record the size of a conversation during an exchange (tool payloads included)"""
+        messages = self._conversations.get(conversation_id, [])
+        chars = sum(message_chars(message) for message in messages)
+        with self._lock:
+            self._resize(conversation_id, chars)
+
+    def compact(self, conversation_id: str, start: int, answer: str) -> None:
+        """Reduce the exchange starting at `start` to its question and final answer,
+        then drop the oldest exchanges while the conversation is above `max_chars`"""
+        self.measure(conversation_id)
+        messages = self._conversations[conversation_id]
+        exchange = messages[start:]
+        tool_calls = sum(len(message.tool_calls) for message in exchange)
+        messages[start:] = [exchange[0], ChatMessage.from_assistant(answer)]
+
+        # Exchanges are (question, answer) pairs once compacted; the last one is kept
+        chars = sum(message_chars(message) for message in messages)
+        while chars > self.max_chars and len(messages) > 2:
+            chars -= message_chars(messages[0]) + message_chars(messages[1])
+            del messages[:2]
+        with self._lock:
+            self._tool_calls[conversation_id] = self._tool_calls.get(conversation_id, 0) + tool_calls
+            self._resize(conversation_id, chars)
+
+    def close(self, conversation_id: str) -> None:
+        """Evict a finished conversation, logging a summary of it"""
+        with self._lock:
+            messages = self._conversations.pop(conversation_id, [])
+            chars = self._chars.pop(conversation_id, 0)
+            tool_calls = self._tool_calls.pop(conversation_id, 0)
+            self.held_chars -= chars
+            self.evicted += 1
+
+        sampled = random.random() < self.log_sample_rate
+        log_event(
+            logging.INFO if sampled else logging.DEBUG,
+            "conversation_finished",
+            conversation=conversation_id,
+            exchanges=len(messages) // 2,
+            tool_calls=tool_calls,
+            chars=chars,
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            log_event(
+                logging.DEBUG,
+                "conversation_messages",
+                conversation=conversation_id,
+                messages=[
+                    {"role": message.role.value, "text": (message.text or "")[:LOG_TEXT_CHARS]}
+                    for message in messages
+                ],
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_conversations": len(self._conversations),
+                "evicted_conversations": self.evicted,
+                "conversation_peak_kb": round(self.peak_chars / 1024, 1),
+            }
+
+
+def memory_usage(conversations: Optional[ConversationStore] = None) -> Dict[str, Any]:
+    """Memory figures at the end of a job. `conversation_peak_kb` (with `conversations`)
+    is the job's own; `process_peak_rss_mb` is the peak of the whole worker process so
+    far, all concurrent jobs included, to compare with the Lambda memory `limit_mb`"""
+    usage: Dict[str, Any] = {"process_peak_rss_mb": process_peak_rss_mb()}
+    limit = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if limit:
+        usage["limit_mb"] = int(limit)
+    if conversations is not None:
+        usage.update(conversations.stats())
+    return usage
@@ -0,0 +1,186 @@
+"""Shared embedding service of the process.
+
+The fields of a fiche are generated in parallel, and each local document search
+embeds one query. Instead of running the model once per query, `EmbeddingService`
+collects the requests arriving within a short window (EMBEDDING_BATCH_WINDOW_MS) and
+embeds them in one batch, which is several times faster on CPU. Query embeddings are
+kept in an LRU cache keyed by the normalised text, and concurrent requests for the
+same text share one computation.
+
+`get_embedding_service()` loads the SentenceTransformers model once per process; the
+RAG pipeline, the local document search and the ingestion all use it.
+"""
+import functools
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from haystack import Document, component
+
+from .vector_index import EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise_text(text: str) -> str:
+    """Cache key of a text: the embedding model is uncased and ignores spacing"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().lower()
+
+
+class EmbeddingService:
+    """Micro-batching, caching front of an embedding function.
+
+    Args:
+        embed_batch: Returns the embeddings of a list of texts
+        max_batch: Texts embedded per call to `embed_batch`
+        window: Seconds to wait for more requests after the first one of a batch
+        cache_size: Query embeddings kept in the LRU cache
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Sequence[Sequence[float]]],
+        max_batch: int = EMBEDDING_MAX_BATCH,
+        window: float = EMBEDDING_BATCH_WINDOW_MS / 1000,
+        cache_size: int = EMBEDDING_CACHE_SIZE,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch = max_batch
+        self.window = window
+        self.cache_size = cache_size
+        self.stats = {"requests": 0, "cache_hits": 0, "batches": 0, "embedded": 0}
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._embed(batch)
+
+    def _embed(self, batch: List[Tuple[str, Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            vectors = [list(map(float, vector)) for vector in self.embed_batch(texts)]
+        except Exception as e:
+            logger.warning(f"Embedding batch of {len(texts)} texts failed: {type(e).__name__}: {e}")
+            for text, future in batch:
+                self._finish(text)
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["embedded"] += len(texts)
+        for (text, future), vector in zip(batch, vectors):
+            self._finish(text, vector)
+            future.set_result(vector)
+
+    def _finish(self, key: str, vector: Optional[List[float]] = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            if vector is not None and self.cache_size > 0:
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def submit(self, text: str) -> "Future[List[float]]":
+        """Request the embedding of a text, answered from the cache or the next batch"""
+        key = normalise_text(text)
+        with self._lock:
+            self.stats["requests"] += 1
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                future: Future = Future()
+                future.set_result(self._cache[key])
+                return future
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["cache_hits"] += 1
+                return future
+            future = self._inflight[key] = Future()
+        self._start()
+        self._queue.put((key, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Embedding of a query"""
+        return self.submit(text).result()
+
+    def embed_many(self, texts: Sequence[str], cache: bool = True) -> List[List[float]]:
+        """Embeddings of several texts. With `cache=False` (e.g. documents being
+        ingested) the texts are embedded directly in batches, bypassing the cache"""
+        if cache:
+            futures = [self.submit(text) for text in texts]
+            return [future.result() for future in futures]
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.max_batch):
+            vectors.extend(list(map(float, vector)) for vector in self.embed_batch(list(texts[start:start + self.max_batch])))
+        return vectors
+
+
+def sentence_transformers_batch_embedder(model: str = EMBEDDING_MODEL) -> Callable[[List[str]], List[List[float]]]:
+    """Batch embedding function over SentenceTransformersDocumentEmbedder, loaded on first use"""
+    from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+
+    embedder = SentenceTransformersDocumentEmbedder(model=model, batch_size=EMBEDDING_MAX_BATCH, progress_bar=False)
+    warm_up_lock = threading.Lock()
+
+    def embed_batch(texts: List[str]) -> List[List[float]]:
+        with warm_up_lock:
+            embedder.warm_up()
+        documents = embedder.run(documents=[Document(content=text) for text in texts])["documents"]
+        return [document.embedding for document in documents]
+
+    return embed_batch
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_service(model: str = EMBEDDING_MODEL) -> EmbeddingService:
+    """The embedding service of the process for a model (the model is loaded once)"""
+    return EmbeddingService(sentence_transformers_batch_embedder(model))
+
+
+@component
+class ServiceTextEmbedder:
+    """Haystack text embedder backed by the shared embedding service, in place of
+    SentenceTransformersTextEmbedder"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+
+    @component.output_types(embedding=List[float])
+    def run(self, text: str):
+        return {"embedding": get_embedding_service(self.model).embed(text)}
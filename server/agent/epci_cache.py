@@ -0,0 +1,125 @@
+"""EPCI-level results shared by the fiches of the communes of a same EPCI.
+
+The `inter_municipality` parts of a fiche (summary, projects, budget and the EPCI
+finances) only depend on the EPCI and the template, so they are computed once per
+`(inter_municipality_code, template version)` and reused by the other communes while
+they are fresher than the TTL.
+
+Results are kept in memory and, when a blob store is given (S3 or the local
+filesystem, see api/backends), persisted so other workers reuse them too. Within a
+process, concurrent fiches of the same EPCI are single-flighted: the first computes a
+section and the others wait for it.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How long EPCI results are reused (the EPCI data changes slowly)
+EPCI_CACHE_TTL_SECONDS = int(os.getenv("EPCI_CACHE_TTL_SECONDS", str(7 * 86400)))
+
+
+class EPCIResultStore:
+    """Per-EPCI section results with a TTL, single-flight and optional persistence.
+
+    Args:
+        template_version: Results of other template versions are never reused
+        blobs: Optional object with `get(key)` and `put(key, body, content_type)`
+            (an api.backends BlobStore) used to share results between workers
+        ttl: Seconds during which a result is reused
+    """
+
+    def __init__(self, template_version: str, blobs: Any = None, ttl: int = EPCI_CACHE_TTL_SECONDS):
+        self.template_version = template_version
+        self.blobs = blobs
+        self.ttl = ttl
+        # key -> (created_at, value)
+        self._memory: Dict[str, Tuple[float, Any]] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, epci_code: str, section: str) -> str:
+        return f"epci/{self.template_version}/{epci_code}/{section}.json"
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl
+
+    def _load(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and self._is_fresh(entry[0]):
+            return entry[1]
+        if self.blobs is None:
+            return None
+
+        try:
+            body = self.blobs.get(key)
+        except Exception as e:
+            logger.warning(f"Could not read EPCI result {key}: {e}")
+            return None
+        if body is None:
+            return None
+        stored = json.loads(body)
+        if not self._is_fresh(stored["created_at"]):
+            return None
+        with self._lock:
+            self._memory[key] = (stored["created_at"], stored["value"])
+        return stored["value"]
+
+    def _save(self, key: str, value: Any) -> Any:
+        """Store a copy of `value` (safe from later changes by the caller) and return it"""
+        created_at = time.time()
+        stored = copy.deepcopy(value)
+        with self._lock:
+            self._memory[key] = (created_at, stored)
+        if self.blobs is None:
+            return stored
+        try:
+            body = json.dumps({"created_at": created_at, "value": value}, ensure_ascii=False)
+            self.blobs.put(key, body.encode("utf-8"), content_type="application/json")
+        except Exception as e:
+            logger.warning(f"Could not persist EPCI result {key}: {e}")
+        return stored
+
+    def get_or_compute(
+        self,
+        epci_code: str,
+        section: str,
+        compute: Callable[[], Any],
+        cache_if: Callable[[Any], bool] = lambda value: True,
+    ) -> Tuple[Any, bool]:
+        """Return the section result of the EPCI and whether it was reused.
+
+        `compute` must return a JSON-serialisable value. Callers get their own copy.
+        A failing `compute` is not cached and its error is raised to all the waiters;
+        results rejected by `cache_if` (e.g. empty ones) are only shared with the waiters.
+        """
+        key = self._key(epci_code, section)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return copy.deepcopy(future.result()), True
+
+        try:
+            shared = self._load(key)
+            reused = shared is not None
+            if not reused:
+                value = compute()
+                shared = self._save(key, value) if cache_if(value) else copy.deepcopy(value)
+            future.set_result(shared)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return copy.deepcopy(shared), reused
@@ -0,0 +1,120 @@
+"""Local gazetteer of stable administrative facts (area, postal code, coordinates).
+
+Such facts barely change, yet asking the tool agent for them costs an LLM call and a
+Perplexity search per commune. The gazetteer loads them from the CSV files of
+GAZETTEER_DIR into a compact table indexed by SIREN and INSEE code. The orchestrator
+fills the matching fields from it before scheduling any LLM work, and only asks the
+agent when the gazetteer has no value.
+
+The CSV files have a `siren` column and optionally `insee`, `name`, `area_km2`,
+`postal_code`, `latitude` and `longitude`. Communes and EPCIs (keyed by the SIREN of the
+EPCI) can be in the same or separate files; later files override earlier rows.
+"""
+import functools
+import glob
+import logging
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_DIR = os.getenv("GAZETTEER_DIR", os.path.join(os.path.dirname(__file__), "gazetteer"))
+
+CODE_COLUMNS = ["siren", "insee"]
+TEXT_COLUMNS = ["name", "postal_code"]
+NUMERIC_COLUMNS = ["area_km2", "latitude", "longitude"]
+
+
+def _format_decimal(value: float, decimals: int) -> str:
+    return f"{value:.{decimals}f}".replace(".", ",")
+
+
+# Template field -> (gazetteer column, formatting of the value as the fiche expects it)
+GAZETTEER_FIELDS: Dict[str, Tuple[str, Callable[[Any], str]]] = {
+    "area": ("area_km2", lambda value: _format_decimal(value, 2) + " km2"),
+    "postal_code": ("postal_code", str),
+    "latitude": ("latitude", lambda value: _format_decimal(value, 5)),
+    "longitude": ("longitude", lambda value: _format_decimal(value, 5)),
+}
+
+
+class Gazetteer:
+    """Facts of the communes and EPCIs, looked up by SIREN or INSEE code.
+
+    Args:
+        table: One row per entity with a `siren` column and any of the fact columns
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        table = table.reset_index(drop=True)
+        # Column arrays: float32 for the numbers (NaN when unknown), objects for the texts
+        self._columns: Dict[str, np.ndarray] = {}
+        for column in NUMERIC_COLUMNS:
+            if column in table:
+                self._columns[column] = pd.to_numeric(table[column], errors="coerce").to_numpy(np.float32)
+        for column in TEXT_COLUMNS:
+            if column in table:
+                self._columns[column] = table[column].to_numpy(object)
+
+        self._index: Dict[str, int] = {}
+        for column in CODE_COLUMNS:
+            if column in table:
+                for position, code in enumerate(table[column].tolist()):
+                    if isinstance(code, str) and code.strip():
+                        self._index[code.strip()] = position
+        self._size = len(table)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get(self, code: Any, column: str) -> Optional[Any]:
+        """Value of a column for the entity with this SIREN or INSEE code, None if unknown"""
+        position = self._index.get(str(code).strip())
+        values = self._columns.get(column)
+        if position is None or values is None:
+            return None
+        value = values[position]
+        if isinstance(value, np.floating):
+            return None if np.isnan(value) else float(value)
+        if value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == "":
+            return None
+        return str(value).strip()
+
+    def resolve(self, code: Any, field: str) -> Optional[str]:
+        """Content of a template field for the entity, formatted like the LLM answers,
+        or None when the gazetteer doesn't know it"""
+        if field not in GAZETTEER_FIELDS:
+            return None
+        column, format_value = GAZETTEER_FIELDS[field]
+        value = self.get(code, column)
+        return None if value is None else format_value(value)
+
+
+def load_gazetteer(directory: str = GAZETTEER_DIR) -> Gazetteer:
+    """Load the CSV files of a directory (an empty gazetteer without any)"""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.csv"))):
+        try:
+            frames.append(pd.read_csv(path, dtype={column: str for column in CODE_COLUMNS + TEXT_COLUMNS}))
+        except Exception as e:
+            logger.warning(f"Skipping gazetteer file {path}: {type(e).__name__}: {e}")
+    if not frames:
+        return Gazetteer(pd.DataFrame(columns=CODE_COLUMNS))
+
+    table = pd.concat(frames, ignore_index=True)
+    if "siren" in table:
+        # Later files override earlier rows column by column: the last known value wins
+        merged = table[table["siren"].notna()].groupby("siren", sort=False).last().reset_index()
+        table = pd.concat([merged, table[table["siren"].isna()]], ignore_index=True)
+    gazetteer = Gazetteer(table)
+    logger.info(f"Gazetteer loaded: {len(gazetteer)} entities from {len(frames)} files")
+    return gazetteer
+
+
+@functools.lru_cache(maxsize=None)
+def get_gazetteer(directory: str = GAZETTEER_DIR) -> Gazetteer:
+    """The gazetteer of the process, loaded once"""
+    return load_gazetteer(directory)
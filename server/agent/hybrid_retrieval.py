@@ -0,0 +1,203 @@
+"""Hybrid retrieval over the RAG index: BM25 and embeddings fused by reciprocal rank.
+
+Budget documents are full of exact terms (account names, amounts, years) that keyword
+search finds better than embeddings, while embeddings catch paraphrases. The
+`HybridRetriever` ranks the documents with both and fuses the rankings with
+reciprocal-rank fusion (RRF): each document scores sum(1 / (rrf_k + rank)) over the
+rankings it appears in.
+
+Both searches are restricted to the documents matching the metadata filters (e.g. the
+SIRENs of the commune and of its EPCI) before scoring, so the results never mix
+communes and no prompt tokens are spent on other cities.
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from haystack import Document, component
+
+from .embedding_service import get_embedding_service
+from .vector_index import EMBEDDING_MODEL, METADATA_FILE, RAG_INDEX_DIR, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words without accents ("Épargne" and "epargne" match)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [token for token in _TOKEN_PATTERN.findall(text) if len(token) > 1]
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring.
+
+    Args:
+        texts: Text of each row of the vector index, "" for deleted rows
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[position] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[position] = counts.get(position, 0) + 1
+
+        self.size = len(texts)
+        documents = max(1, int((lengths > 0).sum()))
+        average_length = float(lengths.sum()) / documents or 1.0
+        # Length normalisation of the BM25 denominator, per row
+        self._norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        self._postings = {
+            token: (
+                np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)),
+                np.fromiter(counts.values(), dtype=np.float32, count=len(counts)),
+                float(np.log(1 + (documents - len(counts) + 0.5) / (len(counts) + 0.5))),
+            )
+            for token, counts in postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for the query (0 for the rows without any query term)"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token not in self._postings:
+                continue
+            positions, frequencies, idf = self._postings[token]
+            scores[positions] += idf * frequencies * (self.k1 + 1) / (frequencies + self._norms[positions])
+        return scores
+
+
+def _top(scores: np.ndarray, candidates: np.ndarray, limit: int) -> np.ndarray:
+    """Candidates with the `limit` best scores, best first"""
+    if len(candidates) == 0:
+        return candidates
+    limit = min(limit, len(candidates))
+    best = np.argpartition(-scores[candidates], limit - 1)[:limit]
+    return candidates[best[np.argsort(-scores[candidates][best])]]
+
+
+@component
+class HybridRetriever:
+    """BM25 + embedding retriever over a `VectorIndex`, with metadata pre-filtering.
+
+    Args:
+        index: Index of the documents (its contents feed the BM25 index)
+        embed_query: Embeds a query when no embedding is given to `run`
+        top_k: Number of documents returned
+        candidates: Length of each ranking before fusion
+        rrf_k: RRF constant, the larger the flatter the fusion
+        min_similarity: Embedding matches below this cosine similarity are ignored
+        min_bm25: Keyword matches below this BM25 score are ignored
+    """
+
+    def __init__(
+        self,
+        index: VectorIndex,
+        embed_query: Optional[Callable[[str], Sequence[float]]] = None,
+        top_k: int = 5,
+        candidates: int = 50,
+        rrf_k: int = 60,
+        min_similarity: Optional[float] = None,
+        min_bm25: Optional[float] = None,
+    ):
+        self.index = index
+        self.embed_query = embed_query
+        self.top_k = top_k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.min_similarity = min_similarity
+        self.min_bm25 = min_bm25
+        self._bm25: Optional[BM25Index] = None
+        self._bm25_rows: Optional[List[Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+
+    def _bm25_index(self) -> BM25Index:
+        """The BM25 index of the current rows, rebuilt when the index changed"""
+        self.index.refresh()
+        with self._lock:
+            rows = self.index._rows
+            if self._bm25 is None or self._bm25_rows is not rows:
+                self._bm25 = BM25Index([
+                    "" if row.get("deleted") else (row["content"] or "") for row in rows
+                ])
+                self._bm25_rows = rows
+            return self._bm25
+
+    def retrieve(
+        self,
+        query: str,
+        query_embedding: Optional[Sequence[float]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        top_k: Optional[int] = None,
+    ) -> List[Document]:
+        """Return the best documents for the query, scored by RRF"""
+        top_k = top_k or self.top_k
+        bm25 = self._bm25_index()
+        mask = self.index.filter_mask(filters)
+        if not mask.any():
+            return []
+
+        rankings = []
+        keyword_scores = bm25.scores(query)[: len(mask)]
+        keyword_mask = mask[: len(keyword_scores)] & (keyword_scores > 0)
+        if self.min_bm25 is not None:
+            keyword_mask &= keyword_scores >= self.min_bm25
+        rankings.append(_top(keyword_scores, np.flatnonzero(keyword_mask), self.candidates))
+
+        if query_embedding is None and self.embed_query is not None:
+            query_embedding = self.embed_query(query)
+        if query_embedding is not None:
+            positions, similarities = self.index.search_positions(
+                query_embedding, top_k=self.candidates, mask=mask
+            )
+            if self.min_similarity is not None:
+                positions = positions[similarities >= self.min_similarity]
+            rankings.append(positions)
+
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, position in enumerate(ranking.tolist()):
+                fused[position] = fused.get(position, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [self.index.document(position, score) for position, score in best]
+
+    @component.output_types(documents=List[Document])
+    def run(
+        self,
+        query: str,
+        query_embedding: Optional[List[float]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        top_k: Optional[int] = None,
+    ):
+        return {"documents": self.retrieve(query, query_embedding, filters, top_k)}
+
+
+def sentence_transformers_query_embedder(model: str = EMBEDDING_MODEL) -> Callable[[str], List[float]]:
+    """Query embedding function over the shared embedding service (batched and cached)"""
+    return get_embedding_service(model).embed
+
+
+@functools.lru_cache(maxsize=None)
+def get_local_retriever(index_dir: str = RAG_INDEX_DIR) -> Optional[HybridRetriever]:
+    """The retriever over the local documents of the process, None without an index"""
+    metadata_path = os.path.join(index_dir, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, "r", encoding="utf-8") as file:
+        if not json.load(file)["rows"]:
+            return None
+    return HybridRetriever(VectorIndex(index_dir), embed_query=sentence_transformers_query_embedder())
@@ -0,0 +1,330 @@
+"""Ingest the budget documents of the communes (comptes administratifs, ROB/DOB...) into
+the RAG index.
+
+Example (from the server directory):
+    python -m agent.ingestion documents/ --workers 8
+
+The source directory holds one sub-directory per commune (named after its SIREN) with
+its PDF and HTML documents. The documents are parsed and chunked in a process pool,
+page by page with generators, and each worker spools its chunks to a JSONL file
+instead of returning them. The main process streams the spooled chunks and embeds
+them in batches. Embeddings are cached by chunk hash in `embeddings.sqlite` next to the
+index, so unchanged or duplicated chunks are never embedded twice. Memory stays
+bounded by the page being parsed, the chunk batch and the pending index upsert
+(`flush_size` chunks), whatever the number and size of the documents.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from haystack import Document
+
+from .embedding_service import get_embedding_service
+from .vector_index import EMBEDDING_DIM, EMBEDDING_MODEL, RAG_INDEX_DIR, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {".pdf", ".html", ".htm"}
+
+# Chunks of CHUNK_WORDS words, consecutive chunks sharing CHUNK_OVERLAP words
+CHUNK_WORDS = int(os.getenv("INGESTION_CHUNK_WORDS", "200"))
+CHUNK_OVERLAP = int(os.getenv("INGESTION_CHUNK_OVERLAP", "30"))
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", str(os.cpu_count() or 2)))
+
+HTML_READ_SIZE = 64 * 1024
+
+# A text block and the page it comes from (None for HTML)
+Block = Tuple[Optional[int], str]
+
+
+def iter_source_files(root: str) -> Iterator[Tuple[str, str]]:
+    """Yield the (commune SIREN, path) of the documents of the source directory"""
+    for commune in sorted(os.listdir(root)):
+        commune_dir = os.path.join(root, commune)
+        if not os.path.isdir(commune_dir):
+            continue
+        for directory, _, files in os.walk(commune_dir):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                    yield commune, os.path.join(directory, name)
+
+
+def iter_pdf_pages(path: str) -> Iterator[Block]:
+    """Yield the text of each page of a PDF, one page in memory at a time"""
+    # Imported here so that only the PDF ingestion pays for loading pypdf
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document fed piece by piece"""
+
+    SKIPPED_TAGS = {"script", "style", "noscript", "template"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+    def take(self) -> str:
+        text, self.parts = " ".join(self.parts), []
+        return text
+
+
+def iter_html_text(path: str) -> Iterator[Block]:
+    """Yield the visible text of an HTML document as it is read"""
+    extractor = _TextExtractor()
+    rest = ""
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        while True:
+            data = file.read(HTML_READ_SIZE)
+            if not data:
+                break
+            # Only feed up to the last tag so that no word is cut between two reads
+            data = rest + data
+            end = data.rfind(">") + 1
+            rest = data[end:]
+            extractor.feed(data[:end])
+            yield None, extractor.take()
+    extractor.feed(rest)
+    extractor.close()
+    yield None, extractor.take()
+
+
+def iter_blocks(path: str) -> Iterator[Block]:
+    if path.lower().endswith(".pdf"):
+        return iter_pdf_pages(path)
+    return iter_html_text(path)
+
+
+def iter_chunks(
+    blocks: Iterable[Block], chunk_words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP
+) -> Iterator[Tuple[Optional[int], str]]:
+    """Split a stream of text blocks into overlapping chunks of words.
+
+    Yields the page where each chunk starts and its text. Only the words of the
+    current chunk are kept in memory.
+    """
+    if not 0 <= overlap < chunk_words:
+        raise ValueError("The overlap must be smaller than the chunk size")
+    window: deque = deque()  # (page, word)
+    emitted = 0  # words of the window already in an emitted chunk
+
+    for page, text in blocks:
+        for word in text.split():
+            window.append((page, word))
+            if len(window) == chunk_words:
+                yield window[0][0], " ".join(word for _, word in window)
+                for _ in range(chunk_words - overlap):
+                    window.popleft()
+                emitted = len(window)
+    if len(window) > emitted:
+        yield window[0][0], " ".join(word for _, word in window)
+
+
+def chunk_hash(text: str, model: str = EMBEDDING_MODEL) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _spool_file(
+    commune: str, path: str, root: str, spool_dir: str, chunk_words: int, overlap: int
+) -> Tuple[str, int]:
+    """Parse and chunk one document into a JSONL spool file (runs in the process pool)"""
+    source = os.path.relpath(path, root)
+    spool_path = os.path.join(spool_dir, hashlib.sha1(source.encode("utf-8")).hexdigest() + ".jsonl")
+    count = 0
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for page, text in iter_chunks(iter_blocks(path), chunk_words, overlap):
+            chunk = {
+                "id": f"{source}#{count}",
+                "content": text,
+                "meta": {"siren": commune, "source": source, "page": page, "chunk": count},
+            }
+            spool.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            count += 1
+    return spool_path, count
+
+
+class EmbeddingCache:
+    """Embeddings by chunk hash, persisted in SQLite"""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB)")
+
+    def get_many(self, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        # Stay under SQLite's limit on the number of query parameters
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self._connection.execute(
+                f"SELECT hash, vector FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                ((key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items),
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def sentence_transformers_embed(model: str = EMBEDDING_MODEL) -> Callable[[List[Document]], List[List[float]]]:
+    """Embedding function over the shared embedding service, whose model is loaded once
+    per process (the chunks bypass its query cache)"""
+    service = get_embedding_service(model)
+
+    def embed(documents: List[Document]) -> List[List[float]]:
+        return service.embed_many([document.content for document in documents], cache=False)
+
+    return embed
+
+
+class IngestionPipeline:
+    """Parses, chunks, embeds and indexes the documents of a source directory.
+
+    Args:
+        index: Index the chunks are written to
+        embed: Returns the embeddings of a batch of documents (SentenceTransformers by default)
+        cache: Embedding cache (`embeddings.sqlite` in the index directory by default)
+        workers: Size of the parsing process pool
+        batch_size: Chunks embedded per call to `embed`
+        flush_size: Chunks written to the index per upsert
+    """
+
+    def __init__(
+        self,
+        index: VectorIndex,
+        embed: Optional[Callable[[List[Document]], Sequence[Sequence[float]]]] = None,
+        cache: Optional[EmbeddingCache] = None,
+        workers: int = INGESTION_WORKERS,
+        batch_size: int = 64,
+        flush_size: int = 5000,
+        chunk_words: int = CHUNK_WORDS,
+        overlap: int = CHUNK_OVERLAP,
+        model: str = EMBEDDING_MODEL,
+    ):
+        self.index = index
+        self.embed = embed or sentence_transformers_embed(model)
+        self.cache = cache or EmbeddingCache(os.path.join(index.path, "embeddings.sqlite"))
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.flush_size = flush_size
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.model = model
+        self.stats = {"files": 0, "failed_files": 0, "chunks": 0, "embedded": 0, "cached": 0}
+
+    def _embed_with_cache(self, documents: List[Document]) -> np.ndarray:
+        """Embeddings of the documents, computing only the ones missing from the cache"""
+        hashes = [chunk_hash(document.content, self.model) for document in documents]
+        vectors = self.cache.get_many(list(dict.fromkeys(hashes)))
+        self.stats["cached"] += sum(1 for key in hashes if key in vectors)
+
+        missing: Dict[str, Document] = {}
+        for key, document in zip(hashes, documents):
+            if key not in vectors:
+                missing.setdefault(key, document)
+        keys, pending = list(missing), list(missing.values())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            computed = np.asarray(self.embed(batch), dtype=np.float32)
+            batch_keys = keys[start:start + self.batch_size]
+            self.cache.put_many(zip(batch_keys, computed))
+            vectors.update(zip(batch_keys, computed))
+            self.stats["embedded"] += len(batch)
+        return np.stack([vectors[key] for key in hashes])
+
+    def _flush(self, documents: List[Document]) -> None:
+        if documents:
+            self.index.upsert(documents, self._embed_with_cache)
+            documents.clear()
+
+    def run(self, root: str) -> Dict[str, int]:
+        """Ingest all the documents of the source directory and return statistics"""
+        pending: List[Document] = []
+        chunk_counts: Dict[str, int] = {}
+        with tempfile.TemporaryDirectory(prefix="ingestion-") as spool_dir, \
+                ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(_spool_file, commune, path, root, spool_dir, self.chunk_words, self.overlap): path
+                for commune, path in iter_source_files(root)
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    spool_path, count = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not parse {path}: {type(e).__name__}: {e}")
+                    self.stats["failed_files"] += 1
+                    continue
+
+                self.stats["files"] += 1
+                self.stats["chunks"] += count
+                chunk_counts[os.path.relpath(path, root)] = count
+                with open(spool_path, "r", encoding="utf-8") as spool:
+                    for line in spool:
+                        pending.append(Document(**json.loads(line)))
+                        if len(pending) >= self.flush_size:
+                            self._flush(pending)
+                os.remove(spool_path)
+            self._flush(pending)
+
+        # Chunks of documents that got shorter since their last ingestion
+        stale = []
+        for document_id in self.index.document_ids():
+            source, _, number = document_id.rpartition("#")
+            if source in chunk_counts and int(number) >= chunk_counts[source]:
+                stale.append(document_id)
+        if stale:
+            self.index.delete(stale)
+        return dict(self.stats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory with one sub-directory of documents per commune")
+    parser.add_argument("--index", default=RAG_INDEX_DIR, help="RAG index directory")
+    parser.add_argument("--workers", type=int, default=INGESTION_WORKERS, help="Parsing processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks embedded at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    pipeline = IngestionPipeline(
+        VectorIndex(args.index, dim=EMBEDDING_DIM), workers=args.workers, batch_size=args.batch_size
+    )
+    print("Summary:", json.dumps(pipeline.run(args.source)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
-# Imports
+# Imports (run from the server directory with `python -m agent.main`)
 from haystack.dataclasses import ChatMessage
 
-from agents import ToolCallingAgent
-from tools import get_sonar_pro_response
-from rag_pipeline import rag_pipeline_func
+from agent.agents import ToolCallingAgent
+from agent.tools import get_sonar_pro_response
+from agent.rag_pipeline import rag_pipeline_func
 
 Tool_Agent = ToolCallingAgent(functions=[get_sonar_pro_response, rag_pipeline_func])  # Can define name and special instructions & tools for every agent
 
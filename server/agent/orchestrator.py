@@ -1,51 +1,41 @@
-import json
 import inspect
-import os
-from typing import List, Dict, Any
+import logging
+import uuid
+from contextlib import contextmanager
+from typing import Callable, FrozenSet, List, Dict, Any, Optional
 from haystack.dataclasses import ChatMessage, ChatRole
 from .agents import Agent, ToolCallingAgent
-from .tools import get_sonar_pro_response
+from .assets import get_asset_cache
+from .cassette import get_cassette
+from .conversations import ConversationStore, log_event, memory_usage
+from .epci_cache import EPCIResultStore
+from .gazetteer import get_gazetteer
+from .results import get_result_sink
+from .tracing import Tracer, current_span, in_context, span, traced
+from .usage import Budget, UsageMeter
+from .tools import get_sonar_pro_response, make_financial_aggregate_lookup, make_local_document_search
 from concurrent.futures import ThreadPoolExecutor
-from .prompt import (
-    tool_agent_instructions,
-    tool_agent_prompt,
-    contact_agent_prompt,
-    logo_agent_prompt,
-    budget_agent_prompt,
-    project_agent_prompt
+from .plan import (
+    DERIVED,
+    LLM,
+    OFGL,
+    FieldTask,
+    get_field,
+    get_plan,
+    run_tasks,
+    set_field,
+)
+from .prompt import tool_agent_instructions, validation_reask_prompt
+from .routing import FAST, STRONG, choose_tier, escalation_reason
+from .validation import STRING, UNKNOWN_ANSWER, answer_kind, is_unknown, validate_answer
+from .util import (
+    finance_series_to_dict,
+    get_commune_finances_by_siren,
+    get_commune_finances_series,
+    get_epci_finances_series,
 )
-from .util import get_commune_finances_by_siren, get_epci_finances_by_code
-
-summary_fields = [
-    "population",
-    "data_from_year",
-    "total_budget",
-    "total_budget_per_person",
-    "debt_repayment_capacity",
-    "debt_ratio",
-    "debt_duration",
-]
-financial_data_fields = [
-    "management_savings_per_capita",
-    "gross_savings_per_capita",
-    "net_savings_per_capita",
-    "management_savings_ratio",
-    "gross_savings_ratio",
-    "net_savings_ratio",
-    "debt_service_to_operating_revenue_ratio",
-]
-comparitive_fields = [
-    "municipality",
-    "inter_municipality",
-    "population",
-    "data_from_year",
-    "total_budget",
-    "total_budget_per_person",
-    "debt_repayment_capacity",
-    "debt_ratio",
-    "debt_duration",
-]
 
+logger = logging.getLogger(__name__)
 
 # def get_all_tools():
 #     """Get all functions marked as tools from tools module"""
@@ -54,18 +44,22 @@ comparitive_fields = [
 #             if inspect.isfunction(obj) and hasattr(obj, '_is_tool')]
 
 class Orchestrator:
-    def __init__(self, city_info):
-        # Initialize different types of agents
-        self.simple_agent = Agent()
-        self.tool_agent = ToolCallingAgent(
-            instructions=tool_agent_instructions,
-            functions=[get_sonar_pro_response]) #get_all_tools())
-
-        # Store conversation history
-        self.conversation_history: Dict[str, List[ChatMessage]] = {}
-
-        # Load data from data.json
-        self.data = self._load_data_fields()
+    def __init__(
+        self,
+        city_info,
+        job_id=None,
+        budget: Optional[Budget] = None,
+        epci_store: Optional[EPCIResultStore] = None,
+    ):
+        # Spans of this fiche (sections, fields, LLM/tool/OFGL calls)
+        self.tracer = Tracer(job_id)
+        # Tokens, tool calls and cost of this fiche, with an optional budget
+        self.usage = UsageMeter(budget if budget is not None else Budget.from_env())
+        # inter_municipality results shared with the other communes of the EPCI (optional)
+        self.epci_store = epci_store
+        # Key of the stored fiche data (see results.py), unique when there is no job
+        self.result_id = job_id or f"local-{uuid.uuid4().hex}"
+        self.result_future = None
 
         self.municipality_name = city_info.municipality_name
         self.inter_municipality_name = city_info.inter_municipality_name
@@ -73,19 +67,53 @@ class Orchestrator:
         self.inter_municipality_epci = city_info.inter_municipality_code
         self.reference_sirens = city_info.reference_sirens
 
-        self.financial_api_data = self._get_numeric_api_data()
+        # Open conversations, reduced to their questions and answers (see conversations.py)
+        self.conversation_history = ConversationStore()
+
+        # Tasks compiled from data_template.json and the empty fiche data of this job
+        self.plan = get_plan()
+        self.data = self.plan.new_data()
+        # Fields already filled from the local gazetteer, never asked to the LLM
+        self.gazetteer_task_ids = self._resolve_gazetteer_fields()
+
+        # Keep the inputs with a recording so the fiche can be replayed later
+        cassette = get_cassette()
+        if cassette is not None and cassette.mode == "record":
+            cassette.annotate(city_info={
+                "siren": self.municipality_siren,
+                "municipality_name": self.municipality_name,
+                "inter_municipality_name": self.inter_municipality_name,
+                "inter_municipality_code": self.inter_municipality_epci,
+                "reference_sirens": list(self.reference_sirens),
+            })
+
+        with self._activate(), span("ofgl_prefetch", "section"):
+            self.financial_api_data = self._get_numeric_api_data()
+
+        # Initialize different types of agents. The OFGL aggregates prefetched above are
+        # answered locally, and the local documents of the commune and its EPCI are
+        # searchable when the RAG index has some
+        functions = [get_sonar_pro_response]
+        financial_aggregate_lookup = make_financial_aggregate_lookup({
+            name: self.financial_api_data[name].get("aggregates")
+            for name in (self.municipality_name, self.inter_municipality_name)
+        })
+        if financial_aggregate_lookup is not None:
+            functions.append(financial_aggregate_lookup)
+        local_document_search = make_local_document_search(
+            [self.municipality_siren, self.inter_municipality_epci])
+        if local_document_search is not None:
+            functions.append(local_document_search)
+        self.simple_agent = Agent()
+        self.tool_agent = ToolCallingAgent(
+            instructions=tool_agent_instructions,
+            functions=functions) #get_all_tools())
 
-    def _load_data_fields(self) -> Dict[str, Any]:
-        """Load data from data_template.json file"""
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            file_path = os.path.join(current_dir, 'data_template.json')
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        except FileNotFoundError:
-            raise FileNotFoundError(
-                "data_template.json not found in the agent directory"
-            )
+    @contextmanager
+    def _activate(self):
+        """Make the tracer and usage meter of this fiche current for the block"""
+        with self.tracer.activate(), self.usage.activate():
+            yield
 
     # def _get_municipality_name(self):
     #     """Get the input from the user"""
@@ -115,10 +143,21 @@ class Orchestrator:
         {"Dijon": {"population": 159346, "data_from_year": 2023, "total_budget": 110000000, "total_budget_per_person": 679, "debt_repayment_capacity": 3.4, "debt_ratio": 0.5, "debt_duration": 10},
         "Dijon Métropole": {"population": 159346, "data_from_year": 2023, "total_budget": 110000000, "total_budget_per_person": 679, "debt_repayment_capacity": 3.4, "debt_ratio": 0.5, "debt_duration": 10}}
         """
-        _, _, municipality_finances = get_commune_finances_by_siren(
-            self.municipality_siren)
-        _, _, epci_finances = get_epci_finances_by_code(
-            self.inter_municipality_epci)
+        # The municipality and EPCI metrics come with their yearly trend and every OFGL
+        # aggregate (for the financial aggregate tool) in a single request
+        municipality_finances = self._finances_with_trend(
+            get_commune_finances_series(self.municipality_siren, with_aggregates=True))
+        if self.epci_store is None:
+            epci_finances = self._finances_with_trend(
+                get_epci_finances_series(self.inter_municipality_epci, with_aggregates=True))
+        else:
+            epci_finances, _ = self.epci_store.get_or_compute(
+                self.inter_municipality_epci,
+                "finances",
+                lambda: self._finances_with_trend(
+                    get_epci_finances_series(self.inter_municipality_epci, with_aggregates=True)),
+                cache_if=bool,
+            )
 
         reference_finances = []
         for siren in self.reference_sirens:
@@ -131,6 +170,28 @@ class Orchestrator:
             "reference_finances": reference_finances,
         }
 
+    @staticmethod
+    def _finances_with_trend(series) -> Dict[str, Any]:
+        """Metrics of the latest year, with their compact year x metric series under "trend" """
+        values, deltas, finances = series
+        if finances:
+            finances["trend"] = finance_series_to_dict(values, deltas)
+        return finances
+
+    def _resolve_gazetteer_fields(self) -> FrozenSet[int]:
+        """Fill the fields the local gazetteer knows and return the ids of their tasks"""
+        gazetteer = get_gazetteer()
+        codes = {"municipality": self.municipality_siren, "inter_municipality": self.inter_municipality_epci}
+        resolved = set()
+        for task in self.plan.tasks:
+            if task.gazetteer_field is None or task.identifier not in codes:
+                continue
+            content = gazetteer.resolve(codes[task.identifier], task.gazetteer_field)
+            if content is not None:
+                set_field(self.data, task.path, content)
+                resolved.add(task.id)
+        return frozenset(resolved)
+
     def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
         """Get the conversation history in a serializable format"""
 
@@ -146,473 +207,236 @@ class Orchestrator:
             for msg in self.conversation_history[conversation_id]
         ]
 
-    def process_logo_field(self) -> None:
-        conversation_id = "logo_retrieval"
-        if conversation_id not in self.conversation_history:
-            self.conversation_history[conversation_id] = []
-        # Create a prompt based on the field and append it to the messages
-        prompt = logo_agent_prompt.format(name=self.municipality_name)
-        self.conversation_history[conversation_id].append(
-            ChatMessage.from_user(prompt))
-        # print(self.conversation_history[conversation_id][-1])
-
-        # Get response from agent and extend the conversation history with the response
-        try:
-            response = self.tool_agent.run(
-                self.conversation_history[conversation_id])
-            self.conversation_history[conversation_id].extend(response)
-        except:
-            print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-        # print(self.conversation_history[conversation_id][-1])
-
-        # We call the agent again to get the final reply after the tool executions
-        final_reply = self.tool_agent.run(
-            self.conversation_history[conversation_id])
-        self.conversation_history[conversation_id].extend(final_reply)
-        # print(self.conversation_history[conversation_id][-1])
-
-        # Store the response
-        self.data["logo"]["content"] = (
-            self.conversation_history[conversation_id][-1].text
-            if final_reply
-            else "unknown"
-        )
-
-        print("--------------------------------")
-        print(self.conversation_history[conversation_id])
-        print("--------------------------------")
+    def _ask_agent(
+        self,
+        conversation_id: str,
+        prompt: str,
+        field: str,
+        priority: Optional[str] = None,
+        kind: str = STRING,
+        complex_field: bool = False,
+    ) -> str:
+        """Ask the tool agent a question in the given conversation and return its answer.
+
+        The question goes to the fast model unless the field is complex, and is asked
+        again to the strong model when the fast answer is unknown, fails the validation
+        of its kind or failed (see routing.py). Fields with priority "low" are answered
+        "inconnu" without calling the agent once the budget is exhausted.
+        """
+        messages = self.conversation_history.open(conversation_id)
+
+        with span(field, "field", conversation=conversation_id) as field_span:
+            if priority == "low" and self.usage.exhausted():
+                self.usage.record_skipped_field()
+                field_span.set_attribute("skipped", "budget")
+                return "inconnu"
+
+            tier = choose_tier(complex_field, self.tool_agent.has_fast_model)
+            start = len(messages)
+            answer = self._exchange(messages, prompt, field, fast=tier == FAST)
+            escalation = escalation_reason(answer, kind) if tier == FAST else None
+            if escalation is not None:
+                # The fast exchange is replaced by the strong model's
+                del messages[start:]
+                tier = STRONG
+                answer = self._exchange(messages, prompt, field, fast=False)
+                field_span.set_attribute("escalation", escalation)
+            field_span.set_attribute("model_tier", tier)
+            self.usage.record_route(tier, escalation)
+
+            if answer is None:
+                return "unknown"
+            # The tool calls and results of the exchange are no longer needed
+            self.conversation_history.compact(conversation_id, start, answer)
+            field_span.set_attribute("answer_length", len(answer))
+        return answer
+
+    def _exchange(self, messages: List[ChatMessage], prompt: str, field: str, fast: bool) -> Optional[str]:
+        """Append the question and the agent's replies to the conversation and return
+        the final answer, or None when the agent call failed.
+
+        The agent is called a second time when its first reply was a tool call, so
+        that it answers from the tool results.
+        """
+        # Append the prompt to the conversation
+        start = len(messages)
+        messages.append(ChatMessage.from_user(prompt))
 
-        return ""
+        # Get response from agent and extend the conversation history with the response.
+        # Throttling is retried by the Bedrock limiter, so an error here is final for
+        # this exchange: it is dropped to keep the conversation valid.
+        try:
+            response = self.tool_agent.run(messages, fast=fast)
+            messages.extend(response)
 
-    def process_summary_fields(self, inter=False) -> None:
-        """Process fields from the summary section"""
-        if inter:
-            identifier = "inter_municipality"
-            name = self.inter_municipality_name
+            # We call the agent again to get the final reply after the tool execution
+            if messages[-1].role != ChatRole.ASSISTANT:
+                final_reply = self.tool_agent.run(messages, fast=fast)
+                messages.extend(final_reply)
+        except Exception as e:
+            logger.warning(f"Agent call failed for {field}: {type(e).__name__}: {e}")
+            current_span().set_attribute("error", f"{type(e).__name__}: {e}")
+            del messages[start:]
+            return None
+
+        return messages[-1].text or "unknown"
+
+    def _execute_task(self, task: FieldTask) -> None:
+        """Fill one field of the fiche from its source"""
+        if task.source == DERIVED:
+            content = {
+                "municipality_name": self.municipality_name,
+                "inter_municipality_name": self.inter_municipality_name,
+            }[task.input_key]
+        elif task.source == OFGL:
+            if task.ofgl_entity == "reference":
+                content = self.financial_api_data["reference_finances"][task.ofgl_index][task.ofgl_key]
+            else:
+                content = self.financial_api_data[self._names[task.ofgl_entity]][task.ofgl_key]
         else:
-            identifier = "municipality"
-            name = self.municipality_name
-
-        fields = self.data["summary"][identifier]
+            logger.debug(f"Field: {task.name}")
+            prompt = task.render_prompt(self._names)
+            kind = answer_kind(task.name, task.field_type)
+            answer = self._ask_agent(
+                task.conversation_id, prompt, task.name, task.priority, kind, task.complex)
+            content = self._validated(task, kind, answer)
+            if task.ends_conversation:
+                self.conversation_history.close(task.conversation_id)
+        set_field(self.data, task.path, content)
+
+    def _validated(self, task: FieldTask, kind: str, answer: str) -> str:
+        """Normalised answer of a field. An invalid answer is asked once more to the
+        strong model, with the reason, and "inconnu" is kept if it is still invalid"""
+        validation = validate_answer(answer, kind)
+        if validation.ok:
+            return validation.value
+
+        logger.info(f"Invalid answer for {task.name} ({validation.error}), asking again")
+        prompt = validation_reask_prompt.format(answer=answer, error=validation.error)
+        answer = self._ask_agent(task.conversation_id, prompt, task.name, kind=kind, complex_field=True)
+        validation = validate_answer(answer, kind)
+        self.usage.record_reask(validation.ok)
+        return validation.value if validation.ok else UNKNOWN_ANSWER
+
+    @property
+    def _names(self) -> Dict[str, str]:
+        return {"municipality": self.municipality_name, "inter_municipality": self.inter_municipality_name}
+
+    def _run_section(self, section: str, identifier: Optional[str] = None, sources=(OFGL, LLM)) -> None:
+        tasks = [
+            task for task in self.plan.select(section, identifier, sources)
+            if task.id not in self.gazetteer_task_ids
+        ]
+        run_tasks(tasks, self._execute_task)
 
-        name_id = f"{identifier}_name"
-        self.data[name_id]["content"] = name
+    @traced("section")
+    def process_logo_field(self) -> None:
+        self._run_section("logo")
+        logo = self.data["logo"]["content"]
+        if isinstance(logo, str) and logo.startswith(("http://", "https://")):
+            # Downloaded while the other sections run, the rendering only reads the cache
+            get_asset_cache().prefetch(logo)
+            current_span().set_attribute("logo_prefetch", True)
+        return ""
 
-        # Process each field in the municipality data
-        for field, value in fields.items():
-            # E.g. field = 'population'
-            # E.g. value = {'type': 'number', 'content': null, 'instruction': 'Enter the total population of the municipality'}
-            print("Field: " + name + " " + field)
-            type = value["type"]
-            instruction = value["instruction"]
+    def _is_complete(self, section: str, identifier: str) -> bool:
+        """Whether every LLM field of a section part has an answer. Fields left unknown
+        (agent errors, budget skips, invalid answers) keep the part from being shared."""
+        for task in self.plan.select(section, identifier, (LLM,)):
+            content = get_field(self.data, task.path)
+            if content is None or (isinstance(content, str) and is_unknown(content)):
+                return False
+        return True
+
+    def _shared_epci_section(self, section: str, compute: Callable[[], None]) -> None:
+        """Fill the inter_municipality part of a section, reusing the result of another
+        commune of the same EPCI when the EPCI store has one"""
+        if self.epci_store is None:
+            compute()
+            return
+
+        def produce() -> Dict[str, Any]:
+            compute()
+            return self.data[section]["inter_municipality"]
+
+        subtree, reused = self.epci_store.get_or_compute(
+            self.inter_municipality_epci, section, produce,
+            cache_if=lambda _: self._is_complete(section, "inter_municipality"))
+        if reused:
+            self.data[section]["inter_municipality"] = subtree
+        current_span().set_attribute("epci_reused", reused)
+
+    def _process_identifier_section(self, section: str, identifier: str) -> None:
+        """Run the tasks of the municipality or inter_municipality part of a section"""
+        if identifier == "inter_municipality":
+            self._shared_epci_section(section, lambda: self._run_section(section, identifier))
+        else:
+            self._run_section(section, identifier)
 
-            if field in summary_fields:
-                self.data["summary"][identifier][field]["content"] = self.financial_api_data[name][field]
-                print("Populated from API")
-            else:
-                conversation_id = identifier + "_" + field
-                if conversation_id not in self.conversation_history:
-                    self.conversation_history[conversation_id] = []
-
-                if type == "array":
-                    # Create the overall array instructions
-                    array_prompt = tool_agent_prompt.format(
-                        identifier=identifier,
-                        name=name,
-                        field=field,
-                        instruction=instruction,
-                        type=type,
-                        example="",
-                    )
-
-                    # Process each item in the array sequentially
-                    for idx, item in enumerate(value["content"]):
-                        for subfield, subvalue in item.items():
-                            # Create prompt for this specific array item
-                            item_prompt = f"For item {idx+1} of the array:\n"
-                            item_prompt += tool_agent_prompt.format(
-                                identifier=identifier,
-                                name=name,
-                                field=subfield,
-                                instruction=subvalue["instruction"],
-                                type=subvalue["type"],
-                                example=subvalue["example"],
-                            )
-                            if idx == 0:
-                                item_prompt = array_prompt + item_prompt
-                            self.conversation_history[conversation_id].append(
-                                ChatMessage.from_user(item_prompt)
-                            )
-
-                            # print("--------------------------------")
-                            # print(self.conversation_history[conversation_id])
-                            # print("--------------------------------")
-
-                            # Get response for this item
-                            try:
-                                response = self.tool_agent.run(
-                                    self.conversation_history[conversation_id]
-                                )
-                                self.conversation_history[conversation_id].extend(
-                                    response)
-                            except:
-                                print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-
-
-                            # We call the agent again to get the final reply after the tool execution
-                            if (
-                                self.conversation_history[conversation_id][-1].role
-                                != ChatRole.ASSISTANT
-                            ):
-                                final_reply = self.tool_agent.run(
-                                    self.conversation_history[conversation_id]
-                                )
-                                self.conversation_history[conversation_id].extend(
-                                    final_reply
-                                )
-
-                            # Store the response for this item
-                            self.data["summary"][identifier][field]["content"][idx][
-                                subfield
-                            ]["content"] = self.conversation_history[conversation_id][
-                                -1
-                            ].text  # if final_reply else "unknown"
-                else:
-                    # Create a prompt based on the field and append it to the messages
-                    prompt = tool_agent_prompt.format(
-                        identifier=identifier,
-                        name=name,
-                        field=field,
-                        instruction=instruction,
-                        type=type,
-                        example=value["example"],
-                    )
-                    self.conversation_history[conversation_id].append(
-                        ChatMessage.from_user(prompt)
-                    )
-                    # print(self.conversation_history[conversation_id][-1])
-
-                    # Get response from agent and extend the conversation history with the response
-                    try:
-                        response = self.tool_agent.run(
-                            self.conversation_history[conversation_id]
-                        )
-                        self.conversation_history[conversation_id].extend(response)
-                        # print(self.conversation_history[conversation_id][-1])
-                    except:
-                        print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-
-                    # We call the agent again to get the final reply after the tool executions
-                    final_reply = self.tool_agent.run(
-                        self.conversation_history[conversation_id]
-                    )
-                    self.conversation_history[conversation_id].extend(
-                        final_reply)
-                    # print(self.conversation_history[conversation_id][-1])
-
-                    # Store the response
-                    self.data["summary"][identifier][field]["content"] = (
-                        self.conversation_history[conversation_id][-1].text
-                        if final_reply
-                        else "unknown"
-                    )
-
-                print("--------------------------------")
-                print(self.conversation_history[conversation_id])
-                print("--------------------------------")
+    @traced("section")
+    def process_summary_fields(self, inter=False) -> None:
+        """Process fields from the summary section"""
+        identifier = "inter_municipality" if inter else "municipality"
+        # The names are job inputs, never shared between the communes of the EPCI
+        self._run_section("summary", identifier, sources=(DERIVED,))
+        self._process_identifier_section("summary", identifier)
 
+    @traced("section")
     def process_projects_fields(self, inter=False) -> None:
         """Process fields from the projects section"""
-        if inter:
-            identifier = "inter_municipality"
-            name = self.inter_municipality_name
-        else:
-            identifier = "municipality"
-            name = self.municipality_name
-
-        fields = self.data["projects"][identifier]
-
-        # Process each field in the project data
-        for field, value in fields.items():
-            print("Field: " + name + " " + field)
-            type = value["type"]
-            instruction = value["instruction"]
-
-            conversation_id = identifier + "_" + field
-            if conversation_id not in self.conversation_history:
-                self.conversation_history[conversation_id] = []
-
-            if type == "array":
-                # Create the overall array instructions
-                array_prompt = project_agent_prompt.format(
-                    identifier=identifier,
-                    name=name,
-                    field=field,
-                    instruction=instruction,
-                    type=type,
-                    example="",
-                )
-
-                # Process each item in the array sequentially
-                for idx, item in enumerate(value["content"]):
-                    for subfield, subvalue in item.items():
-                        # Create prompt for this specific array item
-                        item_prompt = f"For item {idx+1} of the array:\n"
-                        item_prompt += project_agent_prompt.format(
-                            identifier=identifier,
-                            name=name,
-                            field=subfield,
-                            instruction=subvalue["instruction"],
-                            type=subvalue["type"],
-                            example=subvalue["example"],
-                        )
-                        if idx == 0:
-                            item_prompt = array_prompt + item_prompt
-                        self.conversation_history[conversation_id].append(
-                            ChatMessage.from_user(item_prompt)
-                        )
-
-                        # Get response for this item
-                        try:
-                            response = self.tool_agent.run(
-                                self.conversation_history[conversation_id]
-                            )
-                            self.conversation_history[conversation_id].extend(
-                                response)
-                        except:
-                            print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-
-                        # We call the agent again to get the final reply after the tool execution
-                        if (
-                            self.conversation_history[conversation_id][-1].role
-                            != ChatRole.ASSISTANT
-                        ):
-                            final_reply = self.tool_agent.run(
-                                self.conversation_history[conversation_id]
-                            )
-                            self.conversation_history[conversation_id].extend(
-                                final_reply
-                            )
-
-                        # Store the response for this item
-                        self.data["projects"][identifier][field]["content"][idx][
-                            subfield
-                        ]["content"] = self.conversation_history[conversation_id][
-                            -1
-                        ].text  # if final_reply else "unknown"
-            else:
-                # Create a prompt based on the field and append it to the messages
-                prompt = project_agent_prompt.format(
-                    identifier=identifier,
-                    name=name,
-                    field=field,
-                    instruction=instruction,
-                    type=type,
-                    example=value["example"],
-                )
-                self.conversation_history[conversation_id].append(
-                    ChatMessage.from_user(prompt)
-                )
-                # print(self.conversation_history[conversation_id][-1])
-
-                # Get response from agent and extend the conversation history with the response
-                try:
-                    response = self.tool_agent.run(
-                        self.conversation_history[conversation_id]
-                    )
-                    self.conversation_history[conversation_id].extend(response)
-                    # print(self.conversation_history[conversation_id][-1])
-                except:
-                    print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-
-                # We call the agent again to get the final reply after the tool executions
-                final_reply = self.tool_agent.run(
-                    self.conversation_history[conversation_id]
-                )
-                self.conversation_history[conversation_id].extend(final_reply)
-                # print(self.conversation_history[conversation_id][-1])
-
-                # Store the response
-                self.data["projects"][identifier][field]["content"] = (
-                    self.conversation_history[conversation_id][-1].text
-                    if final_reply
-                    else "unknown"
-                )
-
-            print("--------------------------------")
-            print(self.conversation_history[conversation_id])
-            print("--------------------------------")
+        self._process_identifier_section("projects", "inter_municipality" if inter else "municipality")
 
+    @traced("section")
     def process_contact_fields(self) -> None:
         """Process fields from the contacts section"""
-        fields = self.data["contacts"]
-
-        array_prompt = contact_agent_prompt.format(
-            municipality=self.municipality_name,
-            field="contacts",
-            instruction=fields["instruction"],
-            type=fields["type"],
-            example="",
-        )
-        conversation_id = "contacts"
-        if conversation_id not in self.conversation_history:
-            self.conversation_history[conversation_id] = []
-
-        # Process each item in the array sequentially
-        for idx, item in enumerate(fields["content"]):
-            for subfield, subvalue in item.items():
-                # Create prompt for this specific array item
-                item_prompt = contact_agent_prompt.format(
-                    municipality=self.municipality_name,
-                    field=subfield,
-                    instruction=subvalue["instruction"],
-                    type=subvalue["type"],
-                    example=subvalue["example"],
-                )
-                if idx == 0:
-                    item_prompt = array_prompt + item_prompt
-                self.conversation_history[conversation_id].append(
-                    ChatMessage.from_user(item_prompt)
-                )
-
-                # Get response for this item
-                try:
-                    response = self.tool_agent.run(
-                        self.conversation_history[conversation_id]
-                    )
-                    self.conversation_history[conversation_id].extend(response)
-                except:
-                    print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-
-                # We call the agent again to get the final reply after the tool execution
-                if (
-                    self.conversation_history[conversation_id][-1].role
-                    != ChatRole.ASSISTANT
-                ):
-                    final_reply = self.tool_agent.run(
-                        self.conversation_history[conversation_id]
-                    )
-                    self.conversation_history[conversation_id].extend(
-                        final_reply)
-
-                # Store the response for this item
-                self.data["contacts"]["content"][idx][subfield][
-                    "content"
-                ] = self.conversation_history[conversation_id][
-                    -1
-                ].text  # if final_reply else "unknown"
-
-        print("--------------------------------")
-        print(self.conversation_history[conversation_id])
-        print("--------------------------------")
+        self._run_section("contacts")
 
+    @traced("section")
     def process_budget_fields(self) -> None:
-        identifiers = ["municipality", "inter_municipality"]
-        for identifier in identifiers:
-            if identifier == "inter_municipality":
-                name = self.inter_municipality_name
-            else:
-                name = self.municipality_name
-            
-            fields = self.data["budget"][identifier]
-            # Process each field in the municipality data
-            for field, value in fields.items():
-                # E.g. field = 'population'
-                # E.g. value = {'type': 'number', 'content': null, 'instruction': 'Enter the total population of the municipality'}
-                print("Field: " + name + " " + field)
-                type = value["type"]
-                instruction = value["instruction"]
-
-                conversation_id = identifier + "_budegt_" + field
-                if conversation_id not in self.conversation_history:
-                    self.conversation_history[conversation_id] = []
-
-                # Create a prompt based on the field and append it to the messages
-                prompt = budget_agent_prompt.format(
-                    identifier=identifier,
-                    name=name,
-                    field=field,
-                    instruction=instruction,
-                    type=type,
-                    example=value["example"],
-                )
-                self.conversation_history[conversation_id].append(
-                    ChatMessage.from_user(prompt)
-                )
-                # print(self.conversation_history[conversation_id][-1])
-
-                # Get response from agent and extend the conversation history with the response
-                try:
-                    response = self.tool_agent.run(
-                        self.conversation_history[conversation_id]
-                    )
-                    self.conversation_history[conversation_id].extend(response)
-                    # print(self.conversation_history[conversation_id][-1])
-                except:
-                    print("\033[38;5;208mWARNING: Bedrock Role Exception!\033[0m")
-
-                # We call the agent again to get the final reply after the tool executions
-                final_reply = self.tool_agent.run(
-                    self.conversation_history[conversation_id]
-                )
-                self.conversation_history[conversation_id].extend(
-                    final_reply)
-                # print(self.conversation_history[conversation_id][-1])
-
-                # Store the response
-                self.data["budget"][identifier][field]["content"] = (
-                    self.conversation_history[conversation_id][-1].text
-                    if final_reply
-                    else "unknown"
-                )
-
-                print("--------------------------------")
-                print(self.conversation_history[conversation_id])
-                print("--------------------------------")
+        self._process_identifier_section("budget", "municipality")
+        self._process_identifier_section("budget", "inter_municipality")
 
+    @traced("section")
     def process_financial_data(self) -> None:
         """Process fields from the financial data section"""
-        municipality = self.data["financial_data"]["municipality"]
-        inter_municipality = self.data["financial_data"]["inter_municipality"]
-
-        for field, value in municipality.items():
-            if field in financial_data_fields:
-                municipality[field]["content"] = self.financial_api_data[self.municipality_name][field]
-
-        for field, value in inter_municipality.items():
-            if field in financial_data_fields:
-                inter_municipality[field]["content"] = self.financial_api_data[self.inter_municipality_name][field]
+        self._run_section("financial_data")
 
+    @traced("section")
     def process_comparative_data(self) -> None:
         """Process fields from the comparative data section"""
-        for i, ref_municipality in enumerate(self.data["comparative_data"]['content']):
-            for field, value in ref_municipality.items():
-                if field in comparitive_fields:
-                    ref_municipality[field]["content"] = self.financial_api_data["reference_finances"][i][field]
+        self._run_section("comparative_data")
+
+    def _finish(self) -> None:
+        """Record the memory figures of the job and store the fiche data under the job
+        id, off the critical path (see results.py)"""
+        memory = memory_usage(self.conversation_history)
+        self.usage.record_memory(memory)
+        if "limit_mb" in memory and memory["process_peak_rss_mb"] > 0.9 * memory["limit_mb"]:
+            # A condition of the worker process (all its jobs), reported by the job seeing it
+            log_event(logging.WARNING, "process_memory_pressure", job=self.result_id, **memory)
+        self.result_future = get_result_sink().submit(self.result_id, self.data)
 
     def process_all_sections(self) -> Dict[str, Any]:
-        """Process all fields in data_template.json and save results to data_answer.json"""
-        self.process_summary_fields(inter=False)
-        self.process_summary_fields(inter=True)
-        self.process_projects_fields(inter=False)
-        self.process_projects_fields(inter=True)
-        self.process_contact_fields()
-        self.process_budget_fields()
-        self.process_financial_data()
-        self.process_comparative_data()
-
-        # Save to answer.json
-        try:
-            with open("data_answer.json", "w", encoding="utf-8") as file:
-                json.dump(self.data, file, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error saving to answer.json: {e}")
+        """Process all fields in data_template.json and store the data of the job"""
+        with self._activate(), span("process_all_sections", "job"):
+            self.process_logo_field()
+            self.process_summary_fields(inter=False)
+            self.process_summary_fields(inter=True)
+            self.process_projects_fields(inter=False)
+            self.process_projects_fields(inter=True)
+            self.process_contact_fields()
+            self.process_budget_fields()
+            self.process_financial_data()
+            self.process_comparative_data()
+
+        self._finish()
 
         return self.data
     
     def test_process_all_sections(self) -> Dict[str, Any]:
-        """Process all fields in data_template.json and save results to data_answer.json"""
-        self.process_summary_fields(inter=False)
+        """Process all fields in data_template.json and store the data of the job"""
+        with self._activate():
+            self.process_summary_fields(inter=False)
         # self.process_summary_fields(inter=True)
         # self.process_projects_fields(inter=False)
         # self.process_projects_fields(inter=True)
@@ -621,20 +445,17 @@ class Orchestrator:
         # self.process_financial_data()
         # self.process_comparative_data()
 
-        # Save to answer.json
-        try:
-            with open("data_answer.json", "w", encoding="utf-8") as file:
-                json.dump(self.data, file, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error saving to answer.json: {e}")
+        self._finish()
 
         return self.data
 
 
     def parallel_process_all_sections(self) -> Dict[str, Any]:
-        """Process all fields in data_template.json and save results to data_answer.json"""
+        """Process all fields in data_template.json and store the data of the job"""
         # Define the tasks we want to run in parallel
         tasks = [
+            # First, so that the logo downloads while the other sections run
+            (self.process_logo_field, ()),
             (self.process_summary_fields, (False,)),
             (self.process_summary_fields, (True,)),
             (self.process_projects_fields, (False,)),
@@ -645,23 +466,20 @@ class Orchestrator:
             (self.process_comparative_data, ())
         ]
 
-        # Run tasks in parallel
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [executor.submit(func, *args) for func, args in tasks]
+        # Run tasks in parallel (in_context keeps the section spans under the job span)
+        with self._activate(), span("parallel_process_all_sections", "job"):
+            with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+                futures = [executor.submit(in_context(func, *args)) for func, args in tasks]
 
-            # Wait for all tasks to complete
-            for future in futures:
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"Error in parallel execution: {e}")
+                # Wait for all tasks to complete
+                for (func, args), future in zip(tasks, futures):
+                    try:
+                        future.result()
+                    except Exception:
+                        # The section span holds the error too (see Tracer.summary)
+                        logger.exception(f"Error in parallel execution of {func.__name__}{args}")
 
-        # Save to answer.json
-        try:
-            with open('data_answer.json', 'w', encoding='utf-8') as file:
-                json.dump(self.data, file, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error saving to answer.json: {e}")
+        self._finish()
         
         return self.data
     
@@ -0,0 +1,410 @@
+"""Execution plan compiled from data_template.json.
+
+The template is compiled once per process into an immutable `ExecutionPlan`: a flat
+list of `FieldTask`s, one per field to fill, each with
+- its source: OFGL (financial data prefetched from the API), LLM (asked to the tool
+  agent) or derived (copied from the job inputs),
+- the prompt template and arguments used to ask for it (LLM fields),
+- the path of the field in the fiche data,
+- its dependencies: the previous question of the same conversation, since the
+  items of an array are asked one after the other in a single conversation.
+
+Each job copies the output skeleton of the plan (the template with empty contents)
+and runs the tasks it needs with `run_tasks`, instead of walking the template.
+"""
+import functools
+import json
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .gazetteer import GAZETTEER_FIELDS
+from .prompt import budget_agent_prompt, contact_agent_prompt, logo_agent_prompt, project_agent_prompt, tool_agent_prompt
+from .tracing import in_context
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_template.json")
+
+OFGL = "ofgl"
+LLM = "llm"
+DERIVED = "derived"
+
+IDENTIFIERS = ("municipality", "inter_municipality")
+
+# Fields of the summary section filled from the OFGL API
+summary_fields = [
+    "population",
+    "data_from_year",
+    "total_budget",
+    "total_budget_per_person",
+    "debt_repayment_capacity",
+    "debt_ratio",
+    "debt_duration",
+]
+financial_data_fields = [
+    "management_savings_per_capita",
+    "gross_savings_per_capita",
+    "net_savings_per_capita",
+    "management_savings_ratio",
+    "gross_savings_ratio",
+    "net_savings_ratio",
+    "debt_service_to_operating_revenue_ratio",
+    "trend",
+]
+comparitive_fields = [
+    "municipality",
+    "inter_municipality",
+    "population",
+    "data_from_year",
+    "total_budget",
+    "total_budget_per_person",
+    "debt_repayment_capacity",
+    "debt_ratio",
+    "debt_duration",
+]
+
+PROMPTS = {
+    "tool": tool_agent_prompt,
+    "project": project_agent_prompt,
+    "contact": contact_agent_prompt,
+    "budget": budget_agent_prompt,
+    "logo": logo_agent_prompt,
+}
+
+Path = Tuple[Union[str, int], ...]
+PromptArgs = Tuple[Tuple[str, Any], ...]
+
+
+@dataclass(frozen=True)
+class FieldTask:
+    """One field of the fiche to fill.
+
+    Attributes:
+        id: Position of the task in the plan
+        section: Section the task belongs to (summary, projects, contacts, budget,
+            financial_data, comparative_data, logo)
+        identifier: "municipality" or "inter_municipality", None for the sections of the commune only
+        path: Path of the field in the fiche data; its "content" is set
+        source: OFGL, LLM or DERIVED
+        name: Name of the field in spans and logs (e.g. "summary.municipality.area")
+        conversation_id: Conversation of the tool agent the question is asked in (LLM)
+        prompt: Key of the prompt template in PROMPTS (LLM)
+        prompt_args: Arguments of the prompt template known at compile time (LLM)
+        array_prompt_args: For the first item of an array, arguments of the prompt
+            describing the whole array, which is prepended to the item prompt
+        item_label: Prepend "For item N of the array" to the prompt
+        priority: "low" fields are skipped once the budget of the job is exhausted
+        complex: Flagged `"complex": true` in the template: asked to the strong model
+            directly instead of the fast one (LLM, see routing.py)
+        ofgl_entity: "municipality", "inter_municipality" or "reference" (OFGL)
+        ofgl_index: Index of the reference commune (OFGL, comparative data)
+        ofgl_key: Key of the value in the OFGL data (OFGL)
+        input_key: Job input copied into the field (DERIVED)
+        gazetteer_field: Field the local gazetteer may answer before the LLM is asked (LLM)
+        depends_on: Ids of the tasks to run before this one
+        ends_conversation: Last question of its conversation
+    """
+
+    id: int
+    section: str
+    identifier: Optional[str]
+    path: Path
+    source: str
+    name: str
+    conversation_id: Optional[str] = None
+    prompt: Optional[str] = None
+    prompt_args: PromptArgs = ()
+    array_prompt_args: Optional[PromptArgs] = None
+    item_label: Optional[int] = None
+    priority: Optional[str] = None
+    complex: bool = False
+    ofgl_entity: Optional[str] = None
+    ofgl_index: Optional[int] = None
+    ofgl_key: Optional[str] = None
+    input_key: Optional[str] = None
+    gazetteer_field: Optional[str] = None
+    depends_on: Tuple[int, ...] = ()
+    ends_conversation: bool = False
+
+    @property
+    def field_type(self) -> Optional[str]:
+        """Type of the field in the template ("number", "string"...), None if undeclared"""
+        return dict(self.prompt_args).get("type")
+
+    def _job_args(self, names: Dict[str, str]) -> Dict[str, Any]:
+        if self.prompt == "contact":
+            return {"municipality": names["municipality"]}
+        if self.prompt == "logo":
+            return {"name": names["municipality"]}
+        return {"identifier": self.identifier, "name": names[self.identifier]}
+
+    def render_prompt(self, names: Dict[str, str]) -> str:
+        """Build the prompt of an LLM task for a job.
+
+        Args:
+            names: Names of the "municipality" and "inter_municipality" of the job
+        """
+        template = PROMPTS[self.prompt]
+        job_args = self._job_args(names)
+        prompt = template.format(**dict(self.prompt_args), **job_args)
+        if self.item_label is not None:
+            prompt = f"For item {self.item_label} of the array:\n" + prompt
+        if self.array_prompt_args is not None:
+            prompt = template.format(**dict(self.array_prompt_args), **job_args) + prompt
+        return prompt
+
+
+def _prompt_args(field: str, value: Dict[str, Any], example: Any) -> PromptArgs:
+    return (("field", field), ("instruction", value["instruction"]), ("type", value["type"]), ("example", example))
+
+
+class ExecutionPlan:
+    """Immutable tasks of the template and the skeleton of the fiche data"""
+
+    def __init__(self, tasks: Sequence[FieldTask], skeleton: Dict[str, Any]):
+        self.tasks: Tuple[FieldTask, ...] = tuple(tasks)
+        self._skeleton = pickle.dumps(skeleton, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def new_data(self) -> Dict[str, Any]:
+        """Return a fresh copy of the fiche data skeleton for a job"""
+        return pickle.loads(self._skeleton)
+
+    def select(
+        self,
+        section: Optional[str] = None,
+        identifier: Optional[str] = None,
+        sources: Optional[Sequence[str]] = None,
+    ) -> List[FieldTask]:
+        """Tasks of a section and/or identifier and/or sources, in plan order"""
+        return [
+            task
+            for task in self.tasks
+            if (section is None or task.section == section)
+            and (identifier is None or task.identifier == identifier)
+            and (sources is None or task.source in sources)
+        ]
+
+
+class _PlanBuilder:
+    def __init__(self):
+        self.tasks: List[FieldTask] = []
+        self._last_in_conversation: Dict[str, int] = {}
+
+    def add(self, **kwargs: Any) -> None:
+        conversation_id = kwargs.get("conversation_id")
+        depends_on: Tuple[int, ...] = ()
+        if conversation_id is not None and conversation_id in self._last_in_conversation:
+            depends_on = (self._last_in_conversation[conversation_id],)
+        task_id = len(self.tasks)
+        self.tasks.append(FieldTask(id=task_id, depends_on=depends_on, **kwargs))
+        if conversation_id is not None:
+            self._last_in_conversation[conversation_id] = task_id
+
+    def build(self, skeleton: Dict[str, Any]) -> ExecutionPlan:
+        last_ids = set(self._last_in_conversation.values())
+        tasks = [
+            replace(task, ends_conversation=True) if task.id in last_ids else task
+            for task in self.tasks
+        ]
+        return ExecutionPlan(tasks, skeleton)
+
+
+def _compile_llm_fields(builder: _PlanBuilder, section: str, identifier: str, fields: Dict[str, Any],
+                        prompt: str, conversation_prefix: str) -> None:
+    """Questions on the fields of a section part, array items one after the other"""
+    for field, value in fields.items():
+        if section == "summary" and field in summary_fields:
+            continue
+        conversation_id = conversation_prefix + field
+
+        if value["type"] == "array":
+            array_args = _prompt_args(field, value, "")
+            for idx, item in enumerate(value["content"]):
+                for subfield, subvalue in item.items():
+                    builder.add(
+                        section=section,
+                        identifier=identifier,
+                        path=(section, identifier, field, "content", idx, subfield),
+                        source=LLM,
+                        name=f"{section}.{identifier}.{field}[{idx}].{subfield}",
+                        conversation_id=conversation_id,
+                        prompt=prompt,
+                        prompt_args=_prompt_args(subfield, subvalue, subvalue["example"]),
+                        array_prompt_args=array_args if idx == 0 else None,
+                        item_label=idx + 1,
+                        priority=subvalue.get("priority", value.get("priority")),
+                        complex=bool(subvalue.get("complex", value.get("complex", False))),
+                    )
+        else:
+            builder.add(
+                section=section,
+                identifier=identifier,
+                path=(section, identifier, field),
+                source=LLM,
+                name=f"{section}.{identifier}.{field}",
+                conversation_id=conversation_id,
+                prompt=prompt,
+                prompt_args=_prompt_args(field, value, value["example"]),
+                priority=value.get("priority"),
+                complex=bool(value.get("complex", False)),
+                gazetteer_field=field if field in GAZETTEER_FIELDS else None,
+            )
+
+
+def compile_plan(template: Dict[str, Any]) -> ExecutionPlan:
+    """Compile the fiche template into its execution plan"""
+    builder = _PlanBuilder()
+
+    for identifier in IDENTIFIERS:
+        builder.add(
+            section="summary",
+            identifier=identifier,
+            path=(f"{identifier}_name",),
+            source=DERIVED,
+            name=f"{identifier}_name",
+            input_key=f"{identifier}_name",
+        )
+        for field in template["summary"][identifier]:
+            if field in summary_fields:
+                builder.add(
+                    section="summary",
+                    identifier=identifier,
+                    path=("summary", identifier, field),
+                    source=OFGL,
+                    name=f"summary.{identifier}.{field}",
+                    ofgl_entity=identifier,
+                    ofgl_key=field,
+                )
+        _compile_llm_fields(builder, "summary", identifier, template["summary"][identifier], "tool", identifier + "_")
+
+    for identifier in IDENTIFIERS:
+        _compile_llm_fields(builder, "projects", identifier, template["projects"][identifier], "project", identifier + "_")
+
+    contacts = template["contacts"]
+    contacts_args = (("field", "contacts"), ("instruction", contacts["instruction"]), ("type", contacts["type"]), ("example", ""))
+    for idx, item in enumerate(contacts["content"]):
+        for subfield, subvalue in item.items():
+            builder.add(
+                section="contacts",
+                identifier=None,
+                path=("contacts", "content", idx, subfield),
+                source=LLM,
+                name=f"contacts[{idx}].{subfield}",
+                conversation_id="contacts",
+                prompt="contact",
+                prompt_args=_prompt_args(subfield, subvalue, subvalue["example"]),
+                array_prompt_args=contacts_args if idx == 0 else None,
+                priority=subvalue.get("priority", contacts.get("priority")),
+                complex=bool(subvalue.get("complex", contacts.get("complex", False))),
+            )
+
+    for identifier in IDENTIFIERS:
+        _compile_llm_fields(builder, "budget", identifier, template["budget"][identifier], "budget", identifier + "_budegt_")
+
+    for identifier in IDENTIFIERS:
+        for field in template["financial_data"][identifier]:
+            if field in financial_data_fields:
+                builder.add(
+                    section="financial_data",
+                    identifier=identifier,
+                    path=("financial_data", identifier, field),
+                    source=OFGL,
+                    name=f"financial_data.{identifier}.{field}",
+                    ofgl_entity=identifier,
+                    ofgl_key=field,
+                )
+
+    for idx, reference in enumerate(template["comparative_data"]["content"]):
+        for field in reference:
+            if field in comparitive_fields:
+                builder.add(
+                    section="comparative_data",
+                    identifier=None,
+                    path=("comparative_data", "content", idx, field),
+                    source=OFGL,
+                    name=f"comparative_data[{idx}].{field}",
+                    ofgl_entity="reference",
+                    ofgl_index=idx,
+                    ofgl_key=field,
+                )
+
+    builder.add(
+        section="logo",
+        identifier=None,
+        path=("logo",),
+        source=LLM,
+        name="logo",
+        conversation_id="logo_retrieval",
+        prompt="logo",
+    )
+
+    return builder.build(template)
+
+
+@functools.lru_cache(maxsize=None)
+def get_plan(template_path: str = TEMPLATE_PATH) -> ExecutionPlan:
+    """Return the execution plan of the template, compiled once per process"""
+    try:
+        with open(template_path, "r", encoding="utf-8") as file:
+            template = json.load(file)
+    except FileNotFoundError:
+        raise FileNotFoundError("data_template.json not found in the agent directory")
+    return compile_plan(template)
+
+
+def set_field(data: Dict[str, Any], path: Path, content: Any) -> None:
+    """Set the content of the field at `path` in the fiche data"""
+    node: Any = data
+    for key in path:
+        node = node[key]
+    node["content"] = content
+
+
+def get_field(data: Dict[str, Any], path: Path) -> Any:
+    """Content of the field at `path` in the fiche data"""
+    node: Any = data
+    for key in path:
+        node = node[key]
+    return node.get("content")
+
+
+def run_tasks(tasks: Sequence[FieldTask], execute: Callable[[FieldTask], None], max_workers: int = 1) -> None:
+    """Run tasks, each after the tasks it depends on.
+
+    With one worker the tasks run in plan order. With more, independent tasks (e.g.
+    the questions of different conversations) run concurrently. Dependencies on
+    tasks outside of `tasks` are ignored. The first error is raised once the running
+    tasks are done, and the tasks not started yet are not run.
+    """
+    if max_workers <= 1:
+        for task in tasks:
+            execute(task)
+        return
+
+    ids = {task.id for task in tasks}
+    waiting = {task.id: {dep for dep in task.depends_on if dep in ids} for task in tasks}
+    dependents: Dict[int, List[FieldTask]] = {}
+    for task in tasks:
+        for dep in waiting[task.id]:
+            dependents.setdefault(dep, []).append(task)
+    ready = [task for task in tasks if not waiting[task.id]]
+    error: Optional[BaseException] = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {executor.submit(in_context(execute, task)): task for task in ready}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                if error is not None:
+                    continue
+                for dependent in dependents.get(task.id, ()):
+                    waiting[dependent.id].discard(task.id)
+                    if not waiting[dependent.id]:
+                        running[executor.submit(in_context(execute, dependent))] = dependent
+    if error is not None:
+        raise error
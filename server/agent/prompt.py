@@ -13,6 +13,7 @@ INSTRUCTIONS :
    - Si vous ne connaissez pas la réponse, répondez uniquement 'inconnu' (pas d'explications, pas d'excuses)
 
 3. Utilisez les outils si vous avez besoin de plus d'informations. Ne pas inventer ou deviner.
+   Pour les montants financiers (dette, épargne, recettes, dépenses), utilisez en priorité l'outil get_financial_aggregate s'il est disponible.
 4. N'incluez pas de raisonnement ou de texte supplémentaire - fournissez uniquement la réponse finale.
 5. Si le format est 'number', ne fournissez PAS de phrase. Par exemple, '150000 habitants' au lieu de 'La population est de 150000 habitants.'
 6. Si une réponse simple est demandée (ex : 'code_postal' avec le type 'text'), fournissez-la le plus brièvement possible (ex : '21000').
@@ -117,4 +118,9 @@ Exemple :
 - Budget_Total : 271,2 millions d'euros
 
 Maintenant, étant donné '{identifier}' '{name}', le champ '{field}', le type '{type}', et l'instruction '{instruction}', produisez votre réponse en suivant ces règles.
-"""
\ No newline at end of file
+"""
+
+validation_reask_prompt = """
+Votre réponse « {answer} » ne convient pas : {error}.
+Répondez de nouveau à la question précédente en respectant strictement le type et le format demandés. Si vous ne connaissez pas la réponse, répondez uniquement 'inconnu'.
+"""
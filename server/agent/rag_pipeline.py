@@ -1,12 +1,10 @@
 # https://haystack.deepset.ai/tutorials/40_building_chat_application_with_function_calling#creating-a-function-calling-tool-from-a-haystack-pipeline
 
-from haystack import Pipeline, Document
-from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.components.writers import DocumentWriter
-from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+import functools
+import tempfile
+from typing import List, Optional, Sequence
 
-from haystack.components.embedders import SentenceTransformersTextEmbedder
-from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
+from haystack import Pipeline, Document
 from haystack.components.builders import ChatPromptBuilder
 from haystack.dataclasses import ChatMessage
 from haystack_integrations.components.generators.amazon_bedrock import AmazonBedrockChatGenerator
@@ -15,6 +13,10 @@ from haystack_integrations.components.generators.amazon_bedrock import AmazonBed
 from dotenv import load_dotenv
 import os
 
+from .embedding_service import ServiceTextEmbedder, get_embedding_service
+from .hybrid_retrieval import HybridRetriever
+from .vector_index import EMBEDDING_DIM, EMBEDDING_MODEL, RAG_INDEX_DIR, VectorIndex
+
 MODEL_ID = "anthropic.claude-3-5-sonnet-20241022-v2:0"
 
 # Load environment variables for Keys
@@ -24,15 +26,16 @@ aws_secret_access_key = os.getenv("BR_AWS_SECRET_ACCESS_KEY")
 aws_region_name = os.getenv("BR_AWS_DEFAULT_REGION")
 search_api_key = os.getenv("SERPERDEV_API_KEY")
 
-documents = [
-    Document(content="My name is Jean and I live in Paris."),
-    Document(content="My name is Mark and I live in Berlin."),
-    Document(content="My name is Giorgio and I live in Rome."),
-    Document(content="My name is Marta and I live in Madrid."),
-    Document(content="My name is Harry and I live in London."),
+# Toy documents of the demo (`python -m agent.rag_pipeline`), indexed in a directory of
+# their own so they never end up in the index of the local budget documents
+RAG_DEMO_INDEX_DIR = os.getenv("RAG_DEMO_INDEX_DIR", os.path.join(tempfile.gettempdir(), "h-genai-rag-demo"))
+demo_documents = [
+    Document(id="jean", content="My name is Jean and I live in Paris."),
+    Document(id="mark", content="My name is Mark and I live in Berlin."),
+    Document(id="giorgio", content="My name is Giorgio and I live in Rome."),
+    Document(id="marta", content="My name is Marta and I live in Madrid."),
+    Document(id="harry", content="My name is Harry and I live in London."),
 ]
-document_store = InMemoryDocumentStore()
-
 template = [
     ChatMessage.from_user(
         """
@@ -47,42 +50,71 @@ template = [
     """)
 ]
 
-# Document Indexing Pipeline
-indexing_pipeline = Pipeline()
-indexing_pipeline.add_component("doc_embedder", instance=SentenceTransformersDocumentEmbedder(model="sentence-transformers/all-MiniLM-L6-v2"))
-indexing_pipeline.add_component("doc_writer", instance=DocumentWriter(document_store=document_store))
-indexing_pipeline.connect("doc_embedder.documents", "doc_writer.documents")
-indexing_pipeline.run({"doc_embedder": {"documents": documents}})
-
-# Query Embedding and RAG Pipeline
-rag_pipe = Pipeline()
-rag_pipe.add_component("embedder", SentenceTransformersTextEmbedder(model="sentence-transformers/all-MiniLM-L6-v2"))
-rag_pipe.add_component("retriever", InMemoryEmbeddingRetriever(document_store=document_store))
-rag_pipe.add_component("prompt_builder", ChatPromptBuilder(template=template))
-rag_pipe.add_component("llm", AmazonBedrockChatGenerator(
-    model=MODEL_ID,
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    aws_region_name=aws_region_name
-))
-rag_pipe.connect("embedder.embedding", "retriever.query_embedding")
-rag_pipe.connect("retriever", "prompt_builder.documents")
-rag_pipe.connect("prompt_builder.prompt", "llm.messages")
-
-def rag_pipeline_func(query: str):
+# The shared embedding service only loads the model when there are new or changed
+# documents to embed, or a query
+def embed_documents(documents: List[Document]) -> List[List[float]]:
+    return get_embedding_service(EMBEDDING_MODEL).embed_many(
+        [document.content for document in documents], cache=False
+    )
+
+
+def ingest_documents(documents: Sequence[Document], index: VectorIndex) -> int:
+    """Add the documents to the index, embedding only the new or changed ones"""
+    return index.upsert(documents, embed_documents)
+
+
+@functools.lru_cache(maxsize=None)
+def get_document_index(index_dir: str = RAG_INDEX_DIR) -> VectorIndex:
+    """The document index of a directory, opened on first use"""
+    return VectorIndex(index_dir, dim=EMBEDDING_DIM)
+
+
+# Query Embedding and RAG Pipeline, built on first use so that importing this module
+# does no I/O
+@functools.lru_cache(maxsize=None)
+def get_rag_pipeline(index_dir: str = RAG_INDEX_DIR) -> Pipeline:
+    rag_pipe = Pipeline()
+    rag_pipe.add_component("embedder", ServiceTextEmbedder(model=EMBEDDING_MODEL))
+    rag_pipe.add_component("retriever", HybridRetriever(index=get_document_index(index_dir)))
+    rag_pipe.add_component("prompt_builder", ChatPromptBuilder(template=template))
+    rag_pipe.add_component("llm", AmazonBedrockChatGenerator(
+        model=MODEL_ID,
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        aws_region_name=aws_region_name
+    ))
+    rag_pipe.connect("embedder.embedding", "retriever.query_embedding")
+    rag_pipe.connect("retriever", "prompt_builder.documents")
+    rag_pipe.connect("prompt_builder.prompt", "llm.messages")
+    return rag_pipe
+
+def rag_pipeline_func(query: str, siren: Optional[str] = None):
     """Search your documents with the RAG pipeline.
     https://haystack.deepset.ai/tutorials/40_building_chat_application_with_function_calling#creating-a-function-calling-tool-from-a-haystack-pipeline
     
     Args:
         query: The search query to look up
+        siren: Only search the documents of this commune or EPCI (SIREN)
 
     Returns:
         str: The search results
     """
-    result = rag_pipe.run({"embedder": {"text": query}, "prompt_builder": {"question": query}})
+    filters = {"siren": siren} if siren else None
+    result = get_rag_pipeline().run({
+        "embedder": {"text": query},
+        "retriever": {"query": query, "filters": filters},
+        "prompt_builder": {"question": query},
+    })
     return {"reply": result["llm"]["replies"][0].text}
 
-# # Running the Pipeline
-# query = "Where does Mark live?"
-# result = rag_pipe.run({"embedder": {"text": query}, "prompt_builder": {"question": query}})
-# print(result["llm"]["replies"][0].text)
+
+# Running the Pipeline on the demo documents
+if __name__ == "__main__":
+    ingest_documents(demo_documents, get_document_index(RAG_DEMO_INDEX_DIR))
+    query = "Where does Mark live?"
+    result = get_rag_pipeline(RAG_DEMO_INDEX_DIR).run({
+        "embedder": {"text": query},
+        "retriever": {"query": query},
+        "prompt_builder": {"question": query},
+    })
+    print(result["llm"]["replies"][0].text)
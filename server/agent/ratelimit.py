@@ -0,0 +1,253 @@
+"""Shared limiter for the Bedrock calls of a process.
+
+Every `AmazonBedrockChatGenerator` call goes through `BedrockLimiter.call`, which
+combines:
+- token buckets for requests and tokens per minute, sized to the account quota
+  (BEDROCK_REQUESTS_PER_MINUTE / BEDROCK_TOKENS_PER_MINUTE, unlimited if unset),
+- an AIMD concurrency limit: +1 slot per window of successful calls, halved when
+  Bedrock throttles,
+- retries with full-jitter exponential backoff on throttling and transient errors.
+
+The quotas are per account and region, so when several workers run at the same time
+each one should be given its share (e.g. quota / reserved concurrency of the Lambda).
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Error codes of the Bedrock runtime meaning "slow down"
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+# Error codes worth retrying without reducing the concurrency
+TRANSIENT_ERROR_CODES = {
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+    "ModelTimeoutException",
+}
+
+
+def _error_code(error: BaseException) -> Optional[str]:
+    """Find the AWS error code of an exception or of the exceptions it wraps.
+
+    haystack raises AmazonBedrockInferenceError from the botocore ClientError.
+    """
+    seen = set()
+    current: Optional[BaseException] = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        response = getattr(current, "response", None)
+        if isinstance(response, dict):
+            code = response.get("Error", {}).get("Code")
+            if code:
+                return code
+        current = current.__cause__ or current.__context__
+    return None
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    return _error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    return _error_code(error) in THROTTLING_ERROR_CODES | TRANSIENT_ERROR_CODES
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute.
+
+    The bucket can go into debt when a call used more than it reserved (see `adjust`),
+    which delays the following calls.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> float:
+        """Block until `amount` tokens are available and take them. Returns the time waited"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                delay = (amount - self.level) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount: float) -> None:
+        """Take (or give back, if negative) tokens after the fact"""
+        with self._lock:
+            self._refill()
+            self.level = max(-self.capacity, min(self.capacity, self.level - amount))
+
+
+class AdaptiveConcurrencyLimit:
+    """Concurrency limit adjusted with additive increase / multiplicative decrease.
+
+    Each success adds 1/limit (about +1 slot once a full window of calls succeeded),
+    a throttling error multiplies the limit by `backoff`. Decreases are spaced by at
+    least `cooldown` seconds so that a burst of throttled in-flight calls only counts once.
+    """
+
+    def __init__(
+        self,
+        initial: float = 4,
+        minimum: float = 1,
+        maximum: float = 32,
+        backoff: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def on_success(self) -> None:
+        with self._condition:
+            previous = int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if int(self.limit) > previous:
+                self._condition.notify()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+
+
+class BedrockLimiter:
+    """Rate, concurrency and retry policy for the Bedrock calls of the process"""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        concurrency: Optional[AdaptiveConcurrencyLimit] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrencyLimit()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(
+        self,
+        func: Callable[[], T],
+        estimated_tokens: int = 0,
+        used_tokens: Optional[Callable[[T], int]] = None,
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+    ) -> T:
+        """Run a Bedrock call under the limits, retrying throttled and transient failures.
+
+        Args:
+            func: Performs the call
+            estimated_tokens: Tokens reserved in the tokens-per-minute bucket before the call
+            used_tokens: Returns the actual token usage of a result, to correct the reservation
+            on_retry: Called with the error before each retry
+        """
+        attempt = 0
+        while True:
+            if self.requests is not None:
+                self.requests.acquire(1)
+            if self.tokens is not None and estimated_tokens:
+                self.tokens.acquire(estimated_tokens)
+
+            try:
+                with self.concurrency.slot():
+                    result = func()
+            except Exception as e:
+                if self.tokens is not None and estimated_tokens:
+                    # A failed call doesn't consume the tokens it reserved
+                    self.tokens.adjust(-estimated_tokens)
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                if is_throttling_error(e):
+                    self.concurrency.on_throttle()
+                delay = self.backoff_delay(attempt)
+                logger.warning(
+                    "Bedrock call failed with %s, retrying in %.1fs (attempt %d/%d, concurrency %.1f)",
+                    _error_code(e), delay, attempt + 1, self.max_retries, self.concurrency.limit,
+                )
+                if on_retry is not None:
+                    on_retry(e)
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            self.concurrency.on_success()
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.adjust(used_tokens(result) - estimated_tokens)
+            return result
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+_limiter: Optional[BedrockLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> BedrockLimiter:
+    """Return the limiter shared by all the Bedrock calls of the process"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = BedrockLimiter(
+                    requests_per_minute=_env_float("BEDROCK_REQUESTS_PER_MINUTE"),
+                    tokens_per_minute=_env_float("BEDROCK_TOKENS_PER_MINUTE"),
+                    concurrency=AdaptiveConcurrencyLimit(
+                        initial=float(os.getenv("BEDROCK_INITIAL_CONCURRENCY", "8")),
+                        maximum=float(os.getenv("BEDROCK_MAX_CONCURRENCY", "32")),
+                    ),
+                    max_retries=int(os.getenv("BEDROCK_MAX_RETRIES", "5")),
+                )
+    return _limiter
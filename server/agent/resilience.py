@@ -0,0 +1,172 @@
+"""Deadlines, hedged requests and circuit breaking for slow external tools.
+
+`ResilientCall` wraps the calls to one upstream (e.g. Perplexity):
+- each call has a deadline, after which the fallback result is returned,
+- when the first attempt hasn't answered after the p95 of the recent latencies (or
+  failed), a duplicate "hedge" request is sent and the first answer wins,
+- a circuit breaker opens after consecutive failures and short-circuits to the
+  fallback until the upstream recovers (one trial call after `reset_timeout`).
+
+Attempts run on a thread pool owned by the wrapper. An attempt that loses the race or
+misses the deadline is not interrupted; the client's own timeout ends it.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Optional, Set, Tuple, TypeVar
+
+from .tracing import current_span, in_context
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LatencyTracker:
+    """Sliding window of the latencies of successful calls"""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, for `reset_timeout` seconds"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream (only one trial call when half open)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning("Circuit opened after %d consecutive failures", self._failures)
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientCall:
+    """Deadline, hedging and circuit breaker around the calls to one upstream"""
+
+    def __init__(
+        self,
+        name: str,
+        deadline: float = 30.0,
+        hedge_quantile: float = 0.95,
+        initial_hedge_delay: float = 8.0,
+        min_hedge_delay: float = 0.5,
+        min_samples: int = 20,
+        max_hedges: int = 1,
+        breaker: Optional[CircuitBreaker] = None,
+        max_workers: int = 32,
+    ):
+        self.name = name
+        self.deadline = deadline
+        self.hedge_quantile = hedge_quantile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def hedge_delay(self) -> float:
+        """Delay before sending a hedge: the p95 latency once enough calls were observed"""
+        observed = self.latency.quantile(self.hedge_quantile)
+        if observed is None or len(self.latency) < self.min_samples:
+            observed = self.initial_hedge_delay
+        return min(self.deadline, max(self.min_hedge_delay, observed))
+
+    def _submit(self, func: Callable[[], T]) -> "Future[Tuple[T, float]]":
+        def attempt() -> Tuple[T, float]:
+            start = time.monotonic()
+            result = func()
+            return result, time.monotonic() - start
+
+        return self._executor.submit(in_context(attempt))
+
+    def call(self, func: Callable[[], T], fallback: Callable[[], T]) -> T:
+        """Run `func` with a deadline and hedging, or return `fallback()` if it can't succeed"""
+        span = current_span()
+        if not self.breaker.allow():
+            span.set_attribute("circuit", OPEN)
+            return fallback()
+
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_at = start + self.hedge_delay()
+        pending: Set[Future] = {self._submit(func)}
+        hedges = 0
+        last_error: Optional[BaseException] = None
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            can_hedge = hedges < self.max_hedges
+            timeout = (min(deadline, hedge_at) if can_hedge else deadline) - now
+            done, pending = wait(pending, timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    result, duration = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                self.latency.record(duration)
+                self.breaker.record_success()
+                return result
+
+            # Hedge when the delay has passed, or right away if the only attempt failed
+            if can_hedge and (time.monotonic() >= hedge_at or not pending):
+                pending.add(self._submit(func))
+                hedges += 1
+                span.add("hedges")
+
+        self.breaker.record_failure()
+        reason = "deadline exceeded" if pending else f"{type(last_error).__name__}: {last_error}"
+        logger.warning("%s call failed (%s), using the fallback", self.name, reason)
+        span.set_attribute("fallback", reason)
+        return fallback()
@@ -0,0 +1,172 @@
+"""Per-job store of the fiche data, replacing the shared data_answer.json.
+
+Every job used to pretty-print its data to data_answer.json in the working directory,
+so concurrent jobs of a worker overwrote each other and every run paid for the indented
+serialisation on its critical path. `ResultSink.submit` now stores the data of a job
+under its id, compactly encoded, on a background thread. The data can then be loaded
+back, or exported as indented JSON on demand:
+
+    python -m agent.results export <job_id> --output data_answer.json
+
+The encoding is msgpack compressed with zstd when the `msgpack` and `zstandard`
+packages are installed, compact JSON and zlib otherwise. The codec is written in the
+header of every result, so results stay readable whichever packages the reader has.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.getenv("RESULTS_DIR", os.path.join(tempfile.gettempdir(), "h-genai-results"))
+
+try:
+    import msgpack
+except ImportError:  # Optional, compact JSON is used without it
+    msgpack = None
+try:
+    import zstandard
+except ImportError:  # Optional, zlib is used without it
+    zstandard = None
+
+_MAGIC = b"HGR1"
+
+
+def default_codec() -> str:
+    """Best codec the installed packages allow, e.g. "msgpack+zstd" or "json+zlib" """
+    return f"{'msgpack' if msgpack else 'json'}+{'zstd' if zstandard else 'zlib'}"
+
+
+def encode(data: Any, codec: Optional[str] = None) -> bytes:
+    """Serialise and compress data, with a header naming the codec"""
+    codec = codec or default_codec()
+    serialisation, compression = codec.split("+")
+    if serialisation == "msgpack":
+        payload = msgpack.packb(data, default=str, use_bin_type=True)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    if compression == "zstd":
+        payload = zstandard.ZstdCompressor(level=3).compress(payload)
+    else:
+        payload = zlib.compress(payload, 6)
+    return _MAGIC + codec.encode("ascii") + b"\n" + payload
+
+
+def decode(body: bytes) -> Any:
+    """Data of a body written by `encode`"""
+    if not body.startswith(_MAGIC):
+        raise ValueError("Not an encoded result")
+    header, payload = body[len(_MAGIC):].split(b"\n", 1)
+    serialisation, compression = header.decode("ascii").split("+")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("The zstandard package is needed to read this result")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        payload = zlib.decompress(payload)
+    if serialisation == "msgpack":
+        if msgpack is None:
+            raise ImportError("The msgpack package is needed to read this result")
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload)
+
+
+class ResultSink:
+    """Fiche data of the jobs, one file per job id, written in the background.
+
+    Args:
+        directory: Where the results are stored
+        codec: Encoding of the results (`default_codec()` by default)
+    """
+
+    def __init__(self, directory: str = RESULTS_DIR, codec: Optional[str] = None):
+        self.directory = directory
+        self.codec = codec or default_codec()
+        # One writer: the results of a job are written in submission order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-sink")
+        self._pending: "set[Future]" = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.result")
+
+    def _write(self, job_id: str, data: Any) -> str:
+        path = self.path(job_id)
+        try:
+            body = encode(data, self.codec)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(body)
+            os.replace(temporary, path)
+        except Exception as e:
+            logger.error(f"Error saving the result of job {job_id}: {type(e).__name__}: {e}")
+            raise
+        return path
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def submit(self, job_id: str, data: Any) -> "Future[str]":
+        """Store the data of a job in the background and return the future of its path.
+        The data must not be modified until the future is done."""
+        future = self._executor.submit(self._write, job_id, data)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Wait for the results submitted so far to be written"""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass  # Already logged by the writer
+
+    def load(self, job_id: str) -> Any:
+        """Data of a job, raising FileNotFoundError if it has no result"""
+        with open(self.path(job_id), "rb") as file:
+            return decode(file.read())
+
+    def export(self, job_id: str, output: Optional[str] = None) -> str:
+        """Indented JSON of the data of a job, also written to `output` if given"""
+        text = json.dumps(self.load(job_id), indent=4, ensure_ascii=False)
+        if output:
+            with open(output, "w", encoding="utf-8") as file:
+                file.write(text)
+        return text
+
+
+@functools.lru_cache(maxsize=None)
+def get_result_sink(directory: str = RESULTS_DIR) -> ResultSink:
+    """The result sink of the process"""
+    return ResultSink(directory)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the stored fiche data of a job")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Print (or write) the data of a job as indented JSON")
+    export.add_argument("job_id")
+    export.add_argument("--output", help="File to write the JSON to instead of printing it")
+    export.add_argument("--results-dir", default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    text = ResultSink(args.results_dir).export(args.job_id, args.output)
+    if not args.output:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
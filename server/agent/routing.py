@@ -0,0 +1,43 @@
+"""Tiered model routing of the field questions.
+
+Most fields are one-word or one-number extractions that a small model answers as well
+as the large one, faster and cheaper. The tool agent therefore asks the fast model
+(FAST_MODEL_ID) first. A field goes to the strong model (agents.MODEL_ID) when the
+template flags it `"complex": true`, or is escalated to it when the fast answer is
+"inconnu", fails validation (see validation.py), or the fast call failed.
+
+The tier and escalation of every field are recorded on its span and counted by the
+usage meter of the job (see `UsageMeter.record_route`).
+"""
+from typing import Optional
+
+from .validation import is_unknown, validate_answer
+
+FAST = "fast"
+STRONG = "strong"
+
+# Escalation reasons
+UNKNOWN = "unknown"
+INVALID_TYPE = "invalid_type"
+ERROR = "error"
+
+
+def choose_tier(complex_field: bool, fast_available: bool) -> str:
+    """Tier a field is first asked to"""
+    return STRONG if complex_field or not fast_available else FAST
+
+
+def escalation_reason(answer: Optional[str], kind: str) -> Optional[str]:
+    """Why a fast answer must be asked again to the strong model, None if it is fine.
+
+    Args:
+        answer: Final text of the agent, None when the call failed
+        kind: Kind of answer expected (see `validation.answer_kind`)
+    """
+    if answer is None:
+        return ERROR
+    if is_unknown(answer):
+        return UNKNOWN
+    if not validate_answer(answer, kind).ok:
+        return INVALID_TYPE
+    return None
@@ -1,17 +1,33 @@
 from haystack.components.websearch import SerperDevWebSearch
 # from haystack.utils import Secret
 
-from typing import Annotated, List
+from functools import lru_cache
+from typing import Annotated, Any, Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 import os
+import re
+import unicodedata
 
 from pydantic import BaseModel
 from openai import OpenAI
 
+from .cassette import through_cassette
+from .resilience import CircuitBreaker, ResilientCall
+
 # Load environment variables for Keys
 load_dotenv()
 
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+# A Perplexity call not answered within this delay is given up (the field goes on without it)
+PERPLEXITY_DEADLINE_SECONDS = float(os.getenv("PERPLEXITY_DEADLINE_SECONDS", "30"))
+# Delay before the first hedge, until enough latencies were observed to use their p95
+PERPLEXITY_HEDGE_DELAY_SECONDS = float(os.getenv("PERPLEXITY_HEDGE_DELAY_SECONDS", "8"))
+
+# Returned to the agent when Perplexity is failing, so it answers from the conversation
+NO_TOOL_RESULT = (
+    "Aucun résultat : l'outil de recherche est indisponible. "
+    "Répondez avec les informations déjà disponibles, ou 'inconnu'."
+)
 
 def tool(func):
     """Decorator to automatically register functions as tools"""
@@ -22,6 +38,48 @@ class PerplexityResponse(BaseModel):
     content: str
     citations: List[str]
 
+
+def make_perplexity_guard() -> ResilientCall:
+    """Deadline, hedging and circuit breaker policy of the Perplexity calls"""
+    return ResilientCall(
+        "perplexity",
+        deadline=PERPLEXITY_DEADLINE_SECONDS,
+        initial_hedge_delay=PERPLEXITY_HEDGE_DELAY_SECONDS,
+        breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30.0),
+    )
+
+
+perplexity_guard = make_perplexity_guard()
+
+
+def resilient_sonar_pro_call(
+    message: str,
+    search: Callable[[], PerplexityResponse],
+    guard: Optional[ResilientCall] = None,
+) -> PerplexityResponse:
+    """Run a sonar-pro search through the cassette hook and the resilience guard"""
+    guard = guard or perplexity_guard
+    return through_cassette(
+        "perplexity",
+        {"model": "sonar-pro", "message": message},
+        lambda: guard.call(
+            search, fallback=lambda: PerplexityResponse(content=NO_TOOL_RESULT, citations=[])
+        ),
+        encode=lambda response: response.model_dump(),
+        decode=lambda recorded: PerplexityResponse(**recorded),
+    )
+
+
+@lru_cache(maxsize=1)
+def _perplexity_client() -> OpenAI:
+    # No client retries: the guard hedges instead, and abandoned attempts end at the deadline
+    return OpenAI(
+        api_key=PERPLEXITY_API_KEY,
+        base_url="https://api.perplexity.ai",
+        timeout=PERPLEXITY_DEADLINE_SECONDS,
+        max_retries=0,
+    )
+
 @tool
 def get_sonar_pro_response(message: str) -> PerplexityResponse:
     """
@@ -44,13 +102,131 @@ def get_sonar_pro_response(message: str) -> PerplexityResponse:
         print(response.content)  # Prints the generated response
         print(response.citations)  # Prints the list of citations
     """
-    client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai")
+    def call_perplexity() -> PerplexityResponse:
+        messages = [
+            {"role": "user", "content": message}
+        ]
+        response = _perplexity_client().chat.completions.create(model="sonar-pro", messages=messages)
+        return PerplexityResponse(content=response.choices[0].message.content, citations=response.citations)
+
+    return resilient_sonar_pro_call(message, call_perplexity)
+
+def make_local_document_search(sirens: List[str]) -> Optional[Callable[[str], str]]:
+    """Build the tool searching the local documents (budget reports...) of a commune and
+    its EPCI, or None when the RAG index has no document for them"""
+    from .hybrid_retrieval import get_local_retriever
+
+    retriever = get_local_retriever()
+    filters = {"siren": [str(siren) for siren in sirens]}
+    if retriever is None or not retriever.index.filter_mask(filters).any():
+        return None
+
+    def search_local_documents(query: str) -> str:
+        """
+        Search the local documents of the commune and its intercommunality (budget
+        reports, comptes administratifs, ROB/DOB...). Faster than a web search: use it
+        first for budget, debt and project questions.
+
+        Args:
+            query: Keywords or question to look up in the documents.
+
+        Returns:
+            str: The most relevant passages with their source and page.
+        """
+        documents = retriever.retrieve(query, filters=filters)
+        if not documents:
+            return "Aucun passage pertinent dans les documents locaux."
+        return "\n\n".join(
+            f"[{document.meta.get('source')}, p. {document.meta.get('page')}] {document.content}"
+            for document in documents
+        )
+
+    return search_local_documents
+
+def _fold(text: str) -> str:
+    """Lowercase text without accents nor punctuation, to match names written loosely"""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def _format_euros(amount: float) -> str:
+    return f"{amount:,.2f}".replace(",", " ") + " €"
+
+
+def make_financial_aggregate_lookup(entities: Dict[str, Optional[Dict[str, Any]]]) -> Optional[Callable[..., str]]:
+    """Build the tool answering OFGL aggregates from the data prefetched for the fiche,
+    or None when there is none.
+
+    Args:
+        entities: Aggregates of each entity (commune, EPCI) by name, as returned under
+            the "aggregates" key of `util.get_*_finances_series(..., with_aggregates=True)`
+    """
+    # (entity, aggregate) -> {year: (montant, euros_par_habitant)}, names folded
+    table: Dict[Tuple[str, str], Dict[int, Tuple[Optional[float], Optional[float]]]] = {}
+    names: Dict[str, str] = {}
+    entity_names: Dict[str, str] = {}
+    for entity, aggregates in entities.items():
+        if not aggregates or not aggregates.get("aggregates"):
+            continue
+        entity_names[_fold(entity)] = entity
+        for agregat, columns in aggregates["aggregates"].items():
+            names[_fold(agregat)] = agregat
+            table[(_fold(entity), _fold(agregat))] = {
+                year: (montant, per_capita)
+                for year, montant, per_capita in zip(
+                    aggregates["years"], columns["montant"], columns["euros_par_habitant"]
+                )
+            }
+    if not table:
+        return None
+
+    def match(query: str, candidates: Dict[str, str]) -> Optional[str]:
+        """The candidate named like the query, or sharing the most words with it"""
+        folded = _fold(query)
+        if folded in candidates:
+            return folded
+        words = set(folded.split())
+        scores = {key: len(words & set(key.split())) / len(words | set(key.split())) for key in candidates}
+        best = max(scores, key=scores.get, default=None)
+        return best if best is not None and scores[best] > 0 else None
+
+    def get_financial_aggregate(aggregate: str, entity: str, year: Optional[int] = None) -> str:
+        """
+        Look up an official OFGL financial aggregate (amount and amount per inhabitant)
+        of the commune or of its intercommunality. Instantaneous and exact: use it for
+        any budget, debt or savings figure instead of a web search.
+
+        Args:
+            aggregate: Name of the aggregate, e.g. 'Encours de dette', 'Epargne brute',
+                'Recettes de fonctionnement', 'Dépenses d'investissement'.
+            entity: Name of the commune or of the intercommunality.
+            year: Year of the accounts (the most recent year when omitted).
+
+        Returns:
+            str: The amount and the amount per inhabitant, or the available names.
+        """
+        entity_key = match(entity, entity_names)
+        if entity_key is None:
+            return f"Entité inconnue. Entités disponibles : {', '.join(entity_names.values())}."
+        aggregate_key = match(aggregate, names)
+        series = table.get((entity_key, aggregate_key)) if aggregate_key else None
+        if series is None:
+            return f"Agrégat inconnu. Agrégats disponibles : {', '.join(sorted(names.values()))}."
+        known = [y for y, (montant, _) in series.items() if montant is not None]
+        if not known:
+            return "inconnu"
+        year = int(year) if year else max(known)
+        if year not in known:
+            return f"Pas de donnée pour {year}. Années disponibles : {', '.join(map(str, sorted(known)))}."
+
+        montant, per_capita = series[year]
+        answer = f"{names[aggregate_key]} de {entity_names[entity_key]} en {year} : {_format_euros(montant)}"
+        if per_capita is not None:
+            answer += f" ({_format_euros(per_capita)} par habitant)"
+        return answer + " (source : OFGL)"
 
-    messages = [
-        {"role": "user", "content": message}
-    ]
-    response = client.chat.completions.create(model="sonar-pro", messages=messages)
-    return PerplexityResponse(content=response.choices[0].message.content, citations=response.citations)
+    return get_financial_aggregate
 
 #def get_sonar_response(message: str) -> PerplexityResponse:
 #    """
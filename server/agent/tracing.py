@@ -0,0 +1,290 @@
+"""Lightweight spans for the fiche generation hot path.
+
+A `Tracer` collects the spans of one job: orchestrator sections, fields, agent LLM
+calls, tool invocations and OFGL fetches. Spans record their duration, parent and
+attributes (retries, input/output tokens, cache hits, ...). They can be exported as
+JSON lines or as OpenTelemetry (OTLP/JSON) spans, and summarised per job.
+
+The current tracer and span are held in context variables, so code deep in the call
+stack (agents, tools, util) can open spans without having a tracer passed around.
+When no tracer is active, `span()` is a no-op.
+"""
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Directory where the worker writes the spans of each job (disabled if unset)
+TRACE_DIR = os.getenv("HGENAI_TRACE_DIR")
+# "jsonl" or "otel"
+TRACE_FORMAT = os.getenv("HGENAI_TRACE_FORMAT", "jsonl")
+
+_current_tracer: contextvars.ContextVar[Optional["Tracer"]] = contextvars.ContextVar(
+    "hgenai_tracer", default=None
+)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "hgenai_span", default=None
+)
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_s(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add(self, key: str, amount: float = 1) -> None:
+        """Increment a numeric attribute (e.g. retries)"""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        span = asdict(self)
+        span["duration_s"] = round(self.duration_s, 6)
+        return span
+
+
+class _NoopSpan:
+    """Returned by span() when tracing is off; accepts and discards attributes"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add(self, key: str, amount: float = 1) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Collects the spans of one job"""
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["Tracer"]:
+        """Make this tracer the current one for the block"""
+        token = _current_tracer.set(self)
+        try:
+            yield self
+        finally:
+            _current_tracer.reset(token)
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        current = Span(
+            name=name,
+            kind=kind,
+            trace_id=self.trace_id,
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent else None,
+            start_ns=time.time_ns(),
+            attributes=dict(attributes),
+        )
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.status = "error"
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current.end_ns = time.time_ns()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(current)
+
+    def finished_spans(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def to_jsonl(self) -> str:
+        return "\n".join(
+            json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+            for span in self.finished_spans()
+        )
+
+    def to_otel(self) -> Dict[str, Any]:
+        """Spans in the OTLP/JSON format accepted by OpenTelemetry collectors"""
+
+        def attribute(key: str, value: Any) -> Dict[str, Any]:
+            if isinstance(value, bool):
+                typed = {"boolValue": value}
+            elif isinstance(value, int):
+                typed = {"intValue": str(value)}
+            elif isinstance(value, float):
+                typed = {"doubleValue": value}
+            else:
+                typed = {"stringValue": str(value)}
+            return {"key": key, "value": typed}
+
+        spans = []
+        for span in self.finished_spans():
+            attributes = [attribute("hgenai.kind", span.kind)]
+            attributes += [attribute(k, v) for k, v in span.attributes.items()]
+            otel_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 3 if span.kind in ("llm", "tool", "ofgl") else 1,  # CLIENT / INTERNAL
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                "attributes": attributes,
+                "status": {"code": 2, "message": span.error} if span.status == "error" else {"code": 1},
+            }
+            if span.parent_id:
+                otel_span["parentSpanId"] = span.parent_id
+            spans.append(otel_span)
+
+        resource = [attribute("service.name", "h-genai")]
+        if self.job_id:
+            resource.append(attribute("hgenai.job_id", self.job_id))
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": resource},
+                "scopeSpans": [{"scope": {"name": "h-genai"}, "spans": spans}],
+            }]
+        }
+
+    def export(self, directory: str, fmt: str = TRACE_FORMAT) -> str:
+        """Write the spans to `<directory>/<job_id>.<jsonl|otel.json>` and return the path"""
+        os.makedirs(directory, exist_ok=True)
+        name = self.job_id or self.trace_id
+        if fmt == "otel":
+            path = os.path.join(directory, f"{name}.otel.json")
+            content = json.dumps(self.to_otel(), ensure_ascii=False)
+        else:
+            path = os.path.join(directory, f"{name}.jsonl")
+            content = self.to_jsonl()
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        """Per-job summary: totals per span kind, section durations and errors, and slowest fields"""
+        spans = self.finished_spans()
+        by_kind: Dict[str, Dict[str, Any]] = defaultdict(
+            lambda: {"count": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0}
+        )
+        totals: Dict[str, float] = defaultdict(float)
+
+        for span in spans:
+            stats = by_kind[span.kind]
+            stats["count"] += 1
+            stats["errors"] += int(span.status == "error")
+            stats["total_s"] += span.duration_s
+            stats["max_s"] = max(stats["max_s"], span.duration_s)
+            for key in ("input_tokens", "output_tokens", "retries"):
+                if isinstance(span.attributes.get(key), (int, float)):
+                    totals[key] += span.attributes[key]
+            if span.attributes.get("cache_hit"):
+                totals["cache_hits"] += 1
+
+        for stats in by_kind.values():
+            stats["total_s"] = round(stats["total_s"], 3)
+            stats["max_s"] = round(stats["max_s"], 3)
+
+        fields = sorted(
+            (s for s in spans if s.kind == "field"), key=lambda s: s.duration_s, reverse=True
+        )
+        roots = [s for s in spans if s.parent_id is None]
+        sections = [s for s in spans if s.kind == "section"]
+
+        def section_name(s: Span) -> str:
+            return s.name + (f"[{s.attributes['inter']}]" if "inter" in s.attributes else "")
+
+        return {
+            "job_id": self.job_id,
+            "trace_id": self.trace_id,
+            "wall_time_s": round(
+                (max(s.end_ns or s.start_ns for s in roots) - min(s.start_ns for s in roots)) / 1e9, 3
+            ) if roots else 0.0,
+            "by_kind": dict(by_kind),
+            "sections": {section_name(s): round(s.duration_s, 3) for s in sections},
+            "failed_sections": {section_name(s): s.error for s in sections if s.status == "error"},
+            "slowest_fields": [
+                {"name": s.name, "duration_s": round(s.duration_s, 3), **s.attributes}
+                for s in fields[:top]
+            ],
+            **{key: int(value) for key, value in totals.items()},
+        }
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _current_tracer.get()
+
+
+@contextmanager
+def span(name: str, kind: str, **attributes: Any) -> Iterator[Any]:
+    """Open a span on the current tracer (a no-op span if tracing is off)"""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield NOOP_SPAN
+        return
+    with tracer.span(name, kind, **attributes) as current:
+        yield current
+
+
+def current_span() -> Any:
+    return _current_span.get() or NOOP_SPAN
+
+
+def traced(kind: str, name: Optional[str] = None) -> Callable:
+    """Decorator opening a span around a function.
+
+    Simple keyword/positional arguments (bool, int, str) become span attributes.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+        code = func.__code__
+        arg_names = code.co_varnames[: code.co_argcount]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_tracer.get() is None:
+                return func(*args, **kwargs)
+            attributes = {
+                key: value
+                for key, value in list(zip(arg_names, args)) + list(kwargs.items())
+                if key != "self" and isinstance(value, (bool, int, str))
+            }
+            with span(span_name, kind, **attributes):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def in_context(func: Callable, *args: Any, **kwargs: Any) -> Callable[[], Any]:
+    """Bind a call to the current context, so spans opened in a worker thread keep their parent"""
+    context = contextvars.copy_context()
+    return lambda: context.run(func, *args, **kwargs)
@@ -0,0 +1,186 @@
+"""Token and cost accounting for the generation of one fiche.
+
+A `UsageMeter` accumulates the Bedrock input/output tokens (read from the reply
+metadata of the chat generator) and the tool calls of one orchestrator run, and
+prices them with `PRICES`. It may carry a `Budget`: once the budget is exhausted the
+orchestrator stops asking the agent for low-priority fields and fills them with
+"inconnu".
+
+Like the tracer, the current meter is held in a context variable so `_generate` and
+the tool agent can record usage without having the meter passed around.
+"""
+import contextvars
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+# USD per million input/output tokens, per Bedrock model id
+PRICES: Dict[str, Dict[str, float]] = {
+    "anthropic.claude-3-5-sonnet-20241022-v2:0": {"input": 3.0, "output": 15.0},
+    "anthropic.claude-3-5-haiku-20241022-v1:0": {"input": 0.8, "output": 4.0},
+    "mistral.mistral-large-2407-v1:0": {"input": 2.0, "output": 6.0},
+}
+# USD per call of each tool (request fee plus typical tokens of a sonar-pro answer)
+TOOL_PRICES: Dict[str, float] = {
+    "get_sonar_pro_response": float(os.getenv("SONAR_PRO_CALL_PRICE_USD", "0.01")),
+}
+
+# Optional per-job budgets (unset means unlimited)
+JOB_TOKEN_BUDGET = os.getenv("JOB_TOKEN_BUDGET")
+JOB_COST_BUDGET_USD = os.getenv("JOB_COST_BUDGET_USD")
+
+_current_meter: contextvars.ContextVar[Optional["UsageMeter"]] = contextvars.ContextVar(
+    "hgenai_usage_meter", default=None
+)
+
+
+@dataclass(frozen=True)
+class Budget:
+    """Maximum total tokens (input + output) and/or cost of a job"""
+
+    max_tokens: Optional[int] = None
+    max_cost_usd: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["Budget"]:
+        if not JOB_TOKEN_BUDGET and not JOB_COST_BUDGET_USD:
+            return None
+        return cls(
+            max_tokens=int(JOB_TOKEN_BUDGET) if JOB_TOKEN_BUDGET else None,
+            max_cost_usd=float(JOB_COST_BUDGET_USD) if JOB_COST_BUDGET_USD else None,
+        )
+
+
+class UsageMeter:
+    """Accumulates the token usage, tool calls and cost of one job"""
+
+    def __init__(self, budget: Optional[Budget] = None):
+        self.budget = budget
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.llm_calls = 0
+        self.tool_calls: Counter = Counter()
+        # Fields answered "inconnu" because the budget was exhausted
+        self.skipped_fields = 0
+        # Fields answered by each model tier, and escalations to the strong tier by reason
+        self.model_routes: Counter = Counter()
+        self.escalations: Counter = Counter()
+        # Invalid answers asked again, and how many of them became valid
+        self.reasks = 0
+        self.recovered_reasks = 0
+        # Memory figures at the end of the job (see conversations.memory_usage)
+        self.memory: Optional[Dict[str, Any]] = None
+        self._cost_usd = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["UsageMeter"]:
+        """Make this meter the current one for the block"""
+        token = _current_meter.set(self)
+        try:
+            yield self
+        finally:
+            _current_meter.reset(token)
+
+    def record_llm(self, model: Optional[str], input_tokens: int, output_tokens: int) -> None:
+        price = PRICES.get(model or "", {"input": 0.0, "output": 0.0})
+        with self._lock:
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self._cost_usd += (
+                input_tokens * price["input"] + output_tokens * price["output"]
+            ) / 1_000_000
+
+    def record_tool(self, name: str) -> None:
+        with self._lock:
+            self.tool_calls[name] += 1
+            self._cost_usd += TOOL_PRICES.get(name, 0.0)
+
+    def record_skipped_field(self) -> None:
+        with self._lock:
+            self.skipped_fields += 1
+
+    def record_route(self, tier: str, escalation: Optional[str] = None) -> None:
+        """Count the tier that answered a field, and why it was escalated (if it was)"""
+        with self._lock:
+            self.model_routes[tier] += 1
+            if escalation is not None:
+                self.escalations[escalation] += 1
+
+    def record_reask(self, recovered: bool) -> None:
+        """Count a field asked again after an invalid answer"""
+        with self._lock:
+            self.reasks += 1
+            self.recovered_reasks += int(recovered)
+
+    def record_memory(self, memory: Dict[str, Any]) -> None:
+        with self._lock:
+            self.memory = dict(memory)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def cost_usd(self) -> float:
+        return self._cost_usd
+
+    def exhausted(self) -> bool:
+        """Whether the job has used up its budget"""
+        if self.budget is None:
+            return False
+        if self.budget.max_tokens is not None and self.total_tokens >= self.budget.max_tokens:
+            return True
+        if self.budget.max_cost_usd is not None and self.cost_usd >= self.budget.max_cost_usd:
+            return True
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            usage = {
+                "llm_calls": self.llm_calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "tool_calls": dict(self.tool_calls),
+                "cost_usd": round(self._cost_usd, 6),
+                "skipped_fields": self.skipped_fields,
+                "validation": {"reasks": self.reasks, "recovered": self.recovered_reasks},
+                "routing": {
+                    "fields": dict(self.model_routes),
+                    "escalations": dict(self.escalations),
+                    "escalation_rate": round(
+                        sum(self.escalations.values()) / max(1, sum(self.model_routes.values())), 4
+                    ),
+                },
+            }
+        if self.memory is not None:
+            usage["memory"] = self.memory
+        if self.budget is not None:
+            usage["budget"] = {
+                "max_tokens": self.budget.max_tokens,
+                "max_cost_usd": self.budget.max_cost_usd,
+                "exhausted": self.exhausted(),
+            }
+        return usage
+
+
+def current_meter() -> Optional[UsageMeter]:
+    return _current_meter.get()
+
+
+def record_llm_usage(model: Optional[str], input_tokens: int, output_tokens: int) -> None:
+    """Add the usage of an LLM reply to the current meter (if any)"""
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.record_llm(model, input_tokens, output_tokens)
+
+
+def record_tool_call(name: str) -> None:
+    """Count a tool call on the current meter (if any)"""
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.record_tool(name)
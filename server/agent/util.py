@@ -1,9 +1,127 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Tuple, Dict, Any, List, Union
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Dict, Any, List, Union
 
+import numpy as np
 import pandas as pd
 import requests
 
+from .cassette import through_cassette
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Base URL of the OFGL open data API (overridable to point at a mirror or a fake server)
+OFGL_API_URL = os.getenv("OFGL_API_URL", "https://data.ofgl.fr/api/explore/v2.1/catalog/datasets")
+
+# Years available in the OFGL datasets, the last one being the year shown on the fiches
+OFGL_SERIES_YEARS = tuple(str(year) for year in range(2016, 2024))
+
+# Columns of the year x metric matrices of `get_*_finances_series`
+SERIES_METRICS = [
+    "population",
+    "total_budget",
+    "total_budget_per_person",
+    "debt_repayment_capacity",
+    "debt_ratio",
+    "debt_duration",
+    "management_savings_per_capita",
+    "management_savings_ratio",
+    "gross_savings_per_capita",
+    "gross_savings_ratio",
+    "net_savings_per_capita",
+    "net_savings_ratio",
+    "debt_service_to_operating_revenue_ratio",
+]
+
+
+class OFGLCache:
+    """Successful OFGL responses shared by the fiches of a process (e.g. a batch run).
+
+    Concurrent requests for the same query wait for the first one instead of fetching
+    it again. Failed responses are not cached.
+    """
+
+    def __init__(self):
+        self._responses: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, fetch: Callable[[], Tuple[int, Any]]) -> Tuple[Tuple[int, Any], bool]:
+        """Return the response for `key` and whether it came from the cache"""
+        with self._lock:
+            future = self._responses.get(key)
+            owner = future is None
+            if owner:
+                future = self._responses[key] = Future()
+        if not owner:
+            return future.result(), True
+
+        try:
+            response = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._responses[key]
+            future.set_exception(e)
+            raise
+        if response[0] != 200:
+            with self._lock:
+                del self._responses[key]
+        future.set_result(response)
+        return response, False
+
+
+_ofgl_cache: Optional[OFGLCache] = None
+
+
+@contextmanager
+def use_ofgl_cache(cache: Optional[OFGLCache] = None) -> Iterator[OFGLCache]:
+    """Share the OFGL responses between all the fiches generated in the block"""
+    global _ofgl_cache
+    previous = _ofgl_cache
+    _ofgl_cache = cache or OFGLCache()
+    try:
+        yield _ofgl_cache
+    finally:
+        _ofgl_cache = previous
+
+
+def _get_ofgl_json(dataset: str, params: Dict[str, str]) -> Tuple[int, Any]:
+    """Query an OFGL dataset export, returning the status code and the JSON body (or text on error).
+
+    The exchange goes through the active cassette, if any, so it can be recorded/replayed,
+    and is served from the shared cache when one is active (see `use_ofgl_cache`).
+    """
+    def fetch() -> Tuple[int, Any]:
+        response = requests.get(f"{OFGL_API_URL}/{dataset}/exports/json", params=params)
+        if response.status_code == 200:
+            return response.status_code, response.json()
+        return response.status_code, response.text
+
+    def fetch_through_cassette() -> Tuple[int, Any]:
+        return through_cassette(
+            "ofgl",
+            {"dataset": dataset, "params": params},
+            fetch,
+            encode=list,
+            decode=tuple,
+        )
+
+    with span(f"ofgl.{dataset}", "ofgl", where=params.get("where", "")) as ofgl_span:
+        cache = _ofgl_cache
+        if cache is None:
+            status_code, body = fetch_through_cassette()
+        else:
+            key = json.dumps([dataset, params], sort_keys=True)
+            (status_code, body), cache_hit = cache.get(key, fetch_through_cassette)
+            ofgl_span.set_attribute("cache_hit", cache_hit)
+        ofgl_span.set_attribute("status_code", status_code)
+    return status_code, body
+
 def _process_financial_results(results: List[Dict[str, Any]], year: str, is_commune: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Any]]:
     """Helper function to process financial results and create DataFrames and metrics.
     
@@ -164,9 +282,7 @@ def get_commune_finances_by_siren(
                 - net_savings_ratio (float): Net savings ratio
                 - debt_service_to_operating_revenue_ratio (float): Debt service to operating revenue ratio
     """
-    base_url = "https://data.ofgl.fr/api/explore/v2.1/catalog/datasets"
     dataset = "ofgl-base-communes-consolidee"
-    endpoint = f"{base_url}/{dataset}/exports/json"
 
     # Ensure year is a properly formatted 4-digit string
     year = str(datetime.strptime(year, "%Y").year)  # Converts to YYYY format
@@ -179,14 +295,12 @@ def get_commune_finances_by_siren(
                   "touristique,qpv,epci_name")
     }
 
-    response = requests.get(endpoint, params=params)
+    status_code, body = _get_ofgl_json(dataset, params)
 
-    if response.status_code == 200:
-        results = response.json()
-        return _process_financial_results(results, year, is_commune=True)
+    if status_code == 200:
+        return _process_financial_results(body, year, is_commune=True)
     else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
+        logger.warning(f"OFGL request to {dataset} failed ({status_code}): {body}")
         return pd.DataFrame(), pd.DataFrame(), {}
 
 def get_epci_finances_by_code(
@@ -222,9 +336,7 @@ def get_epci_finances_by_code(
                 - net_savings_ratio (float): Net savings ratio
                 - debt_service_to_operating_revenue_ratio (float): Debt service to operating revenue ratio
     """
-    base_url = "https://data.ofgl.fr/api/explore/v2.1/catalog/datasets"
     dataset = "ofgl-base-ei"
-    endpoint = f"{base_url}/{dataset}/exports/json"
 
     # Ensure year is a properly formatted 4-digit string
     year = str(datetime.strptime(year, "%Y").year)  # Converts to YYYY format
@@ -237,12 +349,188 @@ def get_epci_finances_by_code(
                   "gfp_qpv,reg_name,dep_name")
     }
 
-    response = requests.get(endpoint, params=params)
+    status_code, body = _get_ofgl_json(dataset, params)
 
-    if response.status_code == 200:
-        results = response.json()
-        return _process_financial_results(results, year, is_commune=False)
+    if status_code == 200:
+        return _process_financial_results(body, year, is_commune=False)
     else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return pd.DataFrame(), pd.DataFrame(), {}
\ No newline at end of file
+        logger.warning(f"OFGL request to {dataset} failed ({status_code}): {body}")
+        return pd.DataFrame(), pd.DataFrame(), {}
+
+def _financial_series(results: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Compute the metrics of `_process_financial_results` for every year of the results at once.
+
+    Returns the year x metric matrix (indexed by year, columns SERIES_METRICS) and the
+    year-over-year deltas (NaN for the first year). Metrics that can't be computed
+    for a year (missing aggregate, division by zero) are NaN.
+    """
+    if not results:
+        empty = pd.DataFrame(columns=SERIES_METRICS, dtype=float)
+        return empty, empty
+
+    rows = pd.DataFrame(results)
+    rows["year"] = rows["exer"].str[:4].astype(int)
+    # Same 2-decimal precision as the amounts formatted by _process_financial_results
+    amounts = rows.pivot_table(index="year", columns="agregat", values="montant", aggfunc="first").round(2)
+    per_capita = rows.pivot_table(index="year", columns="agregat", values="euros_par_habitant", aggfunc="first").round(2)
+
+    def amount(agregat: str, frame: pd.DataFrame = amounts) -> pd.Series:
+        if agregat in frame:
+            return frame[agregat]
+        return pd.Series(np.nan, index=frame.index)
+
+    def nonzero(series: pd.Series) -> pd.Series:
+        return series.where(series != 0)
+
+    debt = amount("Encours de dette")
+    operating_revenue = nonzero(amount("Recettes de fonctionnement"))
+    values = pd.DataFrame({
+        "population": rows.groupby("year")["ptot"].first(),
+        "total_budget": (debt / 1_000_000).round(),
+        "total_budget_per_person": amount("Encours de dette", per_capita).round(),
+        "debt_repayment_capacity": (debt / nonzero(amount("Epargne brute"))).round(1),
+        "debt_ratio": (debt / operating_revenue * 100).round(2),
+        "debt_duration": (debt / nonzero(amount("Remboursements d'emprunts hors GAD"))).round(1),
+        "management_savings_per_capita": amount("Epargne de gestion", per_capita).round(),
+        "management_savings_ratio": (amount("Epargne de gestion") / nonzero(amount("Recettes totales")) * 100).round(2),
+        "gross_savings_per_capita": amount("Epargne brute", per_capita).round(),
+        "gross_savings_ratio": (amount("Epargne brute") / operating_revenue * 100).round(2),
+        "net_savings_per_capita": amount("Epargne nette", per_capita).round(),
+        "net_savings_ratio": (amount("Epargne nette") / operating_revenue * 100).round(2),
+        "debt_service_to_operating_revenue_ratio": (amount("Annuité de la dette") / operating_revenue * 100).round(2),
+    }, index=amounts.index)[SERIES_METRICS]
+    values.index.name = "year"
+    return values, values.diff()
+
+
+def finance_series_to_dict(values: pd.DataFrame, deltas: pd.DataFrame) -> Dict[str, Any]:
+    """Compact JSON-serialisable form of a series: the years, the metrics and the
+    year x metric values and deltas (None where unknown)"""
+    def matrix(frame: pd.DataFrame) -> List[List[Optional[float]]]:
+        return [[None if pd.isna(v) else float(v) for v in row] for row in frame.to_numpy()]
+
+    return {
+        "years": [int(year) for year in values.index],
+        "metrics": list(values.columns),
+        "values": matrix(values),
+        "deltas": matrix(deltas),
+    }
+
+
+def _aggregate_series(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Amount and per-capita amount of every OFGL aggregate for each year of the results,
+    in a JSON-serialisable form (None where unknown):
+    {"years": [...], "aggregates": {agregat: {"montant": [...], "euros_par_habitant": [...]}}}"""
+    if not results:
+        return {"years": [], "aggregates": {}}
+
+    rows = pd.DataFrame(results)
+    rows["year"] = rows["exer"].str[:4].astype(int)
+    years = sorted(rows["year"].unique().tolist())
+    agregats = sorted(rows["agregat"].unique().tolist())
+    tables = {
+        column: rows.pivot_table(index="agregat", columns="year", values=column, aggfunc="first")
+        .reindex(index=agregats, columns=years).round(2)
+        for column in ("montant", "euros_par_habitant")
+    }
+
+    def values(agregat: str, column: str) -> List[Optional[float]]:
+        return [None if pd.isna(v) else float(v) for v in tables[column].loc[agregat]]
+
+    return {
+        "years": years,
+        "aggregates": {agregat: {column: values(agregat, column) for column in tables} for agregat in agregats},
+    }
+
+
+def _years_clause(years: Iterable[str]) -> str:
+    years = sorted({str(datetime.strptime(str(year), "%Y").year) for year in years})
+    return "year(exer) IN (" + ",".join(f"'{year}'" for year in years) + ")"
+
+
+def _get_finances_series(
+    dataset: str, where: str, select: str, years: Iterable[str], is_commune: bool, with_aggregates: bool = False
+) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Union[int, float, None]]]:
+    years = list(years)
+    params = {
+        "where": f"{where} AND {_years_clause(years)}",
+        "order_by": "exer,agregat",
+        "select": select,
+    }
+    status_code, body = _get_ofgl_json(dataset, params)
+    if status_code != 200:
+        logger.warning(f"OFGL request to {dataset} failed ({status_code}): {body}")
+        empty = pd.DataFrame(columns=SERIES_METRICS, dtype=float)
+        return empty, empty, {}
+
+    values, deltas = _financial_series(body)
+    latest = max(years, key=int)
+    latest_results = [row for row in body if row["exer"].startswith(latest)]
+    _, _, metrics = _process_financial_results(latest_results, latest, is_commune=is_commune)
+    if with_aggregates and metrics:
+        metrics["aggregates"] = _aggregate_series(body)
+    return values, deltas, metrics
+
+
+def get_commune_finances_series(
+    siren: str,
+    years: Iterable[str] = OFGL_SERIES_YEARS,
+    with_aggregates: bool = False
+) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Union[int, float, None]]]:
+    """Get the financial metrics of a commune for several years in a single request.
+
+    Args:
+        siren: SIREN number of the commune as a 9-digit string
+        years: Years of data as strings in YYYY format. Defaults to 2016-2023
+        with_aggregates: Also return every OFGL aggregate per year under the
+            "aggregates" key of the metrics (see `_aggregate_series`)
+
+    Returns:
+        Tuple containing:
+            - pd.DataFrame: Year x metric matrix (see SERIES_METRICS)
+            - pd.DataFrame: Year-over-year deltas of the metrics
+            - Dict[str, Union[int, float, None]]: Key financial metrics of the most recent
+              year, as returned by get_commune_finances_by_siren
+    """
+    return _get_finances_series(
+        "ofgl-base-communes-consolidee",
+        f"siren='{siren}'",
+        ("exer,com_name,siren,insee,agregat,montant,montant_bp,montant_ba,"
+         "montant_flux,euros_par_habitant,ptot,rural,montagne,"
+         "touristique,qpv,epci_name"),
+        years,
+        is_commune=True,
+        with_aggregates=with_aggregates,
+    )
+
+
+def get_epci_finances_series(
+    epci_code: str,
+    years: Iterable[str] = OFGL_SERIES_YEARS,
+    with_aggregates: bool = False
+) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Union[int, float, None]]]:
+    """Get the financial metrics of an EPCI for several years in a single request.
+
+    Args:
+        epci_code: EPCI identification code as a string
+        years: Years of data as strings in YYYY format. Defaults to 2016-2023
+        with_aggregates: Also return every OFGL aggregate per year under the
+            "aggregates" key of the metrics (see `_aggregate_series`)
+
+    Returns:
+        Tuple containing:
+            - pd.DataFrame: Year x metric matrix (see SERIES_METRICS)
+            - pd.DataFrame: Year-over-year deltas of the metrics
+            - Dict[str, Union[int, float, None]]: Key financial metrics of the most recent
+              year, as returned by get_epci_finances_by_code
+    """
+    return _get_finances_series(
+        "ofgl-base-ei",
+        f"epci_code='{epci_code}'",
+        ("exer,epci_name,epci_code,siren,agregat,montant,montant_gfp,montant_communes,"
+         "montant_flux,euros_par_habitant,ptot,nat_juridique,mode_financement,"
+         "gfp_qpv,reg_name,dep_name"),
+        years,
+        is_commune=False,
+        with_aggregates=with_aggregates,
+    )
@@ -0,0 +1,200 @@
+"""Local validation and normalisation of the field answers.
+
+The prompts ask for "150000 habitants"-like answers, but the model sometimes replies
+with a sentence, a refusal or no number at all. `validate_answer` checks an answer
+against the kind of its field and returns it normalised:
+
+- number: the first number with its unit ("La superficie est de 40,4 km²." ->
+  "40,4 km²"), French and English digit grouping accepted
+- url (the logo): the first http(s) URL of the answer
+- date (`*date*` and `*_since` fields): "25 novembre 2024", "mars 2020" or "2020",
+  from French, English, ISO or dd/mm/yyyy dates
+- string: the answer without quotes nor "Réponse :" prefix, refusals rejected
+
+"inconnu"-like answers are valid and normalised to "inconnu". When an answer is
+invalid, the orchestrator asks the field once more with the error (see
+`prompt.validation_reask_prompt`) instead of regenerating the fiche.
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlparse
+
+NUMBER = "number"
+STRING = "string"
+URL = "url"
+DATE = "date"
+
+UNKNOWN_ANSWER = "inconnu"
+_UNKNOWN_ANSWERS = {"", "inconnu", "inconnue", "unknown", "n/a", "non disponible"}
+
+
+@dataclass(frozen=True)
+class Validation:
+    """Outcome of the validation of an answer.
+
+    Attributes:
+        ok: Whether the answer fits its field
+        value: Normalised answer (the stripped answer when invalid)
+        error: Why the answer is invalid, phrased for the re-ask prompt
+    """
+
+    ok: bool
+    value: str
+    error: Optional[str] = None
+
+
+def is_unknown(answer: str) -> bool:
+    return answer.strip().strip(".!'\"").lower() in _UNKNOWN_ANSWERS
+
+
+def answer_kind(name: str, field_type: Optional[str]) -> str:
+    """Kind of answer expected for a field, from its name (e.g. "contacts[0].birth_date")
+    and its template type"""
+    field = re.sub(r"\[\d+\]", "", name).rsplit(".", 1)[-1]
+    if field == "logo" or field.endswith("url") or field == "website":
+        return URL
+    if field_type == NUMBER:
+        return NUMBER
+    if "date" in field or field.endswith("_since"):
+        return DATE
+    return STRING
+
+
+# A number with French/English thousands separators, or a plain (decimal) number
+_NUMBER = re.compile(
+    r"(?<![\w,.])[-+−]?(?:\d{1,3}(?:[ \u00a0\u202f.,]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?)(?![\w])"
+)
+# A word of the unit following a number: letters (possibly with digits, e.g. "km2"),
+# %, € or $, with an optional "/habitant"-like suffix
+_UNIT_WORD = re.compile(r"\s*([%€$]|[^\W\d_][\w'’²³-]*)(/[^\W\d_][\w'’]*)?")
+_UNIT_STOP_WORDS = {
+    "en", "au", "aux", "à", "pour", "selon", "soit", "dont", "et", "source", "in", "as", "of",
+    # A sentence going on after the number ("En 2021 la population était de ...")
+    "la", "le", "les", "l", "un", "une", "de", "des", "du", "il", "elle", "ce", "cette",
+    "est", "était", "sont", "the", "is", "was",
+}
+_MAX_UNIT_WORDS = 4
+# A year ("En 2021, ...") is only the answer when there is no other number
+_YEAR_NUMBER = re.compile(r"(1[6-9]|20)\d\d")
+
+
+def _unit(rest: str) -> str:
+    """Unit words at the start of the text following a number"""
+    words = []
+    while len(words) < _MAX_UNIT_WORDS:
+        word = _UNIT_WORD.match(rest)
+        if word is None or word.group(1).lower().rstrip("'’") in _UNIT_STOP_WORDS:
+            break
+        words.append(word.group(0).strip())
+        rest = rest[word.end():]
+    return " ".join(words)
+
+
+def _normalise_number(answer: str) -> Validation:
+    candidates = [(match.group(0), _unit(answer[match.end():])) for match in _NUMBER.finditer(answer)]
+    if not candidates:
+        return Validation(False, answer, "la réponse ne contient pas de nombre")
+
+    # The first number with a unit, otherwise the first one that isn't a bare year
+    number, unit = next(
+        (candidate for candidate in candidates if candidate[1]),
+        next((candidate for candidate in candidates if not _YEAR_NUMBER.fullmatch(candidate[0])), candidates[0]),
+    )
+    number = number.replace("−", "-")
+    # "51%" stays glued, "40,4 km²" is spaced
+    separator = "" if unit.startswith("%") else " "
+    return Validation(True, (number + separator + unit).strip())
+
+
+_URL = re.compile(r"https?://[^\s<>\"'()\[\]]+", re.IGNORECASE)
+
+
+def _normalise_url(answer: str) -> Validation:
+    for match in _URL.finditer(answer):
+        url = match.group(0).rstrip(".,;:!?")
+        parsed = urlparse(url)
+        if parsed.netloc and "." in parsed.netloc:
+            return Validation(True, url)
+    return Validation(False, answer, "la réponse ne contient pas d'URL http(s) valide")
+
+
+MONTHS = [
+    "janvier", "février", "mars", "avril", "mai", "juin",
+    "juillet", "août", "septembre", "octobre", "novembre", "décembre",
+]
+_MONTH_NAMES = {name: index for index, name in enumerate(MONTHS, 1)}
+_MONTH_NAMES.update({"fevrier": 2, "aout": 8, "decembre": 12})
+_MONTH_NAMES.update({
+    name: index for index, name in enumerate([
+        "january", "february", "march", "april", "may", "june",
+        "july", "august", "september", "october", "november", "december",
+    ], 1)
+})
+_MONTH = "(" + "|".join(sorted(_MONTH_NAMES, key=len, reverse=True)) + r")\.?"
+_YEAR = r"(1[6-9]\d\d|20\d\d)"
+_DATE_PATTERNS = [
+    # (pattern, index of the day, month and year groups)
+    (re.compile(_YEAR + r"-(\d{1,2})-(\d{1,2})"), (3, 2, 1)),
+    (re.compile(r"(\d{1,2})[/.](\d{1,2})[/.]" + _YEAR), (1, 2, 3)),
+    (re.compile(r"(\d{1,2})(?:er)?\s+" + _MONTH + r"\s+" + _YEAR, re.IGNORECASE), (1, 2, 3)),
+    (re.compile(_MONTH + r"\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+" + _YEAR, re.IGNORECASE), (2, 1, 3)),
+    (re.compile(_MONTH + r"\s+" + _YEAR, re.IGNORECASE), (None, 1, 2)),
+    (re.compile(r"(?<!\d)" + _YEAR + r"(?!\d)"), (None, None, 1)),
+]
+
+
+def _month(value: str) -> int:
+    return int(value) if value.isdigit() else _MONTH_NAMES[value.lower()]
+
+
+def _normalise_date(answer: str) -> Validation:
+    for pattern, (day_group, month_group, year_group) in _DATE_PATTERNS:
+        match = pattern.search(answer)
+        if match is None:
+            continue
+        year = match.group(year_group)
+        if month_group is None:
+            return Validation(True, year)
+        month = _month(match.group(month_group))
+        if not 1 <= month <= 12:
+            continue
+        if day_group is None:
+            return Validation(True, f"{MONTHS[month - 1]} {year}")
+        day = int(match.group(day_group))
+        if not 1 <= day <= 31:
+            continue
+        return Validation(True, f"{'1er' if day == 1 else day} {MONTHS[month - 1]} {year}")
+    return Validation(False, answer, "la réponse ne contient pas de date (avec l'année)")
+
+
+_ANSWER_PREFIX = re.compile(r"^(?:réponse|answer)\s*:\s*", re.IGNORECASE)
+_REFUSAL = re.compile(
+    r"^(?:je ne (?:peux|suis|dispose)|je n'ai pas|désolé|je suis désolé|d'après les informations|"
+    r"i cannot|i can't|i'm sorry|sorry)",
+    re.IGNORECASE,
+)
+
+
+def _normalise_string(answer: str) -> Validation:
+    value = _ANSWER_PREFIX.sub("", answer.strip()).strip().strip("\"'«»“”").strip()
+    if not value:
+        return Validation(False, answer, "la réponse est vide")
+    if _REFUSAL.match(value):
+        return Validation(False, value, "la réponse est une explication au lieu de l'information demandée")
+    return Validation(True, value)
+
+
+_NORMALISERS = {
+    NUMBER: _normalise_number,
+    URL: _normalise_url,
+    DATE: _normalise_date,
+    STRING: _normalise_string,
+}
+
+
+def validate_answer(answer: Optional[str], kind: str) -> Validation:
+    """Validate and normalise an answer of the given kind (see `answer_kind`)"""
+    if answer is None or is_unknown(answer):
+        return Validation(True, UNKNOWN_ANSWER)
+    return _NORMALISERS.get(kind, _normalise_string)(answer.strip())
@@ -0,0 +1,330 @@
+"""Persistent vector index for the RAG pipeline.
+
+The index is a directory holding:
+- `embeddings.f32`: the normalised embeddings, a float32 matrix memory-mapped by
+  `numpy.memmap`, so opening the index is instantaneous and the pages are shared by
+  all the worker processes reading it through the OS page cache,
+- `metadata.json`: the id, content, meta and content hash of each row (the sidecar),
+- `ivf.npz` (optional): an inverted-file ANN structure (k-means centroids and the
+  list of each row) to search large corpora without scoring every row.
+
+Ingestion is incremental: `upsert` only embeds the documents that are new or whose
+content or meta changed. Embeddings are flushed before the sidecar is replaced, so a
+crash during ingestion never exposes rows that were not written.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from haystack import Document, component
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.f32"
+METADATA_FILE = "metadata.json"
+IVF_FILE = "ivf.npz"
+
+# The ANN structure is built once the index has this many documents
+ANN_MIN_DOCUMENTS = int(os.getenv("RAG_ANN_MIN_DOCUMENTS", "20000"))
+
+# Embedding model of the RAG documents and queries, and the default index location
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+RAG_INDEX_DIR = os.getenv(
+    "RAG_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag_index")
+)
+
+
+def _content_hash(document: Document) -> str:
+    payload = json.dumps([document.content, document.meta], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex:
+    """Memory-mapped embeddings with a metadata sidecar and an optional IVF structure.
+
+    Scores are cosine similarities. One process should write to an index at a time;
+    readers in other processes see the new documents after `refresh()`.
+
+    Args:
+        path: Directory of the index (created if needed)
+        dim: Embedding size, required to create a new index
+        ann_min_documents: Size from which `upsert` builds the ANN structure
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None, ann_min_documents: int = ANN_MIN_DOCUMENTS):
+        self.path = path
+        self.ann_min_documents = ann_min_documents
+        self._lock = threading.RLock()
+        self._metadata_mtime: Optional[float] = None
+        os.makedirs(path, exist_ok=True)
+        self._load(dim)
+        if self._metadata_mtime is None:
+            self._save_metadata()
+
+    # Storage
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self, dim: Optional[int] = None) -> None:
+        metadata_path = self._file(METADATA_FILE)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as file:
+                metadata = json.load(file)
+            self._metadata_mtime = os.path.getmtime(metadata_path)
+        else:
+            if dim is None:
+                raise ValueError(f"No index in {self.path}: the embedding size is required to create one")
+            metadata = {"dim": dim, "rows": []}
+        if dim is not None and dim != metadata["dim"]:
+            raise ValueError(f"The index in {self.path} has embeddings of size {metadata['dim']}, not {dim}")
+
+        self.dim: int = metadata["dim"]
+        self._rows: List[Dict[str, Any]] = metadata["rows"]
+        self._positions = {row["id"]: i for i, row in enumerate(self._rows)}
+        self._live = np.array([not row.get("deleted") for row in self._rows], dtype=bool)
+        self._meta_cache: Dict[str, Dict[str, List[int]]] = {}
+        self._matrix = self._map(len(self._rows), mode="r") if self._rows else np.zeros((0, self.dim), np.float32)
+
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: Optional[np.ndarray] = None
+        if os.path.exists(self._file(IVF_FILE)):
+            with np.load(self._file(IVF_FILE)) as ivf:
+                if len(ivf["lists"]) <= len(self._rows):
+                    self._centroids, self._lists = ivf["centroids"], ivf["lists"]
+                    self._assign_lists()
+
+    def _map(self, rows: int, mode: str) -> np.memmap:
+        return np.memmap(self._file(EMBEDDINGS_FILE), dtype=np.float32, mode=mode, shape=(rows, self.dim))
+
+    def _save_metadata(self) -> None:
+        tmp_path = self._file(METADATA_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"dim": self.dim, "rows": self._rows}, file, ensure_ascii=False)
+        os.replace(tmp_path, self._file(METADATA_FILE))
+        self._metadata_mtime = os.path.getmtime(self._file(METADATA_FILE))
+
+    def _save_ivf(self) -> None:
+        tmp_path = self._file("ivf.tmp.npz")
+        np.savez(tmp_path, centroids=self._centroids, lists=self._lists)
+        os.replace(tmp_path, self._file(IVF_FILE))
+
+    def refresh(self) -> None:
+        """Reload the index if another process changed it"""
+        metadata_path = self._file(METADATA_FILE)
+        if os.path.exists(metadata_path) and os.path.getmtime(metadata_path) != self._metadata_mtime:
+            with self._lock:
+                self._load()
+
+    def __len__(self) -> int:
+        return int(self._live.sum())
+
+    def document_ids(self) -> List[str]:
+        """Ids of the documents of the index (deleted ones excluded)"""
+        return [row["id"] for row in self._rows if not row.get("deleted")]
+
+    @property
+    def has_ann(self) -> bool:
+        return self._centroids is not None
+
+    # Ingestion
+
+    def upsert(self, documents: Sequence[Document], embed: Callable[[List[Document]], Sequence[Sequence[float]]]) -> int:
+        """Add new documents and update changed ones, embedding only those.
+
+        Args:
+            documents: Documents identified by their `id`
+            embed: Returns the embeddings of a list of documents
+
+        Returns:
+            The number of documents embedded
+        """
+        with self._lock:
+            changed = []
+            for document in documents:
+                position = self._positions.get(document.id)
+                digest = _content_hash(document)
+                if position is None or self._rows[position]["hash"] != digest or self._rows[position].get("deleted"):
+                    changed.append((document, digest))
+            if not changed:
+                return 0
+
+            vectors = _normalise(np.asarray(embed([document for document, _ in changed]), dtype=np.float32))
+            if vectors.shape != (len(changed), self.dim):
+                raise ValueError(f"Expected {len(changed)} embeddings of size {self.dim}, got {vectors.shape}")
+
+            new_count = len(self._rows) + sum(1 for document, _ in changed if document.id not in self._positions)
+            # Grow the file first: memmap can't map past its end
+            with open(self._file(EMBEDDINGS_FILE), "ab") as file:
+                file.truncate(new_count * self.dim * 4)
+            matrix = self._map(new_count, mode="r+")
+
+            rows = list(self._rows)
+            positions = dict(self._positions)
+            for (document, digest), vector in zip(changed, vectors):
+                position = positions.get(document.id)
+                if position is None:
+                    position = positions[document.id] = len(rows)
+                    rows.append({})
+                rows[position] = {"id": document.id, "hash": digest, "content": document.content, "meta": document.meta}
+                matrix[position] = vector
+            matrix.flush()
+            del matrix
+
+            self._rows, self._positions = rows, positions
+            self._save_metadata()
+            self._load()
+            if self.has_ann:
+                self._save_ivf()
+            elif len(self) >= self.ann_min_documents:
+                self.build_ann()
+            return len(changed)
+
+    def delete(self, ids: Sequence[str]) -> None:
+        """Remove documents from the search results (their rows are kept)"""
+        with self._lock:
+            for document_id in ids:
+                position = self._positions.get(document_id)
+                if position is not None:
+                    self._rows[position]["deleted"] = True
+            self._save_metadata()
+            self._load()
+
+    # ANN
+
+    def build_ann(self, n_lists: Optional[int] = None, iterations: int = 10, seed: int = 0) -> None:
+        """Cluster the embeddings with k-means into `n_lists` inverted lists (sqrt(n) by default)"""
+        with self._lock:
+            count = len(self._rows)
+            if count == 0:
+                return
+            n_lists = min(count, n_lists or max(1, int(np.sqrt(count))))
+            rng = np.random.default_rng(seed)
+            # Train on a sample, which is enough to place the centroids
+            sample = self._matrix[rng.choice(count, size=min(count, n_lists * 64), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = np.argmax(sample @ centroids.T, axis=1)
+                for i in range(n_lists):
+                    members = sample[assignments == i]
+                    if len(members):
+                        centroids[i] = members.mean(axis=0)
+                centroids = _normalise(centroids)
+            self._centroids = centroids.astype(np.float32)
+            self._lists = np.zeros(0, dtype=np.int32)
+            self._assign_lists()
+            self._save_ivf()
+
+    def _assign_lists(self) -> None:
+        """Assign the rows added since the last assignment to their nearest centroid"""
+        start = len(self._lists)
+        assigned = [self._lists]
+        for offset in range(start, len(self._rows), 65536):
+            block = np.asarray(self._matrix[offset:offset + 65536])
+            assigned.append(np.argmax(block @ self._centroids.T, axis=1).astype(np.int32))
+        # Updated rows keep their list: an update rarely moves a document far
+        self._lists = np.concatenate(assigned)
+
+    # Search
+
+    def filter_mask(self, filters: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Rows of the live documents whose meta match all the filters.
+
+        Args:
+            filters: Meta key -> accepted value or list of accepted values
+                (e.g. {"siren": ["213100555", "200084952"]})
+        """
+        with self._lock:
+            mask = self._live.copy()
+            for key, accepted in (filters or {}).items():
+                if isinstance(accepted, (str, int)):
+                    accepted = [accepted]
+                positions = self._meta_positions(key)
+                matching = np.zeros(len(mask), dtype=bool)
+                for value in accepted:
+                    matching[positions.get(str(value), [])] = True
+                mask &= matching
+        return mask
+
+    def _meta_positions(self, key: str) -> Dict[str, List[int]]:
+        """Rows by value of a meta key, built once per key and load"""
+        if key not in self._meta_cache:
+            positions: Dict[str, List[int]] = {}
+            for position, row in enumerate(self._rows):
+                value = row["meta"].get(key)
+                if value is not None:
+                    positions.setdefault(str(value), []).append(position)
+            self._meta_cache[key] = positions
+        return self._meta_cache[key]
+
+    def document(self, position: int, score: Optional[float] = None) -> Document:
+        row = self._rows[position]
+        return Document(id=row["id"], content=row["content"], meta=row["meta"], score=score)
+
+    def search_positions(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int = 10,
+        n_probe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the `top_k` documents most similar to the query and their scores, best first.
+
+        With the ANN structure, only the rows of the `n_probe` lists nearest to the
+        query are scored (a tenth of the lists by default). `mask` restricts the search
+        to some rows (see `filter_mask`) before scoring.
+        """
+        query = _normalise(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            matrix, live = self._matrix, self._live
+            centroids, lists = self._centroids, self._lists
+
+        candidates = np.flatnonzero(live if mask is None else live & mask)
+        if centroids is not None:
+            n_probe = n_probe or max(1, len(centroids) // 10)
+            probes = np.argpartition(-(centroids @ query), min(n_probe, len(centroids)) - 1)[:n_probe]
+            candidates = candidates[np.isin(lists[candidates], probes)]
+        if len(candidates) == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = matrix[candidates] @ query
+        k = min(top_k, len(candidates))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int = 10,
+        n_probe: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        """Return the `top_k` documents most similar to the query, with their score"""
+        mask = self.filter_mask(filters) if filters else None
+        positions, scores = self.search_positions(query_embedding, top_k, n_probe, mask)
+        return [self.document(position, float(score)) for position, score in zip(positions, scores)]
+
+
+@component
+class VectorIndexRetriever:
+    """Haystack retriever over a `VectorIndex`, in place of InMemoryEmbeddingRetriever"""
+
+    def __init__(self, index: VectorIndex, top_k: int = 10):
+        self.index = index
+        self.top_k = top_k
+
+    @component.output_types(documents=List[Document])
+    def run(self, query_embedding: List[float], top_k: Optional[int] = None, filters: Optional[Dict[str, Any]] = None):
+        self.index.refresh()
+        return {"documents": self.index.search(query_embedding, top_k=top_k or self.top_k, filters=filters)}
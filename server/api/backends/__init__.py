@@ -0,0 +1,36 @@
+import os
+import tempfile
+from functools import lru_cache
+
+from .base import BlobStore, JobBackend, JobQueue, JobStore
+
+# "aws" (DynamoDB, SQS, S3) or "local" (SQLite, in-process queue, filesystem)
+JOB_BACKEND = os.getenv("JOB_BACKEND", "aws")
+LOCAL_BACKEND_DIR = os.getenv(
+    "LOCAL_BACKEND_DIR", os.path.join(tempfile.gettempdir(), "h-genai")
+)
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str = JOB_BACKEND) -> JobBackend:
+    """Return the (process-wide) job backend selected by JOB_BACKEND"""
+    if name == "aws":
+        from .aws import DynamoDBJobStore, S3BlobStore, SQSJobQueue
+
+        return JobBackend(
+            jobs=DynamoDBJobStore(), queue=SQSJobQueue(), blobs=S3BlobStore()
+        )
+
+    if name == "local":
+        from .local import FileSystemBlobStore, InProcessJobQueue, SQLiteJobStore
+
+        return JobBackend(
+            jobs=SQLiteJobStore(os.path.join(LOCAL_BACKEND_DIR, "jobs.sqlite3")),
+            queue=InProcessJobQueue(),
+            blobs=FileSystemBlobStore(os.path.join(LOCAL_BACKEND_DIR, "blobs")),
+        )
+
+    raise ValueError(f"Unknown job backend: {name}")
+
+
+__all__ = ["BlobStore", "JobBackend", "JobQueue", "JobStore", "get_backend"]
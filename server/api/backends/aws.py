@@ -0,0 +1,102 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .base import BlobStore, JobQueue, JobStore
+
+JOBS_TABLE = os.getenv("JOBS_TABLE", "h-genai-jobs")
+PDF_BUCKET = os.getenv("PDF_BUCKET", "h-genai-pdfs")  # Make sure to create this bucket
+PDF_GENERATION_QUEUE_URL = os.getenv(
+    "PDF_GENERATION_QUEUE_URL",
+    "https://sqs.us-west-2.amazonaws.com/140023381458/h-genai-pdf-generation",
+)
+
+
+class DynamoDBJobStore(JobStore):
+    def __init__(self, table_name: str = JOBS_TABLE):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.table.get_item(Key={"job_id": job_id}).get("Item")
+
+    def claim(self, item: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
+        if previous is None:
+            condition: Dict[str, Any] = {
+                "ConditionExpression": "attribute_not_exists(job_id)"
+            }
+        else:
+            condition = {
+                "ConditionExpression": "#status = :previous_status AND created_at = :previous_created_at",
+                "ExpressionAttributeNames": {"#status": "status"},
+                "ExpressionAttributeValues": {
+                    ":previous_status": previous["status"],
+                    ":previous_created_at": previous.get("created_at", ""),
+                },
+            }
+
+        try:
+            self.table.put_item(Item=item, **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        names = {f"#f{i}": name for i, name in enumerate(fields)}
+        values = {f":v{i}": value for i, value in enumerate(fields.values())}
+        assignments = ", ".join(f"#f{i} = :v{i}" for i in range(len(fields)))
+        self.table.update_item(
+            Key={"job_id": job_id},
+            UpdateExpression=f"SET {assignments}",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+
+
+class SQSJobQueue(JobQueue):
+    def __init__(self, queue_url: str = PDF_GENERATION_QUEUE_URL):
+        self.queue_url = queue_url
+        self.client = boto3.client("sqs")
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str = PDF_BUCKET):
+        self.bucket = bucket
+        self.client = boto3.client("s3")
+
+    def put(self, key: str, body: bytes, content_type: str) -> None:
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=body, ContentType=content_type
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def url(self, key: str, expires_in: int = 3600) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires_in,
+        )
@@ -0,0 +1,59 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+class JobStore(ABC):
+    """Stores job records (a dict with at least `job_id`, `status` and `created_at`)"""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job record or None if it doesn't exist"""
+
+    @abstractmethod
+    def claim(self, item: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
+        """Write `item` only if the stored record still matches `previous`.
+
+        `previous` is None when the job must not exist yet, otherwise the record
+        must still have the same `status` and `created_at`. Returns False if another
+        writer got there first.
+        """
+
+    @abstractmethod
+    def update(self, job_id: str, **fields: Any) -> None:
+        """Set the given fields on an existing job record"""
+
+
+class JobQueue(ABC):
+    """Delivers job messages to the PDF generation worker"""
+
+    @abstractmethod
+    def send(self, message: Dict[str, Any]) -> None:
+        """Queue a message (a dict with `job_id` and `city_info`)"""
+
+
+class BlobStore(ABC):
+    """Stores generated files"""
+
+    @abstractmethod
+    def put(self, key: str, body: bytes, content_type: str) -> None:
+        """Store `body` under `key`"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the object stored under `key`, or None if there is none"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether an object is stored under `key`"""
+
+    @abstractmethod
+    def url(self, key: str, expires_in: int = 3600) -> str:
+        """Return a URL the client can download the object from"""
+
+
+@dataclass(frozen=True)
+class JobBackend:
+    jobs: JobStore
+    queue: JobQueue
+    blobs: BlobStore
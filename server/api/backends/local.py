@@ -0,0 +1,144 @@
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .base import BlobStore, JobQueue, JobStore
+
+logger = logging.getLogger(__name__)
+
+# Function called by the in-process queue for every message
+LOCAL_QUEUE_HANDLER = os.getenv(
+    "LOCAL_QUEUE_HANDLER", "api.pdf_generator_lambda.process_message"
+)
+LOCAL_QUEUE_CONCURRENCY = int(os.getenv("LOCAL_QUEUE_CONCURRENCY", "4"))
+
+
+class SQLiteJobStore(JobStore):
+    """Job records stored as JSON documents in a single SQLite table"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, item TEXT NOT NULL)"
+            )
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection.execute(
+            "SELECT item FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get(job_id)
+
+    def claim(self, item: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
+        with self._lock, self._connection:
+            current = self._get(item["job_id"])
+            if previous is None:
+                if current is not None:
+                    return False
+            elif current is None or (
+                current.get("status"),
+                current.get("created_at", ""),
+            ) != (previous.get("status"), previous.get("created_at", "")):
+                return False
+
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, item) VALUES (?, ?)",
+                (item["job_id"], json.dumps(item)),
+            )
+            return True
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock, self._connection:
+            item = self._get(job_id) or {"job_id": job_id}
+            item.update(fields)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, item) VALUES (?, ?)",
+                (job_id, json.dumps(item)),
+            )
+
+
+class InProcessJobQueue(JobQueue):
+    """Queue backed by a thread pool that runs the worker handler in-process"""
+
+    def __init__(
+        self,
+        concurrency: int = LOCAL_QUEUE_CONCURRENCY,
+        handler: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="local-queue"
+        )
+        self._handler = handler
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    def _resolve_handler(self) -> Callable[[Dict[str, Any]], None]:
+        # Resolved lazily because the worker module itself imports the backend
+        if self._handler is None:
+            module_name, function_name = LOCAL_QUEUE_HANDLER.rsplit(".", 1)
+            self._handler = getattr(importlib.import_module(module_name), function_name)
+        return self._handler
+
+    def _run(self, message: Dict[str, Any]) -> None:
+        try:
+            self._resolve_handler()(message)
+        except Exception as e:
+            logger.error(f"Local job {message.get('job_id')} failed: {str(e)}")
+
+    def send(self, message: Dict[str, Any]) -> None:
+        # Round-trip through JSON like SQS does, so the worker sees the same payload
+        message = json.loads(json.dumps(message))
+        future = self._executor.submit(self._run, message)
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()]
+            self._pending.append(future)
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Wait until all queued messages have been processed"""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+
+class FileSystemBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def put(self, key: str, body: bytes, content_type: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial object
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(body)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def url(self, key: str, expires_in: int = 3600) -> str:
+        return self._path(key).as_uri()
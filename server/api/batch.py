@@ -0,0 +1,258 @@
+"""Generate the fiches of many communes at once (e.g. a whole department or region).
+
+Example (from the server directory):
+    python -m api.batch --department 76 --min-population 20000 --output out/seine-maritime
+    python -m api.batch --region 84 --output out/aura --workers 8 --resume
+
+The communes are selected from the OFGL population file. Each fiche is written to
+`<output>/<siren>/` (`data.json`, `fiche.pdf` and `result.json`), and a line per
+fiche is appended to `<output>/manifest.jsonl`. With `--resume`, communes whose
+fiche was already completed with the current template are skipped.
+
+All the fiches of a run share the Bedrock limiter, the Perplexity guard, the OFGL
+response cache of the process and the EPCI results (the inter_municipality sections
+are generated once per EPCI), and at most `--workers` fiches are generated at once.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from agent.epci_cache import EPCIResultStore
+from agent.orchestrator import Orchestrator
+from agent.util import use_ofgl_cache
+from api.backends.local import FileSystemBlobStore
+from api.jobs import SERVER_DIR, TEMPLATE_VERSION, compute_job_key
+
+logger = logging.getLogger(__name__)
+
+COMMUNES_FILE = os.path.join(
+    os.path.dirname(SERVER_DIR), "data", "populations-ofgl-communes-postprocessed.json"
+)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+
+def load_communes(path: str = COMMUNES_FILE) -> List[Dict[str, Any]]:
+    """Load the communes of the OFGL population file"""
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def filter_communes(
+    communes: Iterable[Dict[str, Any]],
+    region: Optional[str] = None,
+    department: Optional[str] = None,
+    min_population: Optional[int] = None,
+    max_population: Optional[int] = None,
+    sirens: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Select communes by region code, department code, population range and/or SIREN.
+
+    The result is ordered by EPCI so that communes sharing data are generated together.
+    """
+    sirens = {str(siren) for siren in sirens} if sirens else None
+    selected = [
+        commune
+        for commune in communes
+        if (region is None or commune["reg_code"] == region)
+        and (department is None or commune["dep_code"] == department)
+        and (min_population is None or commune["ptot"] >= min_population)
+        and (max_population is None or commune["ptot"] <= max_population)
+        and (sirens is None or commune["siren"] in sirens)
+    ]
+    return sorted(selected, key=lambda commune: (commune["epci_code"], commune["siren"]))
+
+
+def city_info_from_commune(commune: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the CityModel fields of a commune of the OFGL population file"""
+    return {
+        "siren": commune["siren"],
+        "municipality_name": commune["com_name"],
+        "municipality_code": commune["com_code"],
+        "inter_municipality_name": commune["epci_name"],
+        "inter_municipality_code": commune["epci_code"],
+        "reference_sirens": [ref["siren"] for ref in commune["reference_sirens"]],
+    }
+
+
+def generate_fiche(
+    city_info: Dict[str, Any], job_id: str, epci_store: Optional[EPCIResultStore] = None
+) -> Dict[str, Any]:
+    """Run the orchestrator for one commune and return its data, usage and trace summary"""
+    orchestrator = Orchestrator(SimpleNamespace(**city_info), job_id=job_id, epci_store=epci_store)
+    data = orchestrator.parallel_process_all_sections()
+    return {
+        "data": data,
+        "usage": orchestrator.usage.to_dict(),
+        "trace_summary": orchestrator.tracer.summary(),
+    }
+
+
+class BatchRun:
+    """Generates the fiches of a list of communes into an output directory"""
+
+    def __init__(
+        self,
+        output_dir: str,
+        workers: int = BATCH_WORKERS,
+        render: bool = True,
+        resume: bool = False,
+        generate: Optional[Callable[[Dict[str, Any], str], Dict[str, Any]]] = None,
+    ):
+        self.output_dir = Path(output_dir)
+        self.workers = max(1, workers)
+        self.render = render
+        self.resume = resume
+        # EPCI results are kept in the output directory so a resumed run reuses them too
+        self.epci_store = EPCIResultStore(
+            TEMPLATE_VERSION, blobs=FileSystemBlobStore(str(self.output_dir / ".epci"))
+        )
+        self.generate = generate or functools.partial(generate_fiche, epci_store=self.epci_store)
+        self._manifest_lock = threading.Lock()
+
+    def _fiche_dir(self, siren: str) -> Path:
+        return self.output_dir / siren
+
+    def is_done(self, city_info: Dict[str, Any], job_key: str) -> bool:
+        """Whether the fiche was already completed with the same inputs and template"""
+        result_path = self._fiche_dir(city_info["siren"]) / "result.json"
+        try:
+            with open(result_path, "r", encoding="utf-8") as file:
+                result = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return result.get("status") == "completed" and result.get("job_key") == job_key
+
+    def _write_result(self, result: Dict[str, Any]) -> None:
+        fiche_dir = self._fiche_dir(result["siren"])
+        fiche_dir.mkdir(parents=True, exist_ok=True)
+        # Written last, through a rename, so an interrupted fiche is never seen as completed
+        tmp_path = fiche_dir / "result.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, fiche_dir / "result.json")
+
+        with self._manifest_lock, open(self.output_dir / "manifest.jsonl", "a", encoding="utf-8") as file:
+            manifest_entry = {k: result[k] for k in ("siren", "municipality_name", "status", "duration_s", "error")}
+            file.write(json.dumps(manifest_entry, ensure_ascii=False) + "\n")
+
+    def run_one(self, city_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate, render and write the fiche of one commune"""
+        job_key = compute_job_key(city_info)
+        fiche_dir = self._fiche_dir(city_info["siren"])
+        result: Dict[str, Any] = {
+            "siren": city_info["siren"],
+            "municipality_name": city_info["municipality_name"],
+            "job_key": job_key,
+            "template_version": TEMPLATE_VERSION,
+            "started_at": datetime.utcnow().isoformat(),
+        }
+        start = time.perf_counter()
+        try:
+            generated = self.generate(city_info, job_key)
+            fiche_dir.mkdir(parents=True, exist_ok=True)
+            with open(fiche_dir / "data.json", "w", encoding="utf-8") as file:
+                json.dump(generated["data"], file, indent=4, ensure_ascii=False)
+            if self.render:
+                from api.pdf_cache import PDFCache
+
+                pdf, _ = PDFCache().render(generated["data"])
+                with open(fiche_dir / "fiche.pdf", "wb") as file:
+                    file.write(pdf)
+            result.update(
+                status="completed",
+                usage=generated.get("usage"),
+                trace_summary=generated.get("trace_summary"),
+                error=None,
+            )
+        except Exception as e:
+            logger.exception(f"Fiche generation failed for {city_info['municipality_name']}")
+            result.update(status="failed", error=f"{type(e).__name__}: {e}")
+
+        result["duration_s"] = round(time.perf_counter() - start, 3)
+        result["completed_at"] = datetime.utcnow().isoformat()
+        self._write_result(result)
+        return result
+
+    def run(self, city_infos: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Generate all the fiches and return a summary of the run"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        todo = [
+            city_info
+            for city_info in city_infos
+            if not (self.resume and self.is_done(city_info, compute_job_key(city_info)))
+        ]
+        skipped = len(city_infos) - len(todo)
+        if skipped:
+            logger.info(f"Resuming: {skipped} fiches already completed")
+
+        results = []
+        start = time.perf_counter()
+        with use_ofgl_cache(), ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.run_one, city_info) for city_info in todo]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                logger.info(
+                    f"[{len(results)}/{len(todo)}] {result['municipality_name']}: "
+                    f"{result['status']} in {result['duration_s']}s"
+                )
+
+        summary = {
+            "total": len(city_infos),
+            "skipped": skipped,
+            "completed": sum(1 for r in results if r["status"] == "completed"),
+            "failed": sum(1 for r in results if r["status"] == "failed"),
+            "wall_time_s": round(time.perf_counter() - start, 3),
+            "cost_usd": round(sum((r.get("usage") or {}).get("cost_usd", 0.0) for r in results), 4),
+        }
+        with open(self.output_dir / "summary.json", "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=4)
+        return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--region", help="Region code (e.g. 84)")
+    parser.add_argument("--department", help="Department code (e.g. 76, 2A)")
+    parser.add_argument("--min-population", type=int)
+    parser.add_argument("--max-population", type=int)
+    parser.add_argument("--siren", action="append", help="Only these communes (repeatable)")
+    parser.add_argument("--limit", type=int, help="Generate at most this many fiches")
+    parser.add_argument("--communes", default=COMMUNES_FILE, help="OFGL population file")
+    parser.add_argument("--output", required=True, help="Output directory")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Fiches generated at once")
+    parser.add_argument("--no-pdf", action="store_true", help="Only write data.json")
+    parser.add_argument("--resume", action="store_true", help="Skip fiches already completed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    communes = filter_communes(
+        load_communes(args.communes),
+        region=args.region,
+        department=args.department,
+        min_population=args.min_population,
+        max_population=args.max_population,
+        sirens=args.siren,
+    )
+    if args.limit is not None:
+        communes = communes[: args.limit]
+    city_infos = [city_info_from_commune(commune) for commune in communes]
+    logger.info(f"{len(city_infos)} communes selected")
+
+    batch = BatchRun(args.output, workers=args.workers, render=not args.no_pdf, resume=args.resume)
+    summary = batch.run(city_infos)
+    print("Summary:", json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
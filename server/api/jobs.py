@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+# Files whose content changes the generated fiche. Their combined hash is the
+# template version, so editing the template, the stylesheet or the prompts
+# invalidates jobs.
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_FILES = (
+    os.path.join("agent", "data_template.json"),
+    os.path.join("agent", "prompt.py"),
+    os.path.join("template", "index.html"),
+    os.path.join("template", "styles.css"),
+)
+
+# A completed job is reused for this long before a new request regenerates it
+JOB_FRESHNESS_SECONDS = int(os.getenv("JOB_FRESHNESS_SECONDS", "86400"))
+# A pending/processing job older than this is considered abandoned (Lambda timeout is 900s)
+JOB_INFLIGHT_TIMEOUT_SECONDS = int(os.getenv("JOB_INFLIGHT_TIMEOUT_SECONDS", "1800"))
+
+
+def _compute_template_version() -> str:
+    """Hash the template files into a short version string"""
+    digest = hashlib.sha256()
+    for relative_path in TEMPLATE_FILES:
+        try:
+            with open(os.path.join(SERVER_DIR, relative_path), "rb") as file:
+                digest.update(file.read())
+        except FileNotFoundError:
+            digest.update(relative_path.encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+TEMPLATE_VERSION = os.getenv("TEMPLATE_VERSION") or _compute_template_version()
+
+
+def compute_job_key(
+    city_info: Dict[str, Any], template_version: str = TEMPLATE_VERSION
+) -> str:
+    """Compute the content-addressed job key of a fiche request.
+
+    Two requests for the same commune, EPCI and reference communes rendered with
+    the same template produce the same key. The order of the reference SIRENs is
+    kept because it determines the order of the comparative table.
+
+    Args:
+        city_info: The request payload (a dict version of CityModel)
+        template_version: Version of the template used to render the fiche
+
+    Returns:
+        str: A hex digest usable as job id
+    """
+    canonical = {
+        "siren": str(city_info["siren"]).strip(),
+        "inter_municipality_code": str(city_info["inter_municipality_code"]).strip(),
+        "reference_sirens": [str(s).strip() for s in city_info["reference_sirens"]],
+        "template_version": template_version,
+    }
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def is_job_reusable(job: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    """Whether a new request can attach to an existing job record.
+
+    In-flight jobs, including those waiting for the queue to redeliver them, are
+    reusable until their last attempt exceeds JOB_INFLIGHT_TIMEOUT_SECONDS, completed
+    jobs while they are younger than JOB_FRESHNESS_SECONDS. Failed jobs are never
+    reused.
+    """
+    now = now or datetime.utcnow()
+    status = job.get("status")
+
+    if status in ("pending", "processing", "retrying"):
+        started_at = _parse_timestamp(job.get("retried_at") or job.get("created_at"))
+        return started_at is not None and now - started_at < timedelta(
+            seconds=JOB_INFLIGHT_TIMEOUT_SECONDS
+        )
+
+    if status == "completed":
+        completed_at = _parse_timestamp(job.get("completed_at"))
+        return completed_at is not None and now - completed_at < timedelta(
+            seconds=JOB_FRESHNESS_SECONDS
+        )
+
+    return False
@@ -2,38 +2,29 @@ import json
 import logging
 import sys
 import traceback
-import uuid
-import boto3
 from datetime import datetime
 from enum import Enum
 
 from pydantic import BaseModel
 import uvicorn
 from fastapi import FastAPI, Request, Response, HTTPException
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from weasyprint import HTML, CSS
 from mangum import Mangum
 from typing import Dict, Any, List, Optional
 
 from agent.orchestrator import Orchestrator
+from api.backends import get_backend
+from api.jobs import TEMPLATE_VERSION, compute_job_key, is_job_reusable
+from api.rendering import render_pdf
 
-# Configure DynamoDB
-dynamodb = boto3.resource('dynamodb')
-jobs_table = dynamodb.Table('h-genai-jobs')
-
-# Configure S3
-s3 = boto3.client('s3')
-S3_BUCKET = 'h-genai-pdfs'  # Make sure to create this bucket
-
-# Configure SQS
-sqs = boto3.client('sqs')
-PDF_GENERATION_QUEUE_URL = 'https://sqs.us-west-2.amazonaws.com/140023381458/h-genai-pdf-generation'
+# Job store, queue and blob store (AWS or local, see JOB_BACKEND)
+backend = get_backend()
 
 class JobStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
+    RETRYING = "retrying"
     COMPLETED = "completed"
     FAILED = "failed"
 
@@ -42,6 +33,8 @@ class JobResponse(BaseModel):
     status: JobStatus
     pdf_url: Optional[str] = None
     error: Optional[str] = None
+    # Tokens, tool calls and cost of the generation (see agent/usage.py)
+    usage: Optional[Dict[str, Any]] = None
 
 # Configure logging
 logging.basicConfig(
@@ -51,9 +44,6 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="H-GenAI API", description="REST API for H-GenAI", version="1.0.0")
 
-# Initialize Jinja2 templates
-templates = Jinja2Templates(directory="template")
-
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -110,90 +100,99 @@ class CityModel(BaseModel):
     reference_sirens: List[str]
     
 
+def _job_response(job: Dict[str, Any]) -> JobResponse:
+    """Build the API response for a job record, refreshing the PDF URL if completed"""
+    pdf_url = job.get('pdf_url')
+    if job['status'] == JobStatus.COMPLETED.value and 'pdf_url' in job:
+        # Jobs completed before the PDF cache stored their PDF under their id
+        pdf_key = job.get('pdf_key') or f"pdfs/{job['job_id']}.pdf"
+        pdf_url = backend.blobs.url(pdf_key, expires_in=3600)
+
+    return JobResponse(
+        job_id=job['job_id'],
+        status=JobStatus(job['status']),
+        pdf_url=pdf_url,
+        error=job.get('error'),
+        usage=json.loads(job['usage']) if job.get('usage') else None
+    )
+
+
 @app.post("/generate-pdf", response_model=JobResponse)
-async def generate_pdf_from_data(request: Request, city_info: CityModel):
+async def generate_pdf_from_data(request: Request, city_info: CityModel, force: bool = False):
+    """Create (or reuse) a PDF generation job.
+
+    Jobs are keyed by a hash of the request and the template version. A request
+    attaches to an identical job that is still in flight, or gets the existing PDF
+    while it is fresh. Pass `force=true` to always regenerate.
+    """
     logger.info("PDF generation endpoint called")
-    
-    # Generate a unique job ID
-    job_id = str(uuid.uuid4())
-    
+
+    job_id = compute_job_key(city_info.dict())
+    claimed = False
+
     try:
-        # Create a job record in DynamoDB
-        jobs_table.put_item(
-            Item={
-                'job_id': job_id,
-                'status': JobStatus.PENDING.value,
-                'created_at': datetime.utcnow().isoformat(),
-                'city_info': city_info.dict()
-            }
-        )
-        
-        # Send message to SQS
-        message_body = {
+        existing = backend.jobs.get(job_id)
+
+        if existing and not force and is_job_reusable(existing):
+            logger.info(f"Job {job_id} reused with status {existing['status']}")
+            return _job_response(existing)
+
+        # Claim the job key. The condition makes sure two concurrent requests don't
+        # both queue an orchestration: the loser attaches to the winner's job.
+        item = {
             'job_id': job_id,
+            'status': JobStatus.PENDING.value,
+            'created_at': datetime.utcnow().isoformat(),
+            'template_version': TEMPLATE_VERSION,
             'city_info': city_info.dict()
         }
-        
-        sqs.send_message(
-            QueueUrl=PDF_GENERATION_QUEUE_URL,
-            MessageBody=json.dumps(message_body)
-        )
-        
+        if not backend.jobs.claim(item, previous=existing):
+            current = backend.jobs.get(job_id)
+            if current is None:
+                raise RuntimeError(f"Job {job_id} could not be claimed")
+            logger.info(f"Job {job_id} claimed concurrently, attaching to it")
+            return _job_response(current)
+        claimed = True
+
+        # Send message to the PDF generation queue
+        backend.queue.send({
+            'job_id': job_id,
+            'city_info': city_info.dict()
+        })
+
         logger.info(f"Job {job_id} created and queued for processing")
-        
+
         # Return the job ID immediately
         return JobResponse(
             job_id=job_id,
             status=JobStatus.PENDING
         )
-        
+
     except Exception as e:
         logger.error(f"Failed to create job: {str(e)}")
         logger.error(f"Traceback: {''.join(traceback.format_tb(sys.exc_info()[2]))}")
-        
+
         # Update job status to failed if we managed to create it
-        try:
-            jobs_table.update_item(
-                Key={'job_id': job_id},
-                UpdateExpression='SET #status = :status, error = :error',
-                ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={
-                    ':status': JobStatus.FAILED.value,
-                    ':error': str(e)
-                }
-            )
-        except:
-            pass
-            
+        if claimed:
+            try:
+                backend.jobs.update(
+                    job_id, status=JobStatus.FAILED.value, error=str(e)
+                )
+            except:
+                pass
+
         raise HTTPException(status_code=500, detail="Failed to create PDF generation job")
 
 @app.get("/pdf-status/{job_id}", response_model=JobResponse)
 async def get_pdf_status(job_id: str):
     """Get the status of a PDF generation job"""
     try:
-        response = jobs_table.get_item(Key={'job_id': job_id})
-        
-        if 'Item' not in response:
+        job = backend.jobs.get(job_id)
+
+        if job is None:
             raise HTTPException(status_code=404, detail="Job not found")
-            
-        job = response['Item']
-        
-        # If the job is completed and we have a PDF URL that's expired, generate a new one
-        if job['status'] == JobStatus.COMPLETED.value and 'pdf_url' in job:
-            pdf_key = f'pdfs/{job_id}.pdf'
-            pdf_url = s3.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': S3_BUCKET, 'Key': pdf_key},
-                ExpiresIn=3600
-            )
-            job['pdf_url'] = pdf_url
-            
-        return JobResponse(
-            job_id=job['job_id'],
-            status=JobStatus(job['status']),
-            pdf_url=job.get('pdf_url'),
-            error=job.get('error')
-        )
+
+        return _job_response(job)
         
     except Exception as e:
         logger.error(f"Error getting job status: {str(e)}")
@@ -209,19 +208,7 @@ async def small_generate_pdf_from_data(request: Request, city_info: CityModel):
     print(data)
 
     try:
-        html_content = templates.TemplateResponse(
-            "index.html", 
-            {
-                "request": request,
-                "data": data
-            }
-        ).body.decode('utf-8')
-
-        with open("template/styles.css", "r") as css_file:
-            css_content = css_file.read()
-
-        css = CSS(string=css_content)
-        pdf = HTML(string=html_content, base_url="./template").write_pdf(stylesheets=[css])
+        pdf = render_pdf(data)
 
         logger.info("PDF generated successfully")
         return HTMLResponse(pdf, media_type="application/pdf")
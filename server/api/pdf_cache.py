@@ -0,0 +1,152 @@
+"""Cache of the rendered PDFs, keyed by what the PDF is rendered from.
+
+A regenerated fiche often has exactly the same data as a previous run (retries,
+`force=true` regenerations, communes whose sources didn't change). The PDF only
+depends on that data, the template (index.html, styles.css, see TEMPLATE_VERSION) and
+the images it embeds, so their canonical hash addresses the PDF. `PDFCache` looks it up
+on the local disk and in the blob store before rendering: on a hit, the WeasyPrint
+render and the upload are skipped and the existing object is reused.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+from agent.assets import get_asset_cache
+from api.backends.base import BlobStore
+from api.jobs import TEMPLATE_VERSION
+from api.rendering import fetch_assets, render_pdf
+
+logger = logging.getLogger(__name__)
+
+# Local copies of the rendered PDFs ("" disables them), bounded in size
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "h-genai-pdfs"))
+PDF_CACHE_MAX_MB = float(os.getenv("PDF_CACHE_MAX_MB", "256"))
+
+PDF_CONTENT_TYPE = "application/pdf"
+
+
+def pdf_cache_key(data: Dict[str, Any], template_version: str = TEMPLATE_VERSION) -> str:
+    """Canonical hash of the inputs of a PDF: the fiche data, the template version and
+    the content of the cached images it references (a logo can change behind its URL)"""
+    logo = data.get("logo", {}).get("content")
+    asset = get_asset_cache().get(logo) if isinstance(logo, str) else None
+    canonical = {
+        "data": data,
+        "template_version": template_version,
+        "assets": {logo: asset.digest} if asset is not None else {},
+    }
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PDFCache:
+    """Rendered PDFs by `pdf_cache_key`, on the local disk and/or in a blob store.
+
+    Args:
+        blobs: Blob store the PDFs are uploaded to and looked up in (optional)
+        directory: Local directory of the PDFs, None to keep none
+        max_mb: Size above which the oldest local PDFs are deleted
+    """
+
+    def __init__(
+        self,
+        blobs: Optional[BlobStore] = None,
+        directory: Optional[str] = PDF_CACHE_DIR or None,
+        max_mb: float = PDF_CACHE_MAX_MB,
+    ):
+        self.blobs = blobs
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1_048_576)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def blob_key(cache_key: str) -> str:
+        return f"pdfs/by-hash/{cache_key}.pdf"
+
+    def _local_path(self, cache_key: str) -> Optional[str]:
+        return os.path.join(self.directory, f"{cache_key}.pdf") if self.directory else None
+
+    def _read_local(self, cache_key: str) -> Optional[bytes]:
+        path = self._local_path(cache_key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as file:
+                pdf = file.read()
+        except OSError:
+            return None
+        # Recently used PDFs are evicted last
+        os.utime(path)
+        return pdf
+
+    def _write_local(self, cache_key: str, pdf: bytes) -> None:
+        path = self._local_path(cache_key)
+        if path is None:
+            return
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(pdf)
+        os.replace(temporary, path)
+        self._evict(keep=path)
+
+    def _evict(self, keep: str) -> None:
+        """Delete the least recently used PDFs above the size limit (except `keep`)"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf") and entry.path != keep:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = os.path.getsize(keep) + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _render(self, data: Dict[str, Any], cache_key: str) -> bytes:
+        pdf = render_pdf(data)
+        self._write_local(cache_key, pdf)
+        return pdf
+
+    def _key(self, data: Dict[str, Any]) -> str:
+        # The images must be cached first, their content is part of the key
+        fetch_assets(data)
+        return pdf_cache_key(data)
+
+    def render(self, data: Dict[str, Any]) -> Tuple[bytes, bool]:
+        """The PDF of a fiche and whether it was reused instead of rendered"""
+        cache_key = self._key(data)
+        pdf = self._read_local(cache_key)
+        if pdf is None and self.blobs is not None:
+            pdf = self.blobs.get(self.blob_key(cache_key))
+            if pdf is not None:
+                self._write_local(cache_key, pdf)
+        if pdf is not None:
+            logger.info(f"Reusing rendered PDF {cache_key[:12]}")
+            return pdf, True
+        return self._render(data, cache_key), False
+
+    def publish(self, data: Dict[str, Any]) -> Tuple[str, bool]:
+        """Key of the blob holding the PDF of a fiche, rendering and uploading it only
+        when the blob store doesn't have it yet. Returns (blob key, reused)."""
+        if self.blobs is None:
+            raise ValueError("PDFCache.publish needs a blob store")
+        cache_key = self._key(data)
+        blob_key = self.blob_key(cache_key)
+        if self.blobs.exists(blob_key):
+            logger.info(f"Reusing uploaded PDF {blob_key}")
+            return blob_key, True
+
+        pdf = self._read_local(cache_key)
+        reused = pdf is not None
+        if pdf is None:
+            pdf = self._render(data, cache_key)
+        self.blobs.put(blob_key, pdf, content_type=PDF_CONTENT_TYPE)
+        return blob_key, reused
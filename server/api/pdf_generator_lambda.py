@@ -1,121 +1,144 @@
 import json
 import logging
+import os
 import sys
 import traceback
-import boto3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from weasyprint import HTML, CSS
-from fastapi.templating import Jinja2Templates
+from types import SimpleNamespace
+from typing import Any, Dict
 
+from agent.epci_cache import EPCIResultStore
 from agent.orchestrator import Orchestrator
+from agent.tracing import TRACE_DIR
+from api.backends import get_backend
+from api.jobs import TEMPLATE_VERSION
+from api.pdf_cache import PDFCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure AWS services
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-jobs_table = dynamodb.Table('h-genai-jobs')
-S3_BUCKET = 'h-genai-pdfs'
+# Job store and blob store (AWS or local, see JOB_BACKEND)
+backend = get_backend()
+
+# inter_municipality results shared by the jobs of communes of the same EPCI
+EPCI_RESULT_SHARING = os.getenv("EPCI_RESULT_SHARING", "1") == "1"
+epci_store = EPCIResultStore(TEMPLATE_VERSION, blobs=backend.blobs) if EPCI_RESULT_SHARING else None
+
+# Rendered PDFs reused when a job produces the same data as a previous one
+pdf_cache = PDFCache(blobs=backend.blobs)
+
+# Maximum number of SQS records of one batch processed at the same time
+PDF_WORKER_CONCURRENCY = int(os.getenv("PDF_WORKER_CONCURRENCY", "5"))
+# maxReceiveCount of the redrive policy of the queue: the last delivery of a message
+SQS_MAX_RECEIVE_COUNT = int(os.getenv("SQS_MAX_RECEIVE_COUNT", "3"))
+
+
+def process_message(message_body: Dict[str, Any], last_attempt: bool = True) -> None:
+    """Generate the PDF of a queued job and store the result.
+
+    Raises on failure so the caller can report the message back to the queue, after
+    marking the job as failed on its last attempt, or as retrying (still in flight,
+    see is_job_reusable) when the queue will deliver the message again.
+    """
+    job_id = message_body['job_id']
+    city_info = message_body['city_info']
+
+    orchestrator_instance = None
+    try:
+        # Update status to processing
+        backend.jobs.update(job_id, status='processing')
+
+        # Generate the PDF
+        orchestrator_instance = Orchestrator(
+            SimpleNamespace(**city_info), job_id=job_id, epci_store=epci_store
+        )
+        data = orchestrator_instance.parallel_process_all_sections()
+
+        # Render the PDF and upload it to the blob store, unless an identical one already is
+        pdf_key, pdf_reused = pdf_cache.publish(data)
+
+        # Generate pre-signed URL
+        pdf_url = backend.blobs.url(pdf_key, expires_in=3600)
+
+        # Update job status to completed
+        backend.jobs.update(
+            job_id,
+            status='completed',
+            pdf_url=pdf_url,
+            pdf_key=pdf_key,
+            pdf_reused=pdf_reused,
+            completed_at=datetime.utcnow().isoformat(),
+            trace_summary=json.dumps(orchestrator_instance.tracer.summary()),
+            usage=json.dumps(orchestrator_instance.usage.to_dict())
+        )
+
+        logger.info(f"PDF generation completed for job {job_id}")
+
+    except Exception as e:
+        logger.error(f"PDF generation failed for job {job_id}: {str(e)}")
+        logger.error(f"Traceback: {''.join(traceback.format_tb(sys.exc_info()[2]))}")
+
+        # Update job status (keeping what the attempt consumed)
+        if last_attempt:
+            failed_fields = {'status': 'failed', 'error': str(e)}
+        else:
+            failed_fields = {
+                'status': 'retrying',
+                'error': str(e),
+                'retried_at': datetime.utcnow().isoformat(),
+            }
+        if orchestrator_instance is not None:
+            failed_fields['usage'] = json.dumps(orchestrator_instance.usage.to_dict())
+        backend.jobs.update(job_id, **failed_fields)
+        raise
+
+    finally:
+        if TRACE_DIR and orchestrator_instance is not None:
+            try:
+                orchestrator_instance.tracer.export(TRACE_DIR)
+            except OSError as e:
+                logger.warning(f"Could not export the trace of job {job_id}: {e}")
+
+
+def process_record(record: Dict[str, Any]) -> None:
+    """Generate the PDF of a single SQS record"""
+    receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+    process_message(
+        json.loads(record['body']), last_attempt=receive_count >= SQS_MAX_RECEIVE_COUNT
+    )
 
-# Initialize Jinja2 templates
-templates = Jinja2Templates(directory="template")
 
 def process_pdf_generation(event, context):
     """
     Lambda function to process PDF generation requests from SQS
+
+    The records of a batch are processed concurrently (up to PDF_WORKER_CONCURRENCY).
+    Failed records are returned as `batchItemFailures` so that SQS only redelivers
+    those messages (requires ReportBatchItemFailures on the event source mapping).
     """
-    try:
-        # Process SQS messages
-        for record in event['Records']:
-            message_body = json.loads(record['body'])
-            job_id = message_body['job_id']
-            city_info = message_body['city_info']
-            
+    records = event.get('Records', [])
+    batch_item_failures = []
+
+    if not records:
+        return {'batchItemFailures': batch_item_failures}
+
+    max_workers = max(1, min(PDF_WORKER_CONCURRENCY, len(records)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_record, record): record for record in records
+        }
+
+        for future in as_completed(futures):
+            record = futures[future]
             try:
-                # Update status to processing
-                jobs_table.update_item(
-                    Key={'job_id': job_id},
-                    UpdateExpression='SET #status = :status',
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={':status': 'processing'}
-                )
-                
-                # Generate the PDF
-                orchestrator_instance = Orchestrator(city_info)
-                data = orchestrator_instance.parallel_process_all_sections()
-                
-                # Generate HTML
-                html_content = templates.TemplateResponse(
-                    "index.html",
-                    {
-                        "request": None,  # Not needed in this context
-                        "data": data
-                    }
-                ).body.decode('utf-8')
-
-                # Read CSS
-                with open("template/styles.css", "r") as css_file:
-                    css_content = css_file.read()
-
-                # Generate PDF
-                css = CSS(string=css_content)
-                pdf = HTML(string=html_content, base_url="./template").write_pdf(stylesheets=[css])
-                
-                # Upload to S3
-                pdf_key = f'pdfs/{job_id}.pdf'
-                s3.put_object(
-                    Bucket=S3_BUCKET,
-                    Key=pdf_key,
-                    Body=pdf,
-                    ContentType='application/pdf'
-                )
-                
-                # Generate pre-signed URL
-                pdf_url = s3.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': S3_BUCKET, 'Key': pdf_key},
-                    ExpiresIn=3600
-                )
-                
-                # Update job status to completed
-                jobs_table.update_item(
-                    Key={'job_id': job_id},
-                    UpdateExpression='SET #status = :status, pdf_url = :pdf_url',
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={
-                        ':status': 'completed',
-                        ':pdf_url': pdf_url
-                    }
-                )
-                
-                logger.info(f"PDF generation completed for job {job_id}")
-                
+                future.result()
             except Exception as e:
-                logger.error(f"PDF generation failed for job {job_id}: {str(e)}")
-                logger.error(f"Traceback: {''.join(traceback.format_tb(sys.exc_info()[2]))}")
-                
-                # Update job status to failed
-                jobs_table.update_item(
-                    Key={'job_id': job_id},
-                    UpdateExpression='SET #status = :status, error = :error',
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={
-                        ':status': 'failed',
-                        ':error': str(e)
-                    }
-                )
-                
-                # Don't raise the exception - we want to process other messages in the batch if any
-                continue
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps('PDF generation processing completed')
-        }
-        
-    except Exception as e:
-        logger.error(f"Error processing SQS messages: {str(e)}")
-        logger.error(f"Traceback: {''.join(traceback.format_tb(sys.exc_info()[2]))}")
-        raise 
\ No newline at end of file
+                logger.error(f"Record {record.get('messageId')} failed: {str(e)}")
+                batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    logger.info(
+        f"Processed batch of {len(records)} records, {len(batch_item_failures)} failed"
+    )
+    return {'batchItemFailures': batch_item_failures}
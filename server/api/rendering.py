@@ -0,0 +1,62 @@
+import os
+from typing import Any, Dict
+
+from fastapi.templating import Jinja2Templates
+
+from agent.assets import get_asset_cache
+from api.jobs import SERVER_DIR
+
+TEMPLATE_DIR = os.path.join(SERVER_DIR, "template")
+
+# Initialize Jinja2 templates
+templates = Jinja2Templates(directory=TEMPLATE_DIR)
+
+
+def render_html(data: Dict[str, Any]) -> str:
+    """Render the fiche HTML from the orchestrator data"""
+    return templates.TemplateResponse(
+        "index.html",
+        {
+            "request": None,  # Not needed in this context
+            "data": data
+        }
+    ).body.decode('utf-8')
+
+
+def fetch_assets(data: Dict[str, Any]) -> None:
+    """Cache the remote images of the fiche before the rendering. The logo is usually
+    already cached by the orchestrator, otherwise the wait is bounded by the fetch timeout"""
+    logo = data.get("logo", {}).get("content")
+    if isinstance(logo, str) and logo.startswith(("http://", "https://")):
+        get_asset_cache().fetch(logo)
+
+
+def asset_url_fetcher(url: str) -> Dict[str, Any]:
+    """WeasyPrint url_fetcher serving remote images from the asset cache only, so the
+    rendering never waits for the network. Missing images are left out of the PDF."""
+    if not url.startswith(("http://", "https://")):
+        # Template files and data: URLs
+        from weasyprint import default_url_fetcher
+
+        return default_url_fetcher(url)
+    asset = get_asset_cache().get(url)
+    if asset is None:
+        raise ValueError(f"Asset not cached: {url}")
+    return {"string": asset.read(), "mime_type": asset.mime_type, "redirected_url": url}
+
+
+def render_pdf(data: Dict[str, Any]) -> bytes:
+    """Render the fiche PDF from the orchestrator data"""
+    # Imported here so that modules rendering no PDF don't need the cairo/pango libraries
+    from weasyprint import CSS, HTML
+
+    fetch_assets(data)
+    html_content = render_html(data)
+
+    # Read CSS
+    with open(os.path.join(TEMPLATE_DIR, "styles.css"), "r") as css_file:
+        css_content = css_file.read()
+
+    css = CSS(string=css_content, url_fetcher=asset_url_fetcher)
+    html = HTML(string=html_content, base_url=TEMPLATE_DIR, url_fetcher=asset_url_fetcher)
+    return html.write_pdf(stylesheets=[css])
@@ -0,0 +1,16 @@
+import os
+
+# Dummy credentials so that agent.agents can be imported; no request reaches AWS
+DUMMY_CREDENTIALS = {
+    "BR_AWS_ACCESS_KEY_ID": "benchmark",
+    "BR_AWS_SECRET_ACCESS_KEY": "benchmark",
+    "BR_AWS_DEFAULT_REGION": "us-west-2",
+    "AWS_DEFAULT_REGION": "us-west-2",
+}
+
+
+def use_dummy_credentials() -> None:
+    """Set the dummy credentials, keeping the ones already in the environment.
+    Call it before importing the agent modules."""
+    for name, value in DUMMY_CREDENTIALS.items():
+        os.environ.setdefault(name, value)
@@ -0,0 +1,347 @@
+"""Deterministic stand-ins for Bedrock, Perplexity, the OFGL API and the logo downloads.
+
+Each fake sleeps according to a configurable latency distribution, fails with a
+configurable rate and counts its calls, so the orchestrator can be benchmarked end to
+end without credentials or network access.
+"""
+import contextvars
+import functools
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from haystack.dataclasses import ChatMessage, ChatRole, ToolCall
+
+# Label of the section being executed, used to attribute calls. A context variable, so
+# that the worker threads of a section (run with tracing.in_context) see it too
+_current_section: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "benchmark_section", default=None
+)
+
+
+def set_current_section(name: Optional[str]) -> None:
+    _current_section.set(name)
+
+
+def get_current_section() -> str:
+    return _current_section.get() or "init"
+
+
+@dataclass
+class LatencyModel:
+    """A latency distribution in seconds.
+
+    Parsed from specs like "0", "const:0.5", "uniform:0.2,1.5", "normal:1.0,0.2" or
+    "lognormal:1.0,0.5" (median and sigma of the underlying normal distribution).
+    """
+
+    kind: str = "const"
+    params: tuple = (0.0,)
+    failure_rate: float = 0.0
+    seed: int = 0
+    _rng: random.Random = field(init=False, repr=False)
+    _lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+
+    @classmethod
+    def parse(cls, spec: str, failure_rate: float = 0.0, seed: int = 0) -> "LatencyModel":
+        kind, _, raw_params = spec.partition(":") if ":" in spec else ("const", "", spec)
+        params = tuple(float(p) for p in raw_params.split(",") if p)
+        if kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        return cls(kind=kind, params=params or (0.0,), failure_rate=failure_rate, seed=seed)
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "uniform":
+                value = self._rng.uniform(*self.params)
+            elif self.kind == "normal":
+                value = self._rng.gauss(*self.params)
+            elif self.kind == "lognormal":
+                median, sigma = self.params
+                value = median * self._rng.lognormvariate(0.0, sigma)
+            else:
+                value = self.params[0]
+        return max(0.0, value)
+
+    def should_fail(self) -> bool:
+        if self.failure_rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.failure_rate
+
+
+class CallCounter:
+    """Thread-safe call counts, total and per section"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.failures = 0
+        self.by_section: Counter = Counter()
+
+    def record(self, failed: bool = False) -> None:
+        with self._lock:
+            self.total += 1
+            self.failures += int(failed)
+            self.by_section[get_current_section()] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total = 0
+            self.failures = 0
+            self.by_section.clear()
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeBedrockChatGenerator:
+    """Replaces AmazonBedrockChatGenerator.
+
+    When tools are available and the last message is the user's question, it calls the
+    first tool with that question (like the real model usually does). Otherwise it
+    answers with a short deterministic text derived from the question.
+    """
+
+    def __init__(self, latency: LatencyModel, model: Optional[str] = None):
+        from agent.agents import MODEL_ID
+
+        self.latency = latency
+        self.model = model or MODEL_ID
+        self.calls = CallCounter()
+
+    def run(self, messages: List[ChatMessage], tools: Optional[list] = None, **kwargs) -> Dict[str, Any]:
+        time.sleep(self.latency.sample())
+        if self.latency.should_fail():
+            self.calls.record(failed=True)
+            # Same error as the Bedrock integration raises on a throttled ClientError
+            from botocore.exceptions import ClientError
+            from haystack_integrations.common.amazon_bedrock.errors import (
+                AmazonBedrockInferenceError,
+            )
+
+            throttled = ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "simulated failure"}}, "Converse"
+            )
+            raise AmazonBedrockInferenceError("ThrottlingException: simulated failure") from throttled
+        self.calls.record()
+
+        question = next(
+            (m.text or "" for m in reversed(messages) if m.is_from(ChatRole.USER)), ""
+        )
+        prompt_tokens = sum(_estimate_tokens(m.text or "") for m in messages)
+        digest = hashlib.sha1(question.encode("utf-8")).hexdigest()
+
+        if tools and messages[-1].is_from(ChatRole.USER):
+            reply = ChatMessage.from_assistant(
+                tool_calls=[
+                    ToolCall(
+                        tool_name=tools[0].name,
+                        arguments={"message": question[-500:]},
+                        id=f"call_{digest[:12]}",
+                    )
+                ]
+            )
+            completion_tokens = 30
+        else:
+            if "'number'" in question:
+                text = f"{int(digest[:6], 16) % 100000} habitants"
+            elif "url" in question.lower():
+                text = f"https://example.org/logo-{digest[:8]}.png"
+            elif "date" in question.lower():
+                text = f"{1 + int(digest[:2], 16) % 28} mars {2000 + int(digest[2:4], 16) % 24}"
+            else:
+                text = f"réponse {digest[:8]}"
+            reply = ChatMessage.from_assistant(text=text)
+            completion_tokens = _estimate_tokens(text)
+
+        reply.meta["usage"] = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return {"replies": [reply]}
+
+
+class ScriptedChatGenerator:
+    """Chat generator answering each question with the next scripted text (or raising
+    it, for an exception), for tests of the orchestrator's handling of the answers"""
+
+    def __init__(self, model: str, answers: List[Any]):
+        self.model = model
+        self.answers = list(answers)
+        self.questions: List[Optional[str]] = []
+
+    def run(self, messages: List[ChatMessage], tools: Optional[list] = None, **kwargs) -> Dict[str, Any]:
+        self.questions.append(messages[-1].text)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return {"replies": [ChatMessage.from_assistant(text=answer)]}
+
+
+def make_fake_sonar_pro_response(real_function: Callable, latency: LatencyModel) -> Callable:
+    """Build a fake of `get_sonar_pro_response` keeping its name, signature and docstring.
+
+    The fake search goes through the same cassette hook and resilience guard as the real
+    tool (with a guard of its own, so benchmark runs don't share breaker state).
+    """
+    from agent.tools import PerplexityResponse, make_perplexity_guard, resilient_sonar_pro_call
+
+    calls = CallCounter()
+    guard = make_perplexity_guard()
+
+    def search(message: str) -> PerplexityResponse:
+        time.sleep(latency.sample())
+        if latency.should_fail():
+            calls.record(failed=True)
+            raise RuntimeError("Perplexity: simulated failure")
+        calls.record()
+        digest = hashlib.sha1(message.encode("utf-8")).hexdigest()
+        return PerplexityResponse(
+            content=f"Résultat de recherche {digest[:8]} pour : {message[:200]}",
+            citations=[f"https://example.org/{digest[:8]}"],
+        )
+
+    @functools.wraps(real_function)
+    def fake_sonar_pro_response(message: str) -> PerplexityResponse:
+        return resilient_sonar_pro_call(message, lambda: search(message), guard=guard)
+
+    fake_sonar_pro_response.calls = calls
+    fake_sonar_pro_response.guard = guard
+    return fake_sonar_pro_response
+
+
+# Aggregates read by agent.util._process_financial_results
+OFGL_AGGREGATES = {
+    "Encours de dette": 1.0,
+    "Epargne brute": 0.18,
+    "Recettes de fonctionnement": 1.1,
+    "Remboursements d'emprunts hors GAD": 0.09,
+    "Annuité de la dette": 0.12,
+    "Epargne de gestion": 0.21,
+    "Epargne nette": 0.09,
+    "Recettes totales": 1.4,
+    "Dépenses de fonctionnement": 0.92,
+    "Dépenses d'investissement": 0.35,
+}
+
+
+def fake_image(url: str, size: int = 800) -> bytes:
+    """A PNG logo of `size` pixels, coloured after the URL (stands in for the download)"""
+    from PIL import Image
+
+    digest = hashlib.sha256(url.encode("utf-8")).digest()
+    output = io.BytesIO()
+    Image.new("RGB", (size, size), tuple(digest[:3])).save(output, format="PNG")
+    return output.getvalue()
+
+
+def fake_ofgl_rows(dataset: str, where: str) -> List[Dict[str, Any]]:
+    """Synthetic OFGL export rows for a `where` clause like "siren='…' AND year(exer)='2023'" """
+    identifier = where.split("'")[1] if "'" in where else "000000000"
+    seed = int(hashlib.sha1(identifier.encode("utf-8")).hexdigest()[:8], 16)
+    population = 10_000 + seed % 200_000
+    years = [int(y) for y in re.findall(r"\b(20\d\d)\b", where)] or [2023]
+
+    rows = []
+    for year in years:
+        scale = population * 1_500 * (1 + (year - 2016) * 0.02)
+        for agregat, ratio in OFGL_AGGREGATES.items():
+            montant = round(scale * ratio, 2)
+            row = {
+                "exer": f"{year}-01-01",
+                "siren": identifier,
+                "agregat": agregat,
+                "montant": montant,
+                "euros_par_habitant": round(montant / population, 2),
+                "montant_flux": 0.0,
+                "ptot": population,
+                "epci_name": f"EPCI {identifier}",
+            }
+            if dataset == "ofgl-base-ei":
+                row.update({
+                    "epci_code": identifier,
+                    "montant_gfp": montant,
+                    "montant_communes": 0.0,
+                    "nat_juridique": "CA",
+                    "mode_financement": "FPU",
+                    "gfp_qpv": "Non",
+                    "reg_name": ["Normandie"],
+                    "dep_name": ["Seine-Maritime"],
+                })
+            else:
+                row.update({
+                    "com_name": f"Commune {identifier}",
+                    "insee": identifier[-5:],
+                    "montant_bp": montant,
+                    "montant_ba": 0.0,
+                    "rural": "Non",
+                    "montagne": "Non",
+                    "touristique": "Non",
+                    "qpv": "Non",
+                })
+            rows.append(row)
+    return sorted(rows, key=lambda r: r["agregat"])
+
+
+class FakeOFGLServer:
+    """Local HTTP server answering OFGL `exports/json` queries with synthetic data"""
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.calls = CallCounter()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(server.latency.sample())
+                if server.latency.should_fail():
+                    server.calls.record(failed=True)
+                    self.send_response(503)
+                    self.end_headers()
+                    self.wfile.write(b"simulated failure")
+                    return
+                server.calls.record()
+
+                url = urlparse(self.path)
+                dataset = url.path.strip("/").split("/")[0]
+                where = parse_qs(url.query).get("where", [""])[0]
+                body = json.dumps(fake_ofgl_rows(dataset, where)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeOFGLServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
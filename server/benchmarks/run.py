@@ -0,0 +1,368 @@
+"""Benchmark the orchestrator end to end against fake Bedrock, Perplexity and OFGL backends.
+
+Example:
+    python -m benchmarks.run --fiches 3 --llm-latency lognormal:1.5,0.4 \
+        --tool-latency lognormal:4,0.5 --ofgl-latency uniform:0.2,0.8 --output report.json
+
+Reports wall time, per-section durations (the longest one is the critical path of a
+parallel run), LLM/tool/HTTP call counts and the peak traced memory of every fiche.
+
+A recorded fiche (see agent/cassette.py) can be profiled instead of the fakes:
+    python -m benchmarks.run --cassette lehavre.cassette.jsonl.gz --cassette-latency
+"""
+import argparse
+import functools
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+from . import use_dummy_credentials
+
+use_dummy_credentials()
+
+from agent import orchestrator as orchestrator_module  # noqa: E402
+from agent.agents import FAST_MODEL_ID  # noqa: E402
+from agent import tools, util  # noqa: E402
+from agent.assets import AssetCache  # noqa: E402
+from agent.cassette import REPLAY, use_cassette  # noqa: E402
+from agent.epci_cache import EPCIResultStore  # noqa: E402
+from agent.results import ResultSink  # noqa: E402
+from agent.usage import Budget  # noqa: E402
+from api.batch import city_info_from_commune  # noqa: E402
+
+from .fakes import (  # noqa: E402
+    FakeBedrockChatGenerator,
+    FakeOFGLServer,
+    LatencyModel,
+    fake_image,
+    make_fake_sonar_pro_response,
+    set_current_section,
+)
+
+COMMUNES_FILE = (
+    Path(__file__).resolve().parents[2] / "data" / "populations-ofgl-communes-postprocessed.json"
+)
+
+# Orchestrator methods timed as sections: (label, method name, args)
+SECTIONS = [
+    ("logo", "process_logo_field", ()),
+    ("summary.municipality", "process_summary_fields", (False,)),
+    ("summary.inter_municipality", "process_summary_fields", (True,)),
+    ("projects.municipality", "process_projects_fields", (False,)),
+    ("projects.inter_municipality", "process_projects_fields", (True,)),
+    ("contacts", "process_contact_fields", ()),
+    ("budget", "process_budget_fields", ()),
+    ("financial_data", "process_financial_data", ()),
+    ("comparative_data", "process_comparative_data", ()),
+]
+
+
+def load_city_infos(count: int) -> List[SimpleNamespace]:
+    """CityModel-like inputs for the first `count` communes of the OFGL population file"""
+    if COMMUNES_FILE.exists():
+        with open(COMMUNES_FILE, "r", encoding="utf-8") as file:
+            communes = json.load(file)[:count]
+    else:
+        communes = [
+            {
+                "siren": f"2100000{i:02d}",
+                "com_code": f"000{i:02d}",
+                "com_name": f"Commune {i}",
+                "epci_code": f"2000000{i:02d}",
+                "epci_name": f"EPCI {i}",
+                "reference_sirens": [{"siren": f"2200000{i:02d}"}],
+            }
+            for i in range(count)
+        ]
+
+    return [SimpleNamespace(**city_info_from_commune(commune)) for commune in communes]
+
+
+def _timed_section(label: str, method: Callable, timings: Dict[str, float]) -> Callable:
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        set_current_section(label)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings[label] = time.perf_counter() - start
+            set_current_section(None)
+
+    return wrapper
+
+
+def _instrument_sections(orchestrator, timings: Dict[str, float]) -> None:
+    """Replace the section methods of one orchestrator by timed versions.
+
+    Methods called with different arguments (e.g. inter=True) get separate labels.
+    """
+    for method_name in {name for _, name, _ in SECTIONS}:
+        method = getattr(orchestrator, method_name)
+        labels = {args: label for label, name, args in SECTIONS if name == method_name}
+
+        def dispatch(*args, _method=method, _labels=labels, **kwargs):
+            key = tuple(args) + tuple(kwargs.values())
+            label = _labels.get(key, _method.__name__)
+            return _timed_section(label, _method, timings)(*args, **kwargs)
+
+        setattr(orchestrator, method_name, dispatch)
+
+
+def _city_info_from_cassette(meta: Dict[str, Any]) -> SimpleNamespace:
+    city_info = dict(meta["city_info"])
+    city_info.setdefault("municipality_code", "")
+    return SimpleNamespace(**city_info)
+
+
+def run_benchmark(
+    fiches: int = 1,
+    llm_latency: str = "0",
+    tool_latency: str = "0",
+    ofgl_latency: str = "0",
+    llm_failure_rate: float = 0.0,
+    tool_failure_rate: float = 0.0,
+    ofgl_failure_rate: float = 0.0,
+    mode: str = "parallel",
+    seed: int = 0,
+    cassette: Optional[str] = None,
+    cassette_mode: str = REPLAY,
+    cassette_latency: bool = False,
+    token_budget: Optional[int] = None,
+    epci_store: Optional[EPCIResultStore] = None,
+) -> Dict[str, Any]:
+    """Generate fiches and return the report.
+
+    Without `cassette`, `fiches` communes are generated against the fake backends. With
+    a cassette, the real code paths are used and the external calls are replayed from
+    (or recorded to) that file.
+    """
+    fake_llm = FakeBedrockChatGenerator(LatencyModel.parse(llm_latency, llm_failure_rate, seed))
+    # Fast tier of the tool agent, counted with the strong one
+    fake_fast_llm = FakeBedrockChatGenerator(
+        LatencyModel.parse(llm_latency, llm_failure_rate, seed + 3), model=FAST_MODEL_ID
+    )
+    fake_fast_llm.calls = fake_llm.calls
+    fake_tool = make_fake_sonar_pro_response(
+        tools.get_sonar_pro_response,
+        LatencyModel.parse(tool_latency, tool_failure_rate, seed + 1),
+    )
+
+    original_tool = orchestrator_module.get_sonar_pro_response
+    original_asset_cache = orchestrator_module.get_asset_cache
+    original_result_sink = orchestrator_module.get_result_sink
+    original_ofgl_url = util.OFGL_API_URL
+    results = []
+
+    with ExitStack() as stack:
+        ofgl = stack.enter_context(
+            FakeOFGLServer(LatencyModel.parse(ofgl_latency, ofgl_failure_rate, seed + 2))
+        )
+        workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        if cassette_mode == REPLAY:
+            # Logos are "downloaded" from the fake, into a cache of this run
+            asset_cache = AssetCache(os.path.join(workdir, "assets"), fetch=fake_image)
+            orchestrator_module.get_asset_cache = lambda: asset_cache
+        active_cassette = None
+        if cassette:
+            active_cassette = stack.enter_context(
+                use_cassette(cassette, mode=cassette_mode, simulate_latency=cassette_latency)
+            )
+            if cassette_mode == REPLAY:
+                city_infos = [_city_info_from_cassette(active_cassette.meta)]
+            else:
+                city_infos = load_city_infos(fiches)
+        else:
+            city_infos = load_city_infos(fiches)
+            orchestrator_module.get_sonar_pro_response = fake_tool
+            util.OFGL_API_URL = ofgl.url
+
+        # The fiche data is stored in the temporary directory of the run
+        result_sink = ResultSink(os.path.join(workdir, "results"))
+        orchestrator_module.get_result_sink = lambda: result_sink
+        tracemalloc.start()
+        try:
+            for city_info in city_infos:
+                for counter in (fake_llm.calls, fake_tool.calls, ofgl.calls):
+                    counter.reset()
+                if active_cassette is not None:
+                    active_cassette.calls.clear()
+                tracemalloc.reset_peak()
+                timings: Dict[str, float] = {}
+                error: Optional[str] = None
+                usage: Optional[Dict[str, Any]] = None
+
+                start = time.perf_counter()
+                try:
+                    set_current_section("init")
+                    init_start = time.perf_counter()
+                    orchestrator = orchestrator_module.Orchestrator(
+                        city_info,
+                        budget=Budget(max_tokens=token_budget) if token_budget else None,
+                        epci_store=epci_store,
+                    )
+                    timings["init"] = time.perf_counter() - init_start
+                    set_current_section(None)
+
+                    if active_cassette is None:
+                        orchestrator.tool_agent.llm = fake_llm
+                        orchestrator.tool_agent.fast_llm = fake_fast_llm
+                        orchestrator.simple_agent.llm = fake_llm
+                    _instrument_sections(orchestrator, timings)
+
+                    if mode == "sequential":
+                        orchestrator.process_all_sections()
+                    else:
+                        orchestrator.parallel_process_all_sections()
+                    usage = orchestrator.usage.to_dict()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                wall_time = time.perf_counter() - start
+                peak_memory = tracemalloc.get_traced_memory()[1]
+
+                if active_cassette is not None:
+                    calls = {
+                        "llm_calls": active_cassette.calls["bedrock"],
+                        "tool_calls": active_cassette.calls["perplexity"],
+                        "http_calls": active_cassette.calls["ofgl"],
+                    }
+                else:
+                    calls = {
+                        "llm_calls": fake_llm.calls.total,
+                        "llm_failures": fake_llm.calls.failures,
+                        "tool_calls": fake_tool.calls.total,
+                        "tool_failures": fake_tool.calls.failures,
+                        "http_calls": ofgl.calls.total,
+                        "http_failures": ofgl.calls.failures,
+                    }
+
+                section_times = {k: v for k, v in timings.items() if k != "init"}
+                results.append({
+                    "municipality": city_info.municipality_name,
+                    "wall_time_s": round(wall_time, 3),
+                    "init_s": round(timings.get("init", 0.0), 3),
+                    "critical_section": (
+                        max(section_times, key=section_times.get) if section_times else None
+                    ),
+                    "sections": {
+                        label: {
+                            "duration_s": round(duration, 3),
+                            "llm_calls": fake_llm.calls.by_section[label],
+                            "tool_calls": fake_tool.calls.by_section[label],
+                            "http_calls": ofgl.calls.by_section[label],
+                        }
+                        for label, duration in timings.items()
+                    },
+                    **calls,
+                    "peak_memory_mb": round(peak_memory / 1_048_576, 2),
+                    "usage": usage,
+                    "error": error,
+                })
+        finally:
+            tracemalloc.stop()
+            result_sink.flush()
+            orchestrator_module.get_result_sink = original_result_sink
+            orchestrator_module.get_sonar_pro_response = original_tool
+            orchestrator_module.get_asset_cache = original_asset_cache
+            util.OFGL_API_URL = original_ofgl_url
+
+    wall_times = [r["wall_time_s"] for r in results]
+    escalation_rates = [r["usage"]["routing"]["escalation_rate"] for r in results if r.get("usage")]
+    return {
+        "config": {
+            "fiches": len(city_infos),
+            "mode": mode,
+            "llm_latency": llm_latency,
+            "tool_latency": tool_latency,
+            "ofgl_latency": ofgl_latency,
+            "llm_failure_rate": llm_failure_rate,
+            "tool_failure_rate": tool_failure_rate,
+            "ofgl_failure_rate": ofgl_failure_rate,
+            "seed": seed,
+            "cassette": cassette,
+            "cassette_mode": cassette_mode if cassette else None,
+            "token_budget": token_budget,
+            "share_epci": epci_store is not None,
+        },
+        "summary": {
+            "wall_time_mean_s": round(statistics.mean(wall_times), 3) if wall_times else None,
+            "wall_time_max_s": max(wall_times) if wall_times else None,
+            "llm_calls_per_fiche": statistics.mean(r["llm_calls"] for r in results) if results else None,
+            "tool_calls_per_fiche": statistics.mean(r["tool_calls"] for r in results) if results else None,
+            "http_calls_per_fiche": statistics.mean(r["http_calls"] for r in results) if results else None,
+            "peak_memory_max_mb": max(r["peak_memory_mb"] for r in results) if results else None,
+            "escalation_rate_mean": round(statistics.mean(escalation_rates), 4) if escalation_rates else None,
+            "errors": sum(1 for r in results if r["error"]),
+        },
+        "fiches": results,
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    for fiche in report["fiches"]:
+        print(
+            f"{fiche['municipality']}: {fiche['wall_time_s']:.2f}s "
+            f"(init {fiche['init_s']:.2f}s, critical: {fiche['critical_section']}) "
+            f"llm={fiche['llm_calls']} tool={fiche['tool_calls']} http={fiche['http_calls']} "
+            f"peak={fiche['peak_memory_mb']}MB"
+            + (f" ERROR {fiche['error']}" if fiche["error"] else "")
+        )
+        for label, section in fiche["sections"].items():
+            print(
+                f"    {label:<30} {section['duration_s']:>8.2f}s "
+                f"llm={section['llm_calls']:<4} tool={section['tool_calls']:<4} http={section['http_calls']}"
+            )
+    print("Summary:", json.dumps(report["summary"]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fiches", type=int, default=1, help="Number of communes to generate")
+    parser.add_argument("--mode", choices=["parallel", "sequential"], default="parallel")
+    parser.add_argument("--llm-latency", default="0", help="e.g. lognormal:1.5,0.4")
+    parser.add_argument("--tool-latency", default="0", help="e.g. lognormal:4,0.5")
+    parser.add_argument("--ofgl-latency", default="0", help="e.g. uniform:0.2,0.8")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--tool-failure-rate", type=float, default=0.0)
+    parser.add_argument("--ofgl-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cassette", help="Replay (or record) the external calls from this cassette")
+    parser.add_argument("--cassette-mode", choices=["replay", "record"], default="replay")
+    parser.add_argument("--cassette-latency", action="store_true", help="Replay with the recorded latencies")
+    parser.add_argument("--token-budget", type=int, help="Per-fiche token budget (see agent/usage.py)")
+    parser.add_argument("--share-epci", action="store_true", help="Reuse EPCI results between fiches")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        fiches=args.fiches,
+        llm_latency=args.llm_latency,
+        tool_latency=args.tool_latency,
+        ofgl_latency=args.ofgl_latency,
+        llm_failure_rate=args.llm_failure_rate,
+        tool_failure_rate=args.tool_failure_rate,
+        ofgl_failure_rate=args.ofgl_failure_rate,
+        mode=args.mode,
+        seed=args.seed,
+        cassette=args.cassette,
+        cassette_mode=args.cassette_mode,
+        cassette_latency=args.cassette_latency,
+        token_budget=args.token_budget,
+        epci_store=EPCIResultStore("benchmark") if args.share_epci else None,
+    )
+    _print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
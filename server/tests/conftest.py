@@ -6,3 +6,20 @@ import pytest
 # Add the server directory to Python path for imports
 server_path = Path(__file__).parent.parent
 sys.path.insert(0, str(server_path))
+
+from benchmarks import use_dummy_credentials  # noqa: E402
+
+# The tests never reach AWS either
+use_dummy_credentials()
+
+
+@pytest.fixture
+def fake_ofgl(monkeypatch):
+    """Serve the OFGL API from the benchmark fakes and return the city info of a commune
+    they know, to build an `Orchestrator` without network access"""
+    from agent import util
+    from benchmarks.fakes import fake_ofgl_rows
+    from benchmarks.run import load_city_infos
+
+    monkeypatch.setattr(util, "_get_ofgl_json", lambda dataset, params: (200, fake_ofgl_rows(dataset, params["where"])))
+    return load_city_infos(1)[0]
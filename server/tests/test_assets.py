@@ -0,0 +1,107 @@
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from agent import orchestrator
+from agent.assets import SVG_MIME_TYPE, AssetCache, prepare_image
+from agent.results import ResultSink
+from api import rendering
+from benchmarks.fakes import ScriptedChatGenerator, fake_image
+from benchmarks.run import SECTIONS
+
+SVG = b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+
+
+def test_images_are_validated_and_downscaled():
+    body, mime_type = prepare_image(fake_image("https://example.org/logo.png", size=800), max_pixels=512)
+    assert mime_type == "image/png"
+    assert Image.open(io.BytesIO(body)).size == (512, 512)
+
+    small = fake_image("https://example.org/logo.png", size=100)
+    assert prepare_image(small, max_pixels=512) == (small, "image/png")
+    assert prepare_image(SVG) == (SVG, SVG_MIME_TYPE)
+    with pytest.raises(ValueError):
+        prepare_image(b"<html><body>Not found</body></html>")
+
+
+def test_assets_are_content_addressed_and_fetched_once(tmp_path):
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        time.sleep(0.05)
+        if "dead" in url:
+            raise ConnectionError("host unreachable")
+        return fake_image("same image")
+
+    cache = AssetCache(str(tmp_path), fetch=fetch)
+    futures = [cache.prefetch("https://a.fr/logo.png") for _ in range(3)]
+    assets = [future.result() for future in futures]
+    other = cache.fetch("https://b.fr/blason.png")
+
+    assert fetched == ["https://a.fr/logo.png", "https://b.fr/blason.png"]
+    assert assets[0] == assets[1] == assets[2]
+    assert other.digest == assets[0].digest and other.path == assets[0].path
+    assert len(list((tmp_path / "objects").iterdir())) == 1
+
+    # Failures are remembered, and another worker reuses the cached assets from disk
+    assert cache.fetch("https://dead.fr/logo.png") is None
+    assert cache.fetch("https://dead.fr/logo.png") is None
+    assert fetched.count("https://dead.fr/logo.png") == 1
+    warm = AssetCache(str(tmp_path), fetch=fetch)
+    assert warm.get("https://a.fr/logo.png") == assets[0]
+    assert warm.get("https://dead.fr/logo.png") is None
+
+
+def test_fetch_waits_at_most_the_timeout(tmp_path):
+    release = threading.Event()
+
+    def slow_fetch(url):
+        release.wait(5)
+        return fake_image(url)
+
+    cache = AssetCache(str(tmp_path), fetch=slow_fetch)
+    start = time.perf_counter()
+    assert cache.fetch("https://slow.fr/logo.png", timeout=0.1) is None
+    assert time.perf_counter() - start < 1
+    release.set()
+    assert cache.prefetch("https://slow.fr/logo.png").result(timeout=5) is not None
+
+
+def test_renderer_only_serves_cached_assets(tmp_path, monkeypatch):
+    cache = AssetCache(str(tmp_path), fetch=fake_image)
+    monkeypatch.setattr(rendering, "get_asset_cache", lambda: cache)
+
+    rendering.fetch_assets({"logo": {"content": "https://example.org/logo.png"}})
+    served = rendering.asset_url_fetcher("https://example.org/logo.png")
+    assert served["mime_type"] == "image/png"
+    assert Image.open(io.BytesIO(served["string"])).size == (512, 512)
+
+    with pytest.raises(ValueError):
+        rendering.asset_url_fetcher("https://example.org/other.png")
+    rendering.fetch_assets({"logo": {"content": "inconnu"}})
+    assert cache.get("inconnu") is None
+
+
+@pytest.mark.parametrize("pipeline", ["process_all_sections", "parallel_process_all_sections"])
+def test_pipelines_answer_and_prefetch_the_logo(pipeline, tmp_path, monkeypatch, fake_ofgl):
+    fetched = []
+    cache = AssetCache(str(tmp_path / "assets"), fetch=lambda url: fetched.append(url) or fake_image(url))
+    monkeypatch.setattr(orchestrator, "get_asset_cache", lambda: cache)
+    monkeypatch.setattr(orchestrator, "get_result_sink", lambda: ResultSink(str(tmp_path / "results")))
+    fiche = orchestrator.Orchestrator(fake_ofgl)
+    fiche.tool_agent.fast_llm = fiche.tool_agent.llm = ScriptedChatGenerator(
+        "strong", ["Le logo : https://www.dijon.fr/logo.png"])
+    # Only the logo is answered, the other sections are left empty
+    for _, method_name, _ in SECTIONS:
+        if method_name != "process_logo_field":
+            monkeypatch.setattr(fiche, method_name, lambda *args, **kwargs: None)
+
+    data = getattr(fiche, pipeline)()
+
+    assert data["logo"]["content"] == "https://www.dijon.fr/logo.png"
+    assert cache.fetch("https://www.dijon.fr/logo.png") is not None
+    assert fetched == ["https://www.dijon.fr/logo.png"]
@@ -0,0 +1,84 @@
+import json
+import threading
+
+from agent.util import OFGLCache
+from api.batch import BatchRun, city_info_from_commune, filter_communes
+
+
+def commune(siren, dep, reg, population, epci="200000001"):
+    return {
+        "siren": siren,
+        "com_code": siren[-5:],
+        "com_name": f"Commune {siren}",
+        "epci_code": epci,
+        "epci_name": f"EPCI {epci}",
+        "dep_code": dep,
+        "reg_code": reg,
+        "ptot": population,
+        "reference_sirens": [{"siren": "219999999"}],
+    }
+
+
+COMMUNES = [
+    commune("210000003", "76", "28", 170000, epci="200000002"),
+    commune("210000001", "76", "28", 20000),
+    commune("210000002", "27", "28", 50000),
+    commune("210000004", "01", "84", 40000),
+]
+
+
+def test_filter_communes():
+    assert [c["siren"] for c in filter_communes(COMMUNES, department="76")] == ["210000001", "210000003"]
+    assert len(filter_communes(COMMUNES, region="28", min_population=30000)) == 2
+    assert [c["siren"] for c in filter_communes(COMMUNES, max_population=20000)] == ["210000001"]
+
+
+def test_batch_run_writes_results_and_resumes(tmp_path):
+    generated = []
+
+    def generate(city_info, job_id):
+        generated.append(city_info["siren"])
+        if city_info["siren"] == "210000002":
+            raise RuntimeError("boom")
+        return {"data": {"municipality_name": {"content": city_info["municipality_name"]}}, "usage": {"cost_usd": 0.5}}
+
+    city_infos = [city_info_from_commune(c) for c in filter_communes(COMMUNES, region="28")]
+    batch = BatchRun(str(tmp_path), workers=2, render=False, resume=True, generate=generate)
+
+    summary = batch.run(city_infos)
+    assert (summary["completed"], summary["failed"], summary["skipped"]) == (2, 1, 0)
+    assert summary["cost_usd"] == 1.0
+    data = json.loads((tmp_path / "210000001" / "data.json").read_text())
+    assert data["municipality_name"]["content"] == "Commune 210000001"
+    assert len((tmp_path / "manifest.jsonl").read_text().splitlines()) == 3
+
+    # Only the failed fiche is generated again
+    generated.clear()
+    summary = batch.run(city_infos)
+    assert generated == ["210000002"]
+    assert summary["skipped"] == 2
+
+
+def test_ofgl_cache_fetches_each_query_once():
+    cache = OFGLCache()
+    fetches = []
+    barrier = threading.Barrier(4, timeout=5)
+
+    def fetch():
+        fetches.append(1)
+        return 200, [{"agregat": "Encours de dette"}]
+
+    def query():
+        barrier.wait()
+        return cache.get("epci", fetch)
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fetches) == 1
+    assert cache.get("epci", fetch) == ((200, [{"agregat": "Encours de dette"}]), True)
+    assert cache.get("missing", lambda: (500, "error"))[0] == (500, "error")
+    assert cache.get("missing", lambda: (200, []))[1] is False
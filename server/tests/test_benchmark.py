@@ -0,0 +1,24 @@
+from benchmarks.run import run_benchmark
+
+
+def test_benchmark_runs_orchestrator_end_to_end():
+    report = run_benchmark(fiches=1, mode="parallel")
+    fiche = report["fiches"][0]
+
+    assert fiche["error"] is None
+    assert fiche["llm_calls"] > 0 and fiche["tool_calls"] > 0
+    # Municipality, EPCI and reference communes are fetched from the fake OFGL server
+    assert fiche["http_calls"] >= 3
+    assert fiche["critical_section"] in fiche["sections"]
+    assert report["summary"]["errors"] == 0
+
+
+def test_tool_calls_are_attributed_to_their_section():
+    fiche = run_benchmark(fiches=1, mode="parallel")["fiches"][0]
+    sections = fiche["sections"]
+
+    # Perplexity is called from the worker threads of ResilientCall and run_tasks
+    assert sections["init"]["tool_calls"] == 0
+    for label in ("summary.municipality", "projects.municipality", "contacts", "budget"):
+        assert sections[label]["tool_calls"] > 0 and sections[label]["llm_calls"] > 0
+    assert sum(section["tool_calls"] for section in sections.values()) == fiche["tool_calls"]
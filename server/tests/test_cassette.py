@@ -0,0 +1,53 @@
+import pytest
+
+from agent.cassette import (
+    RECORD,
+    REPLAY,
+    CassetteMissError,
+    RecordedCallError,
+    through_cassette,
+    use_cassette,
+)
+from benchmarks.run import run_benchmark
+
+
+def test_cassette_replays_recorded_calls(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    responses = iter(["first", "second"])
+
+    def failing():
+        raise ValueError("upstream down")
+
+    with use_cassette(path, mode=RECORD) as cassette:
+        cassette.annotate(city_info={"siren": "217600350"})
+        assert through_cassette("tool", {"q": "a"}, lambda: next(responses)) == "first"
+        assert through_cassette("tool", {"q": "a"}, lambda: next(responses)) == "second"
+        with pytest.raises(ValueError):
+            through_cassette("tool", {"q": "b"}, failing)
+
+    def unexpected():
+        raise AssertionError("replay must not call the upstream")
+
+    with use_cassette(path, mode=REPLAY) as cassette:
+        assert cassette.meta["city_info"]["siren"] == "217600350"
+        assert through_cassette("tool", {"q": "a"}, unexpected) == "first"
+        assert through_cassette("tool", {"q": "a"}, unexpected) == "second"
+        with pytest.raises(RecordedCallError):
+            through_cassette("tool", {"q": "b"}, unexpected)
+        with pytest.raises(CassetteMissError):
+            through_cassette("tool", {"q": "c"}, unexpected)
+
+
+def test_recorded_fiche_replays_offline(tmp_path):
+    path = str(tmp_path / "fiche.jsonl.gz")
+
+    with use_cassette(path, mode=RECORD):
+        recorded = run_benchmark(fiches=1)
+    replayed = run_benchmark(cassette=path, cassette_mode=REPLAY)
+
+    assert recorded["fiches"][0]["error"] is None
+    fiche = replayed["fiches"][0]
+    assert fiche["error"] is None
+    assert fiche["municipality"] == recorded["fiches"][0]["municipality"]
+    assert fiche["llm_calls"] == recorded["fiches"][0]["llm_calls"]
+    assert fiche["http_calls"] == recorded["fiches"][0]["http_calls"]
@@ -0,0 +1,70 @@
+import json
+import logging
+
+from haystack.dataclasses import ChatMessage, ToolCall
+
+from agent.conversations import ConversationStore
+from benchmarks.run import run_benchmark
+
+
+def exchange(question, payload, answer):
+    call = ToolCall(tool_name="get_sonar_pro_response", arguments={"message": question})
+    request = ChatMessage.from_assistant(tool_calls=[call])
+    return [
+        ChatMessage.from_user(question),
+        request,
+        ChatMessage.from_tool(payload, origin=call),
+        ChatMessage.from_assistant(answer),
+    ]
+
+
+def test_exchanges_are_reduced_to_their_answer_and_bounded():
+    store = ConversationStore(max_chars=60)
+    messages = store.open("summary")
+    messages.extend(exchange("Population ?", "x" * 5000, "159 346 habitants"))
+    store.compact("summary", 0, "159 346 habitants")
+
+    assert [m.text for m in store["summary"]] == ["Population ?", "159 346 habitants"]
+    assert store.peak_chars > 5000 and store.held_chars < 60
+
+    # The oldest exchanges are dropped above max_chars, the last one is always kept
+    for index in range(3):
+        start = len(messages)
+        messages.extend(exchange(f"Question {index} ?", "y" * 100, f"Réponse {index}"))
+        store.compact("summary", start, f"Réponse {index}")
+    assert [m.text for m in store["summary"]] == [
+        "Question 1 ?", "Réponse 1", "Question 2 ?", "Réponse 2",
+    ]
+    assert store.held_chars <= 60
+
+
+def test_finished_conversations_are_evicted_and_sampled_in_logs(caplog):
+    caplog.set_level(logging.INFO, logger="agent.conversations")
+    logged = ConversationStore(log_sample_rate=1.0)
+    quiet = ConversationStore(log_sample_rate=0.0)
+    for store in (logged, quiet):
+        store.open("contacts").extend(exchange("Maire ?", "z" * 300, "Nathalie Koenders"))
+        store.compact("contacts", 0, "Nathalie Koenders")
+        store.close("contacts")
+        assert "contacts" not in store and store.held_chars == 0
+
+    records = [json.loads(record.message) for record in caplog.records]
+    assert records == [{
+        "event": "conversation_finished",
+        "conversation": "contacts",
+        "exchanges": 1,
+        "tool_calls": 1,
+        "chars": len("Maire ?") + len("Nathalie Koenders"),
+    }]
+    assert logged.stats()["evicted_conversations"] == 1
+
+
+def test_jobs_report_their_memory_without_dumping_conversations(capsys):
+    fiche = run_benchmark(fiches=1)["fiches"][0]
+    memory = fiche["usage"]["memory"]
+
+    assert fiche["error"] is None
+    assert memory["open_conversations"] == 0 and memory["evicted_conversations"] > 0
+    assert 0 < memory["conversation_peak_kb"] < 100
+    assert memory["process_peak_rss_mb"] > 0
+    assert "ChatMessage(" not in capsys.readouterr().out
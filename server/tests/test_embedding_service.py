@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agent.embedding_service import EmbeddingService, normalise_text
+
+
+def fake_embed_batch(calls, delay=0.02):
+    def embed_batch(texts):
+        calls.append(list(texts))
+        # A fixed cost per call, as the model overhead on CPU
+        time.sleep(delay)
+        return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+    return embed_batch
+
+
+def test_concurrent_requests_are_embedded_in_batches():
+    calls = []
+    service = EmbeddingService(fake_embed_batch(calls), max_batch=16, window=0.05)
+    texts = [f"dette de la commune {i}" for i in range(40)]
+    barrier = threading.Barrier(len(texts))
+
+    def embed(text):
+        barrier.wait()
+        return service.embed(text)
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        vectors = list(pool.map(embed, texts))
+
+    assert vectors == [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+    assert max(len(call) for call in calls) <= 16
+    assert len(calls) <= 5
+    assert service.stats["embedded"] == 40
+
+
+def test_query_embeddings_are_cached_by_normalised_text():
+    calls = []
+    service = EmbeddingService(fake_embed_batch(calls, delay=0), window=0, cache_size=2)
+    assert normalise_text("  Encours  de\tDETTE ") == "encours de dette"
+
+    first = service.embed("Encours de dette")
+    assert service.embed("  encours DE dette\n") == first
+    assert len(calls) == 1 and service.stats["cache_hits"] == 1
+
+    service.embed("épargne brute")
+    service.embed("capacité de désendettement")
+    # The least recently used query was evicted
+    service.embed("encours de dette")
+    assert len(calls) == 4
+
+    # Documents bypass the cache
+    service.embed_many(["a", "b", "c"], cache=False)
+    assert calls[-1] == ["a", "b", "c"] and service.stats["requests"] == 5
+
+
+def test_failed_batches_are_not_cached():
+    attempts = []
+
+    def embed_batch(texts):
+        attempts.append(texts)
+        if len(attempts) == 1:
+            raise RuntimeError("model unavailable")
+        return [[1.0] for _ in texts]
+
+    service = EmbeddingService(embed_batch, window=0)
+    with pytest.raises(RuntimeError):
+        service.embed("dette")
+    assert service.embed("dette") == [1.0]
+    assert len(attempts) == 2
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+from haystack.dataclasses import ChatMessage
+
+from agent import orchestrator
+from agent.epci_cache import EPCIResultStore
+from api.backends.local import FileSystemBlobStore
+from benchmarks.run import run_benchmark
+
+
+def test_concurrent_communes_compute_epci_sections_once():
+    store = EPCIResultStore("v1")
+    computed = []
+    barrier = threading.Barrier(3, timeout=5)
+    results = []
+
+    def compute():
+        computed.append(1)
+        time.sleep(0.05)
+        return {"population": {"content": 1000}}
+
+    def commune():
+        barrier.wait()
+        results.append(store.get_or_compute("200084952", "summary", compute))
+
+    threads = [threading.Thread(target=commune) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(computed) == 1
+    assert sorted(reused for _, reused in results) == [False, True, True]
+    # Each commune gets its own copy
+    results[0][0]["population"]["content"] = 0
+    assert results[1][0]["population"]["content"] == 1000
+
+
+def test_results_are_persisted_with_ttl_and_template_version(tmp_path):
+    blobs = FileSystemBlobStore(str(tmp_path))
+    EPCIResultStore("v1", blobs=blobs).get_or_compute("200084952", "projects", lambda: {"a": 1})
+
+    assert EPCIResultStore("v1", blobs=blobs).get_or_compute("200084952", "projects", lambda: {"a": 2}) == ({"a": 1}, True)
+    assert EPCIResultStore("v2", blobs=blobs).get_or_compute("200084952", "projects", lambda: {"a": 2}) == ({"a": 2}, False)
+    assert EPCIResultStore("v1", blobs=blobs, ttl=0).get_or_compute("200084952", "projects", lambda: {"a": 3}) == ({"a": 3}, False)
+
+
+def test_failures_and_rejected_results_are_not_cached():
+    store = EPCIResultStore("v1")
+
+    def failing():
+        raise RuntimeError("OFGL down")
+
+    with pytest.raises(RuntimeError):
+        store.get_or_compute("200084952", "finances", failing)
+    assert store.get_or_compute("200084952", "finances", dict, cache_if=bool) == ({}, False)
+    assert store.get_or_compute("200084952", "finances", lambda: {"population": 1}, cache_if=bool)[1] is False
+    assert store.get_or_compute("200084952", "finances", dict, cache_if=bool) == ({"population": 1}, True)
+
+
+def test_second_commune_of_an_epci_reuses_inter_municipality_sections():
+    store = EPCIResultStore("test")
+    first = run_benchmark(fiches=1, epci_store=store)["fiches"][0]
+    second = run_benchmark(fiches=1, epci_store=store)["fiches"][0]
+
+    assert first["error"] is None and second["error"] is None
+    assert second["llm_calls"] < first["llm_calls"] * 0.75
+
+
+
+class ConstantChatGenerator:
+    """Answers every question with the same text, without calling tools"""
+
+    model = "constant"
+
+    def __init__(self, answer):
+        self.answer = answer
+
+    def run(self, messages, tools=None, **kwargs):
+        return {"replies": [ChatMessage.from_assistant(text=self.answer)]}
+
+
+def test_incomplete_epci_sections_are_not_shared(fake_ofgl):
+    store = EPCIResultStore("test")
+
+    def run_projects(answer):
+        fiche = orchestrator.Orchestrator(fake_ofgl, epci_store=store)
+        fiche.tool_agent.fast_llm = fiche.tool_agent.llm = ConstantChatGenerator(answer)
+        fiche.process_projects_fields(inter=True)
+        return fiche.data["projects"]["inter_municipality"]
+
+    # Unknown fields are not shared with the next commune, which asks again
+    run_projects("inconnu")
+    # Answers valid for every kind of field
+    complete = run_projects("12 projets depuis le 1 mars 2020, https://www.metropole-dijon.fr")
+    assert "inconnu" not in str(complete)
+    assert run_projects("inconnu") == complete
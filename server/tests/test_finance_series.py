@@ -0,0 +1,92 @@
+import json
+import math
+
+from haystack.tools import create_tool_from_function
+
+from agent import tools, util
+from benchmarks.fakes import fake_ofgl_rows
+
+
+def fake_ofgl(calls):
+    def get_ofgl_json(dataset, params):
+        calls.append(params["where"])
+        return 200, fake_ofgl_rows(dataset, params["where"])
+
+    return get_ofgl_json
+
+
+def test_all_years_are_fetched_in_one_request(monkeypatch):
+    calls = []
+    monkeypatch.setattr(util, "_get_ofgl_json", fake_ofgl(calls))
+
+    values, deltas, metrics = util.get_commune_finances_series("213100555")
+
+    assert len(calls) == 1
+    assert "year(exer) IN ('2016','2017','2018','2019','2020','2021','2022','2023')" in calls[0]
+    assert list(values.index) == list(range(2016, 2024))
+    assert list(values.columns) == util.SERIES_METRICS
+    assert deltas.loc[2016].isna().all()
+    assert deltas.loc[2017, "total_budget"] == values.loc[2017, "total_budget"] - values.loc[2016, "total_budget"]
+    assert metrics["data_from_year"] == 2023
+
+
+def test_series_matches_the_single_year_metrics(monkeypatch):
+    calls = []
+    monkeypatch.setattr(util, "_get_ofgl_json", fake_ofgl(calls))
+
+    values, _, metrics = util.get_epci_finances_series("200084952", years=["2019", "2023"])
+    _, _, single_year = util.get_epci_finances_by_code("200084952", year="2023")
+
+    assert metrics == single_year
+    for metric in util.SERIES_METRICS:
+        assert values.loc[2023, metric] == single_year[metric]
+
+
+def test_missing_aggregates_and_zero_divisions_are_unknown():
+    rows = [
+        row
+        for row in fake_ofgl_rows("ofgl-base-communes-consolidee", "siren='213100555' AND year(exer) IN ('2022','2023')")
+        if not (row["exer"].startswith("2022") and row["agregat"] == "Epargne brute")
+    ]
+    for row in rows:
+        if row["agregat"] == "Recettes de fonctionnement" and row["exer"].startswith("2023"):
+            row["montant"] = 0.0
+
+    values, deltas = util._financial_series(rows)
+    assert math.isnan(values.loc[2022, "debt_repayment_capacity"])
+    assert math.isnan(values.loc[2023, "debt_ratio"])
+
+    compact = util.finance_series_to_dict(values, deltas)
+    assert compact["years"] == [2022, 2023]
+    assert compact["deltas"][0] == [None] * len(util.SERIES_METRICS)
+    assert compact["values"][1][util.SERIES_METRICS.index("debt_ratio")] is None
+
+
+def test_aggregates_answer_the_financial_tool(monkeypatch):
+    calls = []
+    monkeypatch.setattr(util, "_get_ofgl_json", fake_ofgl(calls))
+
+    _, _, metrics = util.get_commune_finances_series("213100555", years=["2022", "2023"], with_aggregates=True)
+    _, _, epci = util.get_epci_finances_series("242100410", years=["2023"], with_aggregates=True)
+    assert len(calls) == 2
+    aggregates = metrics["aggregates"]
+    assert aggregates["years"] == [2022, 2023]
+    debt = aggregates["aggregates"]["Encours de dette"]
+    assert debt["euros_par_habitant"][1] == metrics["total_budget_per_person"]
+    json.dumps(aggregates)
+
+    lookup = tools.make_financial_aggregate_lookup({"Dijon": aggregates, "Dijon Métropole": epci["aggregates"]})
+    tool = create_tool_from_function(lookup)
+    assert tool.name == "get_financial_aggregate"
+    assert tool.parameters["required"] == ["aggregate", "entity"]
+
+    answer = lookup("encours de la dette", "dijon")
+    assert answer.startswith("Encours de dette de Dijon en 2023 : ")
+    assert f"{debt['montant'][1]:,.2f}".replace(",", " ") in answer
+    assert "en 2022" in lookup("Encours de dette", "Dijon", 2022)
+    assert "Dijon Métropole en 2023" in lookup("Epargne brute", "Métropole de Dijon")
+    assert "Années disponibles : 2023" in lookup("Epargne brute", "Dijon Metropole", 2019)
+    assert lookup("population active", "Dijon").startswith("Agrégat inconnu")
+    assert lookup("Epargne brute", "Rouen").startswith("Entité inconnue")
+
+    assert tools.make_financial_aggregate_lookup({"Dijon": None}) is None
@@ -0,0 +1,65 @@
+from agent import orchestrator
+from agent.gazetteer import load_gazetteer
+from agent.plan import get_plan
+from benchmarks.run import load_city_infos, run_benchmark
+
+
+def write_gazetteer(directory, rows):
+    directory.mkdir(exist_ok=True)
+    lines = ["siren,insee,name,area_km2,postal_code,latitude,longitude"] + rows
+    (directory / "communes.csv").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_facts_are_looked_up_by_siren_or_insee(tmp_path):
+    write_gazetteer(tmp_path, [
+        "213102318,21231,Dijon,40.41,21000,47.32202,5.04148",
+        "242100410,,Dijon Métropole,240,,,",
+        "217605409,76540,Rouen,21.38,76000,,",
+    ])
+    # Later files override earlier rows
+    (tmp_path / "updates.csv").write_text("siren,area_km2\n217605409,21.5\n", encoding="utf-8")
+    gazetteer = load_gazetteer(str(tmp_path))
+
+    assert len(gazetteer) == 3
+    assert gazetteer.resolve("213102318", "area") == "40,41 km2"
+    assert gazetteer.resolve("21231", "postal_code") == "21000"
+    assert gazetteer.resolve("213102318", "latitude") == "47,32202"
+    assert gazetteer.resolve(" 242100410 ", "area") == "240,00 km2"
+    assert gazetteer.resolve("217605409", "area") == "21,50 km2"
+    # A partial override keeps the other columns and the INSEE code of the row
+    assert gazetteer.resolve("217605409", "postal_code") == "76000"
+    assert gazetteer.resolve("76540", "area") == "21,50 km2"
+    assert gazetteer.resolve("242100410", "postal_code") is None
+    assert gazetteer.resolve("000000000", "area") is None
+    assert gazetteer.resolve("213102318", "population") is None
+    assert len(load_gazetteer(str(tmp_path / "missing"))) == 0
+
+
+def test_gazetteer_fields_skip_the_llm(tmp_path, monkeypatch):
+    assert {task.name for task in get_plan().tasks if task.gazetteer_field} == {
+        "summary.municipality.area", "summary.inter_municipality.area",
+    }
+    without = run_benchmark(fiches=1)["fiches"][0]
+
+    city_info = load_city_infos(1)[0]
+    write_gazetteer(tmp_path, [
+        f"{city_info.siren},,Commune,40.41,,,",
+        f"{city_info.inter_municipality_code},,EPCI,240,,,",
+    ])
+    monkeypatch.setattr(orchestrator, "get_gazetteer", lambda: load_gazetteer(str(tmp_path)))
+    with_gazetteer = run_benchmark(fiches=1)["fiches"][0]
+
+    assert without["error"] is None and with_gazetteer["error"] is None
+    assert with_gazetteer["llm_calls"] <= without["llm_calls"] - 2
+    assert with_gazetteer["tool_calls"] <= without["tool_calls"] - 2
+
+
+def test_gazetteer_fields_are_filled_at_init(tmp_path, monkeypatch, fake_ofgl):
+    write_gazetteer(tmp_path, [
+        f"{fake_ofgl.siren},,Commune,40.41,,,",
+        f"{fake_ofgl.inter_municipality_code},,EPCI,240,,,",
+    ])
+    monkeypatch.setattr(orchestrator, "get_gazetteer", lambda: load_gazetteer(str(tmp_path)))
+    data = orchestrator.Orchestrator(fake_ofgl).data
+    assert data["summary"]["municipality"]["area"]["content"] == "40,41 km2"
+    assert data["summary"]["inter_municipality"]["area"]["content"] == "240,00 km2"
@@ -0,0 +1,80 @@
+import numpy as np
+from haystack import Document
+from haystack.tools import create_tool_from_function
+
+from agent import hybrid_retrieval, tools
+from agent.hybrid_retrieval import BM25Index, HybridRetriever, tokenize
+from agent.vector_index import VectorIndex
+
+DIM = 8
+
+TEXTS = {
+    ("dijon-1", "213100555"): "Encours de dette du budget principal : 210 millions d'euros en 2023",
+    ("dijon-2", "213100555"): "Le programme de rénovation thermique des écoles se poursuit",
+    ("metropole-1", "242100410"): "Épargne brute de la métropole en hausse de 4 %",
+    ("rouen-1", "217605409"): "Encours de dette de Rouen : 180 millions d'euros",
+}
+
+
+def build_index(path, vectors=None):
+    index = VectorIndex(str(path), dim=DIM)
+    documents = [
+        Document(id=doc_id, content=text, meta={"siren": siren}) for (doc_id, siren), text in TEXTS.items()
+    ]
+    vectors = vectors or {doc.id: np.random.default_rng(i).normal(size=DIM) for i, doc in enumerate(documents)}
+    index.upsert(documents, lambda docs: [vectors[doc.id] for doc in docs])
+    return index, vectors
+
+
+def test_bm25_ranks_exact_terms_and_ignores_accents():
+    assert tokenize("Épargne BRUTE, 2023") == ["epargne", "brute", "2023"]
+    bm25 = BM25Index(["encours de dette", "rénovation des écoles", "dette dette dette encours", ""])
+    scores = bm25.scores("Dette")
+    assert scores[2] > scores[0] > 0
+    assert scores[1] == scores[3] == 0
+    assert bm25.scores("renovation")[1] > 0
+
+
+def test_results_are_filtered_by_commune_before_scoring(tmp_path):
+    index, _ = build_index(tmp_path)
+    retriever = HybridRetriever(index, top_k=5)
+
+    documents = retriever.retrieve("encours de dette", filters={"siren": ["213100555", "242100410"]})
+    assert documents[0].id == "dijon-1"
+    assert "rouen-1" not in {document.id for document in documents}
+    assert retriever.retrieve("dette", filters={"siren": "000000000"}) == []
+
+
+def test_rankings_are_fused_by_reciprocal_rank(tmp_path):
+    index, vectors = build_index(tmp_path)
+    query_embedding = vectors["dijon-2"]
+    retriever = HybridRetriever(index, top_k=2, rrf_k=60)
+
+    # dijon-1 is the best keyword match, dijon-2 the best embedding match
+    documents = retriever.retrieve("encours de dette", query_embedding=query_embedding, filters={"siren": "213100555"})
+    assert {document.id for document in documents} == {"dijon-1", "dijon-2"}
+    assert documents[0].score == documents[1].score == 1 / 61 + 1 / 62
+
+    # A similarity threshold drops the weak embedding matches
+    strict = HybridRetriever(index, top_k=4, min_similarity=0.99)
+    documents = strict.retrieve("rénovation", query_embedding=query_embedding)
+    assert [document.id for document in documents] == ["dijon-2"]
+    assert documents[0].score == 2 / 61
+
+    # New documents are searchable without rebuilding the retriever
+    index.upsert([Document(id="dijon-3", content="Taux d'endettement", meta={"siren": "213100555"})], lambda docs: [np.ones(DIM)])
+    assert retriever.retrieve("endettement", filters={"siren": "213100555"})[0].id == "dijon-3"
+
+
+def test_local_document_search_tool(tmp_path, monkeypatch):
+    index, _ = build_index(tmp_path)
+    monkeypatch.setattr(hybrid_retrieval, "get_local_retriever", lambda: HybridRetriever(index))
+
+    assert tools.make_local_document_search(["000000000"]) is None
+    search = tools.make_local_document_search(["213100555", "242100410"])
+    tool = create_tool_from_function(search)
+    assert tool.name == "search_local_documents"
+    assert list(tool.parameters["properties"]) == ["query"]
+
+    result = search("épargne brute")
+    assert "métropole" in result and "Rouen" not in result
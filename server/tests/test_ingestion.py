@@ -0,0 +1,91 @@
+import itertools
+import os
+
+import numpy as np
+
+from agent.ingestion import EmbeddingCache, IngestionPipeline, iter_chunks, iter_html_text
+from agent.vector_index import VectorIndex
+
+DIM = 8
+
+
+def write_report(root, siren, name, paragraphs):
+    directory = root / siren
+    directory.mkdir(parents=True, exist_ok=True)
+    body = "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+    (directory / name).write_text(
+        f"<html><head><style>p {{ color: red }}</style></head><body>{body}</body></html>", encoding="utf-8"
+    )
+
+
+def fake_embed(calls):
+    def embed(documents):
+        calls.append(len(documents))
+        return [np.random.default_rng(len(document.content)).normal(size=DIM) for document in documents]
+
+    return embed
+
+
+def test_chunks_are_streamed_with_overlap():
+    words = (f"w{i}" for i in itertools.count())
+    blocks = ((page, next(words)) for page in itertools.count(1))
+    # The source never ends: chunks must be produced lazily
+    first, second = itertools.islice(iter_chunks(blocks, chunk_words=4, overlap=1), 2)
+    assert first == (1, "w0 w1 w2 w3")
+    assert second == (4, "w3 w4 w5 w6")
+
+    chunks = list(iter_chunks([(1, "a b c d e")], chunk_words=4, overlap=1))
+    assert [text for _, text in chunks] == ["a b c d", "d e"]
+
+
+def test_html_text_is_extracted_across_reads(tmp_path, monkeypatch):
+    monkeypatch.setattr("agent.ingestion.HTML_READ_SIZE", 7)
+    write_report(tmp_path, "1", "report.html", ["Budget primitif 2024", "Dette &amp; épargne"])
+    text = " ".join(block for _, block in iter_html_text(str(tmp_path / "1" / "report.html")))
+    assert text.split() == ["Budget", "primitif", "2024", "Dette", "&", "épargne"]
+
+
+def test_pipeline_embeds_each_chunk_once(tmp_path):
+    source = tmp_path / "documents"
+    paragraphs = [f"Ligne {i} du compte administratif" for i in range(100)]
+    write_report(source, "213100555", "ca_2023.html", paragraphs)
+    write_report(source, "213100555", "rob_2024.htm", paragraphs[:20])
+    # The same text for another commune: embedded once thanks to the chunk cache
+    write_report(source, "200084952", "ca_2023.html", paragraphs)
+    (source / "200084952" / "notes.txt").write_text("ignored")
+
+    index = VectorIndex(str(tmp_path / "index"), dim=DIM)
+    calls = []
+    pipeline = IngestionPipeline(
+        index, embed=fake_embed(calls), workers=2, batch_size=4, flush_size=10, chunk_words=50, overlap=10
+    )
+    stats = pipeline.run(str(source))
+
+    assert stats["files"] == 3 and stats["failed_files"] == 0
+    assert len(index) == stats["chunks"]
+    assert stats["embedded"] < stats["chunks"]
+    assert max(calls) <= 4
+    document = index.search(np.ones(DIM), top_k=1)[0]
+    assert document.meta["siren"] in {"213100555", "200084952"}
+    assert os.path.exists(tmp_path / "index" / "embeddings.sqlite")
+
+    # Re-ingesting only embeds the new last chunk of the shortened document, which
+    # also loses its extra chunks
+    write_report(source, "213100555", "ca_2023.html", paragraphs[:30])
+    calls.clear()
+    stats = IngestionPipeline(
+        VectorIndex(str(tmp_path / "index")), embed=fake_embed(calls), workers=2, chunk_words=50, overlap=10
+    ).run(str(source))
+    assert calls == [1]
+    ids = VectorIndex(str(tmp_path / "index")).document_ids()
+    assert len(ids) == stats["chunks"]
+    assert not any(i.startswith(os.path.join("213100555", "ca_2023.html") + "#5") for i in ids)
+
+
+def test_embedding_cache_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many([("a", np.arange(DIM)), ("b", np.ones(DIM))])
+    found = cache.get_many(["a", "b", "c"])
+    assert set(found) == {"a", "b"}
+    assert found["a"].tolist() == list(range(DIM))
+    cache.close()
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+from api import jobs
+from api.jobs import (
+    JOB_FRESHNESS_SECONDS,
+    JOB_INFLIGHT_TIMEOUT_SECONDS,
+    TEMPLATE_FILES,
+    compute_job_key,
+    is_job_reusable,
+)
+
+CITY_INFO = {
+    "siren": "217600350",
+    "municipality_name": "Le Havre",
+    "municipality_code": "76351",
+    "inter_municipality_name": "CU Le Havre Seine Métropole",
+    "inter_municipality_code": "200084952",
+    "reference_sirens": ["213101181", "214401416"],
+}
+
+
+def test_job_key_is_stable_for_identical_requests():
+    assert compute_job_key(CITY_INFO) == compute_job_key(dict(CITY_INFO))
+
+
+def test_job_key_changes_with_request_and_template():
+    other = dict(CITY_INFO, reference_sirens=["214401416", "213101181"])
+    assert compute_job_key(CITY_INFO) != compute_job_key(other)
+    assert compute_job_key(CITY_INFO, "v1") != compute_job_key(CITY_INFO, "v2")
+
+
+def test_template_version_covers_the_prompts(tmp_path, monkeypatch):
+    for relative_path in TEMPLATE_FILES:
+        (tmp_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / relative_path).write_text(relative_path, encoding="utf-8")
+    monkeypatch.setattr(jobs, "SERVER_DIR", str(tmp_path))
+    before = jobs._compute_template_version()
+
+    (tmp_path / "agent" / "prompt.py").write_text("tool_agent_instructions = ''", encoding="utf-8")
+    assert jobs._compute_template_version() != before
+
+
+def test_job_reuse_depends_on_status_and_age():
+    now = datetime.utcnow()
+    fresh = (now - timedelta(seconds=10)).isoformat()
+    stale_done = (now - timedelta(seconds=JOB_FRESHNESS_SECONDS + 1)).isoformat()
+    stale_running = (now - timedelta(seconds=JOB_INFLIGHT_TIMEOUT_SECONDS + 1)).isoformat()
+
+    assert is_job_reusable({"status": "pending", "created_at": fresh}, now)
+    assert not is_job_reusable({"status": "processing", "created_at": stale_running}, now)
+    assert is_job_reusable({"status": "completed", "completed_at": fresh}, now)
+    assert not is_job_reusable({"status": "completed", "completed_at": stale_done}, now)
+    assert not is_job_reusable({"status": "failed", "created_at": fresh}, now)
+    # A job waiting for its redelivery is in flight since its last attempt
+    assert is_job_reusable({"status": "retrying", "created_at": stale_running, "retried_at": fresh}, now)
+    assert not is_job_reusable({"status": "retrying", "created_at": stale_running, "retried_at": stale_running}, now)
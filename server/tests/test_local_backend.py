@@ -0,0 +1,47 @@
+import threading
+
+from api.backends.local import FileSystemBlobStore, InProcessJobQueue, SQLiteJobStore
+
+
+def test_sqlite_job_store_claim_is_conditional(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    first = {"job_id": "abc", "status": "pending", "created_at": "2024-01-01T00:00:00"}
+
+    assert store.claim(first, previous=None)
+    assert not store.claim(dict(first, created_at="later"), previous=None)
+
+    store.update("abc", status="failed", error="boom")
+    failed = store.get("abc")
+    assert failed["status"] == "failed" and failed["error"] == "boom"
+
+    retry = {"job_id": "abc", "status": "pending", "created_at": "2024-01-02T00:00:00"}
+    assert not store.claim(retry, previous=first)
+    assert store.claim(retry, previous=failed)
+    assert store.get("abc")["created_at"] == "2024-01-02T00:00:00"
+
+
+def test_in_process_queue_runs_handler_concurrently():
+    seen = []
+    barrier = threading.Barrier(3, timeout=5)
+
+    def handler(message):
+        barrier.wait()
+        seen.append(message["job_id"])
+
+    queue = InProcessJobQueue(concurrency=3, handler=handler)
+    for job_id in ("a", "b", "c"):
+        queue.send({"job_id": job_id, "city_info": {}})
+    queue.join(timeout=5)
+
+    assert sorted(seen) == ["a", "b", "c"]
+
+
+def test_filesystem_blob_store(tmp_path):
+    blobs = FileSystemBlobStore(str(tmp_path))
+
+    assert not blobs.exists("pdfs/abc.pdf")
+    blobs.put("pdfs/abc.pdf", b"%PDF", content_type="application/pdf")
+    assert blobs.exists("pdfs/abc.pdf")
+    assert blobs.get("pdfs/abc.pdf") == b"%PDF"
+    assert blobs.get("pdfs/missing.pdf") is None
+    assert blobs.url("pdfs/abc.pdf").startswith("file://")
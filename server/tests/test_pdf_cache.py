@@ -0,0 +1,87 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+
+from agent.assets import AssetCache
+from api import pdf_cache, rendering
+from api.backends.local import FileSystemBlobStore
+from api.pdf_cache import PDFCache, pdf_cache_key
+from benchmarks.fakes import fake_image
+
+LOGO = "https://example.org/logo.png"
+DATA = {
+    "logo": {"content": LOGO},
+    "summary": {"municipality": {"name": {"content": "Dijon"}, "population": {"content": "159 346"}}},
+}
+
+
+@pytest.fixture
+def fakes(tmp_path, monkeypatch):
+    """WeasyPrint replaced by a fake recording what it renders, logos by fake images"""
+    fakes = SimpleNamespace(renders=[], images={LOGO: fake_image("blue")})
+
+    def fake_render_pdf(data):
+        fakes.renders.append(data)
+        return b"%PDF-" + data["summary"]["municipality"]["name"]["content"].encode()
+
+    fakes.assets = AssetCache(str(tmp_path / "assets"), fetch=lambda url: fakes.images[url])
+    monkeypatch.setattr(pdf_cache, "render_pdf", fake_render_pdf)
+    monkeypatch.setattr(pdf_cache, "get_asset_cache", lambda: fakes.assets)
+    monkeypatch.setattr(rendering, "get_asset_cache", lambda: fakes.assets)
+    return fakes
+
+
+def test_key_is_canonical(fakes, tmp_path):
+    fakes.assets.fetch(LOGO)
+    key = pdf_cache_key(DATA)
+    reordered = {"summary": copy.deepcopy(DATA["summary"]), "logo": dict(DATA["logo"])}
+    changed = copy.deepcopy(DATA)
+    changed["summary"]["municipality"]["population"]["content"] = "159 347"
+
+    assert pdf_cache_key(reordered) == key
+    assert pdf_cache_key(changed) != key
+    assert pdf_cache_key(DATA, template_version="other") != key
+
+    # A different image behind the same logo URL is a different PDF
+    fakes.images[LOGO] = fake_image("red")
+    fakes.assets = AssetCache(str(tmp_path / "other-assets"), fetch=lambda url: fakes.images[url])
+    fakes.assets.fetch(LOGO)
+    assert pdf_cache_key(DATA) != key
+
+
+def test_identical_data_is_rendered_and_uploaded_once(fakes, tmp_path):
+    blobs = FileSystemBlobStore(str(tmp_path / "blobs"))
+    cache = PDFCache(blobs=blobs, directory=str(tmp_path / "pdfs"))
+
+    key, reused = cache.publish(DATA)
+    assert not reused and blobs.get(key) == b"%PDF-Dijon"
+    assert cache.publish(copy.deepcopy(DATA)) == (key, True)
+    # Another worker reuses the uploaded PDF
+    assert PDFCache(blobs=blobs, directory=None).publish(DATA) == (key, True)
+
+    other = copy.deepcopy(DATA)
+    other["summary"]["municipality"]["name"]["content"] = "Rouen"
+    other_key, reused = cache.publish(other)
+    assert other_key != key and not reused
+    assert len(fakes.renders) == 2
+
+    # A PDF still on the local disk is uploaded again without rendering
+    fresh_blobs = FileSystemBlobStore(str(tmp_path / "fresh-blobs"))
+    assert PDFCache(blobs=fresh_blobs, directory=str(tmp_path / "pdfs")).publish(DATA) == (key, True)
+    assert fresh_blobs.get(key) == b"%PDF-Dijon" and len(fakes.renders) == 2
+
+
+def test_local_cache_is_bounded(fakes, tmp_path):
+    cache = PDFCache(directory=str(tmp_path / "pdfs"), max_mb=15 / 1_048_576)
+
+    assert cache.render(DATA) == (b"%PDF-Dijon", False)
+    assert cache.render(DATA) == (b"%PDF-Dijon", True)
+    other = copy.deepcopy(DATA)
+    other["summary"]["municipality"]["name"]["content"] = "Rouen"
+    assert cache.render(other) == (b"%PDF-Rouen", False)
+
+    # Only one 10-byte PDF fits: the oldest one was evicted
+    assert len(list((tmp_path / "pdfs").iterdir())) == 1
+    assert cache.render(DATA) == (b"%PDF-Dijon", False)
+    assert len(fakes.renders) == 3
@@ -0,0 +1,53 @@
+import json
+import threading
+
+import pytest
+
+from api import pdf_generator_lambda
+from api.jobs import is_job_reusable
+
+
+def test_only_failed_records_are_reported(monkeypatch):
+    processed = []
+    lock = threading.Lock()
+
+    def process_record(record):
+        body = json.loads(record["body"])
+        if body["job_id"] == "job-2":
+            raise RuntimeError("Bedrock down")
+        with lock:
+            processed.append(body["job_id"])
+
+    monkeypatch.setattr(pdf_generator_lambda, "process_record", process_record)
+    event = {"Records": [
+        {"messageId": f"message-{index}", "body": json.dumps({"job_id": f"job-{index}"})}
+        for index in range(4)
+    ]}
+
+    result = pdf_generator_lambda.process_pdf_generation(event, None)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "message-2"}]}
+    assert sorted(processed) == ["job-0", "job-1", "job-3"]
+    assert pdf_generator_lambda.process_pdf_generation({"Records": []}, None) == {"batchItemFailures": []}
+
+
+def test_jobs_are_only_failed_on_their_last_delivery(monkeypatch):
+    updates = []
+
+    class FailingOrchestrator:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("Bedrock down")
+
+    monkeypatch.setattr(pdf_generator_lambda, "Orchestrator", FailingOrchestrator)
+    monkeypatch.setattr(pdf_generator_lambda.backend.jobs, "update", lambda job_id, **fields: updates.append(fields))
+    monkeypatch.setattr(pdf_generator_lambda, "SQS_MAX_RECEIVE_COUNT", 3)
+    body = json.dumps({"job_id": "job-1", "city_info": {}})
+
+    for receive_count in (1, 3):
+        record = {"body": body, "attributes": {"ApproximateReceiveCount": str(receive_count)}}
+        with pytest.raises(RuntimeError):
+            pdf_generator_lambda.process_record(record)
+
+    statuses = [fields["status"] for fields in updates]
+    assert statuses == ["processing", "retrying", "processing", "failed"]
+    assert is_job_reusable(updates[1]) and not is_job_reusable(updates[3])
@@ -0,0 +1,80 @@
+import threading
+import time
+from dataclasses import FrozenInstanceError
+
+import pytest
+
+from agent.plan import DERIVED, LLM, OFGL, get_plan, run_tasks, set_field
+
+NAMES = {"municipality": "Dijon", "inter_municipality": "Dijon Métropole"}
+
+
+def test_plan_is_compiled_once_with_every_field():
+    plan = get_plan()
+    assert get_plan() is plan
+
+    population = next(task for task in plan.tasks if task.name == "summary.municipality.population")
+    assert (population.source, population.ofgl_key) == (OFGL, "population")
+    area = next(task for task in plan.tasks if task.name == "summary.inter_municipality.area")
+    assert area.source == LLM and area.conversation_id == "inter_municipality_area"
+    assert [task.name for task in plan.select("summary", sources=(DERIVED,))] == [
+        "municipality_name",
+        "inter_municipality_name",
+    ]
+    assert {task.section for task in plan.tasks} == {
+        "summary", "projects", "contacts", "budget", "financial_data", "comparative_data", "logo"
+    }
+    with pytest.raises(FrozenInstanceError):
+        population.source = LLM
+
+
+def test_array_items_are_chained_in_one_conversation():
+    contacts = get_plan().select("contacts")
+    assert contacts[0].depends_on == ()
+    for previous, task in zip(contacts, contacts[1:]):
+        assert task.depends_on == (previous.id,)
+    assert [task.ends_conversation for task in contacts] == [False] * (len(contacts) - 1) + [True]
+
+    first, second = contacts[0], next(task for task in contacts if task.path[2] == 1)
+    # The description of the whole array only comes with the first item
+    assert first.render_prompt(NAMES).count("Dijon") == 2
+    assert second.render_prompt(NAMES).count("Dijon") == 1
+
+
+def test_each_job_gets_its_own_data():
+    plan = get_plan()
+    data = plan.new_data()
+    set_field(data, ("summary", "municipality", "population"), 1000)
+    assert data["summary"]["municipality"]["population"]["content"] == 1000
+    assert plan.new_data()["summary"]["municipality"]["population"]["content"] is None
+
+
+def test_run_tasks_respects_dependencies_and_runs_chains_concurrently():
+    tasks = get_plan().select("projects")
+    started = {}
+    lock = threading.Lock()
+
+    def execute(task):
+        with lock:
+            started[task.id] = time.perf_counter()
+        time.sleep(0.001)
+
+    run_tasks(tasks, execute, max_workers=4)
+    assert set(started) == {task.id for task in tasks}
+    for task in tasks:
+        for dep in task.depends_on:
+            assert started[dep] < started[task.id]
+
+
+def test_run_tasks_stops_on_error():
+    tasks = get_plan().select("contacts")
+    executed = []
+
+    def execute(task):
+        executed.append(task.id)
+        if len(executed) == 2:
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run_tasks(tasks, execute, max_workers=2)
+    assert len(executed) == 2
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from agent.ratelimit import AdaptiveConcurrencyLimit, BedrockLimiter, TokenBucket, is_throttling_error
+
+
+class InferenceError(Exception):
+    pass
+
+
+def bedrock_error(code):
+    """An error shaped like haystack's AmazonBedrockInferenceError wrapping a ClientError"""
+    try:
+        raise ClientError({"Error": {"Code": code, "Message": code}}, "Converse")
+    except ClientError as e:
+        try:
+            raise InferenceError("Could not generate inference") from e
+        except InferenceError as wrapped:
+            return wrapped
+
+
+def test_throttling_is_detected_through_wrapping():
+    assert is_throttling_error(bedrock_error("ThrottlingException"))
+    assert not is_throttling_error(bedrock_error("ValidationException"))
+    assert not is_throttling_error(ValueError("boom"))
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(per_minute=600, burst=2)  # 10 tokens/s
+    bucket.acquire(2)
+    start = time.monotonic()
+    bucket.acquire(1)
+    assert time.monotonic() - start >= 0.08
+
+
+def test_aimd_concurrency():
+    limit = AdaptiveConcurrencyLimit(initial=8, cooldown=60)
+    limit.on_throttle()
+    limit.on_throttle()  # within the cooldown: counted once
+    assert limit.limit == 4
+    for _ in range(4):
+        limit.on_success()
+    assert 4.9 < limit.limit < 5
+
+
+def test_limiter_retries_throttled_calls():
+    limiter = BedrockLimiter(concurrency=AdaptiveConcurrencyLimit(initial=8), base_delay=0.001)
+    outcomes = [bedrock_error("ThrottlingException"), bedrock_error("ServiceUnavailableException"), "ok"]
+    retries = []
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert limiter.call(call, on_retry=retries.append) == "ok"
+    assert len(retries) == 2
+    # Only the throttling error reduced the concurrency
+    assert 4 < limiter.concurrency.limit < 5
+
+
+def test_limiter_gives_up():
+    limiter = BedrockLimiter(max_retries=2, base_delay=0.001)
+    calls = []
+
+    def throttled():
+        calls.append(1)
+        raise bedrock_error("ThrottlingException")
+
+    with pytest.raises(InferenceError):
+        limiter.call(throttled)
+    assert len(calls) == 3
+
+    def invalid():
+        calls.append(1)
+        raise bedrock_error("ValidationException")
+
+    with pytest.raises(InferenceError):
+        limiter.call(invalid)
+    assert len(calls) == 4
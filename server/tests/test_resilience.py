@@ -0,0 +1,73 @@
+import threading
+import time
+
+from agent.resilience import OPEN, CircuitBreaker, ResilientCall
+
+
+def fallback():
+    return "no tool result"
+
+
+def test_hedge_answers_when_first_attempt_is_slow():
+    guard = ResilientCall("test", deadline=5, initial_hedge_delay=0.05, min_hedge_delay=0.01)
+    attempts = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            attempts.append(1)
+            first = len(attempts) == 1
+        time.sleep(2 if first else 0.01)
+        return "slow" if first else "hedged"
+
+    start = time.monotonic()
+    assert guard.call(call, fallback) == "hedged"
+    assert time.monotonic() - start < 1
+    assert len(attempts) == 2
+
+
+def test_failed_attempt_is_hedged_immediately():
+    guard = ResilientCall("test", deadline=5, initial_hedge_delay=3)
+    outcomes = [RuntimeError("boom"), "ok"]
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    start = time.monotonic()
+    assert guard.call(call, fallback) == "ok"
+    assert time.monotonic() - start < 1
+
+
+def test_deadline_returns_fallback():
+    guard = ResilientCall("test", deadline=0.1, max_hedges=0)
+    assert guard.call(lambda: time.sleep(1) or "late", fallback) == "no tool result"
+
+
+def test_hedge_delay_follows_observed_p95():
+    guard = ResilientCall("test", deadline=10, min_samples=20, min_hedge_delay=0.0)
+    for i in range(100):
+        guard.latency.record(i / 100)
+    assert guard.hedge_delay() == 0.95
+
+
+def test_circuit_breaker_short_circuits_then_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    guard = ResilientCall("test", deadline=1, max_hedges=0, breaker=breaker)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise RuntimeError("down")
+
+    assert guard.call(failing, fallback) == "no tool result"
+    assert guard.call(failing, fallback) == "no tool result"
+    assert breaker.state == OPEN
+    assert guard.call(failing, fallback) == "no tool result"
+    assert len(calls) == 2  # short-circuited
+
+    time.sleep(0.06)
+    assert guard.call(lambda: "back", fallback) == "back"
+    assert breaker.state == "closed"
@@ -0,0 +1,57 @@
+import json
+import threading
+
+import pytest
+
+from agent.results import ResultSink, decode, default_codec, encode
+from benchmarks.run import run_benchmark
+
+DATA = {"summary": {"municipality": {"name": {"content": "Évreux"}, "population": {"content": 46707}}}}
+
+
+def test_results_round_trip_with_their_codec():
+    body = encode(DATA, "json+zlib")
+    assert body.startswith(b"HGR1json+zlib\n")
+    assert decode(body) == DATA
+    assert len(body) < len(json.dumps(DATA, indent=4, ensure_ascii=False).encode("utf-8"))
+    assert decode(encode(DATA)) == DATA
+    with pytest.raises(ValueError):
+        decode(b'{"summary": {}}')
+
+
+def test_msgpack_zstd_codec():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    assert default_codec() == "msgpack+zstd"
+    assert decode(encode(DATA, "msgpack+zstd")) == DATA
+
+
+def test_concurrent_jobs_keep_their_own_result(tmp_path):
+    sink = ResultSink(str(tmp_path))
+    barrier = threading.Barrier(4, timeout=5)
+
+    def job(index):
+        barrier.wait()
+        sink.submit(f"job-{index}", {"index": index, **DATA})
+
+    threads = [threading.Thread(target=job, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.flush()
+
+    assert [sink.load(f"job-{index}")["index"] for index in range(4)] == [0, 1, 2, 3]
+    exported = sink.export("job-2", str(tmp_path / "data_answer.json"))
+    assert json.loads((tmp_path / "data_answer.json").read_text(encoding="utf-8"))["index"] == 2
+    assert '    "index": 2' in exported and "Évreux" in exported
+    with pytest.raises(FileNotFoundError):
+        sink.load("missing")
+
+
+def test_fiches_no_longer_write_to_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    report = run_benchmark(fiches=2)
+
+    assert report["summary"]["errors"] == 0
+    assert list(tmp_path.iterdir()) == []
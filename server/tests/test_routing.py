@@ -0,0 +1,42 @@
+from agent import orchestrator
+from agent.routing import FAST, INVALID_TYPE, STRONG, UNKNOWN, escalation_reason
+from benchmarks.fakes import ScriptedChatGenerator
+from benchmarks.run import run_benchmark
+
+
+def test_escalation_reasons():
+    assert escalation_reason("42 km2", "number") is None
+    assert escalation_reason("Inconnu.", "string") == UNKNOWN
+    assert escalation_reason("environ quarante", "number") == INVALID_TYPE
+    assert escalation_reason("Dijon", "string") is None
+    assert escalation_reason(None, "string") == "error"
+
+
+def test_fields_escalate_to_the_strong_model(fake_ofgl):
+    fiche = orchestrator.Orchestrator(fake_ofgl)
+    fast = ScriptedChatGenerator("fast", ["40 km2", "inconnu", "beaucoup", RuntimeError("down")])
+    strong = ScriptedChatGenerator("strong", ["12 km2", "3500 habitants", "Maire", "Parcours"])
+    fiche.tool_agent.fast_llm, fiche.tool_agent.llm = fast, strong
+
+    assert fiche._ask_agent("c1", "Superficie ?", "area", kind="number") == "40 km2"
+    assert fiche._ask_agent("c2", "Superficie ?", "area", kind="number") == "12 km2"
+    assert fiche._ask_agent("c3", "Population ?", "population", kind="number") == "3500 habitants"
+    assert fiche._ask_agent("c4", "Titre ?", "title", kind="string") == "Maire"
+    assert fiche._ask_agent("c5", "Carrière ?", "career", complex_field=True) == "Parcours"
+
+    # The escalated exchange replaced the fast one in the conversation
+    assert [m.text for m in fiche.conversation_history["c2"]] == ["Superficie ?", "12 km2"]
+    assert len(fast.questions) == 4 and len(strong.questions) == 4
+    routing = fiche.usage.to_dict()["routing"]
+    assert routing["fields"] == {FAST: 1, STRONG: 4}
+    assert routing["escalations"] == {UNKNOWN: 1, INVALID_TYPE: 1, "error": 1}
+    assert routing["escalation_rate"] == 0.6
+
+
+def test_most_fields_run_on_the_fast_model():
+    fiche = run_benchmark(fiches=1, mode="sequential")["fiches"][0]
+    routing = fiche["usage"]["routing"]
+
+    assert fiche["error"] is None
+    assert routing["fields"][FAST] > 4 * routing["fields"][STRONG] > 0
+    assert routing["escalations"] == {}
@@ -0,0 +1,87 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from agent import orchestrator
+from agent.assets import AssetCache
+from agent.results import ResultSink
+from agent.tracing import Tracer, in_context, span, traced
+from benchmarks.fakes import ScriptedChatGenerator, fake_image
+
+
+@traced("section")
+def process_section(inter=False):
+    with span("field", "field") as field_span:
+        field_span.add("retries")
+        with span("llm.generate", "llm") as llm_span:
+            llm_span.set_attribute("input_tokens", 100)
+            llm_span.set_attribute("output_tokens", 20)
+
+
+def test_span_is_noop_without_tracer():
+    with span("field", "field") as current:
+        current.set_attribute("answer_length", 3)
+    process_section()
+
+
+def test_spans_keep_parents_across_threads():
+    tracer = Tracer("job-1")
+    with tracer.activate(), span("job", "job"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(in_context(process_section, inter)) for inter in (False, True)]
+            for future in futures:
+                future.result()
+
+    spans = {s.span_id: s for s in tracer.finished_spans()}
+    assert len(spans) == 7
+    job = next(s for s in spans.values() if s.kind == "job")
+    for s in spans.values():
+        if s.kind == "section":
+            assert s.parent_id == job.span_id
+        elif s.kind != "job":
+            assert spans[s.parent_id].kind in ("section", "field")
+
+    summary = tracer.summary()
+    assert summary["input_tokens"] == 200 and summary["output_tokens"] == 40
+    assert summary["retries"] == 2
+    assert set(summary["sections"]) == {"process_section[False]", "process_section[True]"}
+    assert summary["by_kind"]["llm"]["count"] == 2
+    assert summary["failed_sections"] == {}
+
+
+def test_export_formats(tmp_path):
+    tracer = Tracer("job-2")
+    with tracer.activate():
+        process_section()
+
+    lines = open(tracer.export(str(tmp_path), "jsonl")).read().splitlines()
+    assert {json.loads(line)["kind"] for line in lines} == {"section", "field", "llm"}
+
+    otel = json.load(open(tracer.export(str(tmp_path), "otel")))
+    otel_spans = otel["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(otel_spans) == 3
+    assert sum("parentSpanId" in s for s in otel_spans) == 2
+
+
+def test_failed_sections_are_logged_and_summarised(tmp_path, monkeypatch, caplog, fake_ofgl):
+    monkeypatch.setattr(orchestrator, "get_asset_cache", lambda: AssetCache(str(tmp_path / "assets"), fetch=fake_image))
+    monkeypatch.setattr(orchestrator, "get_result_sink", lambda: ResultSink(str(tmp_path / "results")))
+    fiche = orchestrator.Orchestrator(fake_ofgl)
+    fiche.tool_agent.fast_llm = fiche.tool_agent.llm = ScriptedChatGenerator("strong", ["inconnu"])
+
+    @traced("section")
+    def process_contact_fields():
+        raise ConnectionError("annuaire unreachable")
+
+    monkeypatch.setattr(fiche, "process_contact_fields", process_contact_fields)
+    for method_name in ("process_summary_fields", "process_projects_fields", "process_budget_fields",
+                        "process_financial_data", "process_comparative_data"):
+        monkeypatch.setattr(fiche, method_name, traced("section", name=method_name)(lambda *args: None))
+
+    fiche.parallel_process_all_sections()
+
+    summary = fiche.tracer.summary()
+    assert summary["failed_sections"] == {"process_contact_fields": "ConnectionError: annuaire unreachable"}
+    assert "process_logo_field" in summary["sections"]
+    errors = [record for record in caplog.records if record.levelno == logging.ERROR]
+    assert "process_contact_fields" in errors[0].getMessage() and errors[0].exc_info
@@ -0,0 +1,41 @@
+from agent.usage import PRICES, Budget, UsageMeter, record_llm_usage, record_tool_call
+from benchmarks.run import run_benchmark
+
+MODEL = "anthropic.claude-3-5-sonnet-20241022-v2:0"
+
+
+def test_meter_accumulates_usage_of_the_current_job():
+    meter = UsageMeter()
+    record_llm_usage(MODEL, 1000, 100)  # no active meter: ignored
+    with meter.activate():
+        record_llm_usage(MODEL, 1000, 100)
+        record_llm_usage(MODEL, 2000, 300)
+        record_tool_call("get_sonar_pro_response")
+
+    usage = meter.to_dict()
+    assert usage["llm_calls"] == 2
+    assert (usage["input_tokens"], usage["output_tokens"]) == (3000, 400)
+    assert usage["tool_calls"] == {"get_sonar_pro_response": 1}
+    price = PRICES[MODEL]
+    assert usage["cost_usd"] > (3000 * price["input"] + 400 * price["output"]) / 1_000_000
+    assert "budget" not in usage
+
+
+def test_budget_exhaustion():
+    meter = UsageMeter(Budget(max_tokens=1000))
+    meter.record_llm(MODEL, 800, 100)
+    assert not meter.exhausted()
+    meter.record_llm(MODEL, 50, 50)
+    assert meter.exhausted()
+    assert UsageMeter(Budget(max_cost_usd=0.001)).exhausted() is False
+
+
+def test_low_priority_fields_are_skipped_past_the_budget():
+    unlimited = run_benchmark(fiches=1, mode="sequential")["fiches"][0]
+    limited = run_benchmark(fiches=1, mode="sequential", token_budget=1)["fiches"][0]
+
+    assert unlimited["usage"]["skipped_fields"] == 0
+    assert limited["error"] is None
+    assert limited["usage"]["skipped_fields"] > 0
+    assert limited["usage"]["budget"]["exhausted"]
+    assert limited["llm_calls"] < unlimited["llm_calls"]
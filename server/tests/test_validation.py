@@ -0,0 +1,69 @@
+import pytest
+
+from agent import orchestrator
+from agent.plan import get_plan
+from agent.validation import DATE, NUMBER, STRING, URL, answer_kind, validate_answer
+from benchmarks.fakes import ScriptedChatGenerator
+
+
+@pytest.mark.parametrize("answer, kind, expected", [
+    ("La superficie est de 40,4 km².", NUMBER, "40,4 km²"),
+    ("159 346 habitants en 2023", NUMBER, "159 346 habitants"),
+    ("1,234,567 euros", NUMBER, "1,234,567 euros"),
+    ("271,2 millions d'euros", NUMBER, "271,2 millions d'euros"),
+    ("51%", NUMBER, "51%"),
+    ("679 €/habitant", NUMBER, "679 €/habitant"),
+    ("En 2021, la population était de 46 707 habitants", NUMBER, "46 707 habitants"),
+    ("Selon l INSEE 2020 : 46707 habitants", NUMBER, "46707 habitants"),
+    ("En 2021 la population était de 46 707", NUMBER, "46 707"),
+    ("40,4 km² en 2020", NUMBER, "40,4 km²"),
+    ("2020", NUMBER, "2020"),
+    ("Logo : https://upload.wikimedia.org/wikipedia/fr/2/2f/Logo_Dijon.svg.", URL,
+     "https://upload.wikimedia.org/wikipedia/fr/2/2f/Logo_Dijon.svg"),
+    ("November 25, 2024", DATE, "25 novembre 2024"),
+    ("1 mars 1977", DATE, "1er mars 1977"),
+    ("25/11/2024", DATE, "25 novembre 2024"),
+    ("Depuis juillet 2020", DATE, "juillet 2020"),
+    ("Réponse : « Nathalie KOENDERS »", STRING, "Nathalie KOENDERS"),
+    ("Inconnu.", NUMBER, "inconnu"),
+])
+def test_answers_are_normalised(answer, kind, expected):
+    validation = validate_answer(answer, kind)
+    assert validation.ok and validation.value == expected
+
+
+@pytest.mark.parametrize("answer, kind", [
+    ("environ quarante", NUMBER),
+    ("www.dijon", URL),
+    ("récemment", DATE),
+    ("Je ne peux pas trouver cette information", STRING),
+])
+def test_invalid_answers_are_rejected(answer, kind):
+    validation = validate_answer(answer, kind)
+    assert not validation.ok and validation.error
+
+
+def test_kind_of_the_fields():
+    kinds = {task.name: answer_kind(task.name, task.field_type) for task in get_plan().tasks}
+    assert kinds["logo"] == URL
+    assert kinds["summary.municipality.area"] == NUMBER
+    assert kinds["contacts[0].birth_date"] == DATE
+    assert kinds["contacts[0].title_since"] == DATE
+    assert kinds["contacts[0].name"] == STRING
+
+
+def test_invalid_answer_is_asked_again_once(fake_ofgl):
+    fiche = orchestrator.Orchestrator(fake_ofgl)
+    task = next(task for task in fiche.plan.tasks if task.name == "contacts[0].birth_date")
+    fast = ScriptedChatGenerator("fast", ["bientôt", "plus tard"])
+    strong = ScriptedChatGenerator("strong", ["toujours pas", "Né le 1 mars 1977", "non plus", "jamais"])
+    fiche.tool_agent.fast_llm, fiche.tool_agent.llm = fast, strong
+
+    fiche._execute_task(task)
+    assert fiche.data["contacts"]["content"][0]["birth_date"]["content"] == "1er mars 1977"
+    assert "« toujours pas »" in strong.questions[1]
+
+    # Still invalid after the re-ask: left unknown
+    fiche._execute_task(task)
+    assert fiche.data["contacts"]["content"][0]["birth_date"]["content"] == "inconnu"
+    assert fiche.usage.to_dict()["validation"] == {"reasks": 2, "recovered": 1}
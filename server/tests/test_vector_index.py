@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from haystack import Document
+
+from agent.vector_index import VectorIndex, VectorIndexRetriever
+
+DIM = 16
+
+
+def make_embed(calls):
+    """Deterministic embeddings derived from the content of the documents"""
+    def embed(documents):
+        calls.extend(document.id for document in documents)
+        return [
+            np.random.default_rng(abs(hash(document.content)) % 2**32).normal(size=DIM).tolist()
+            for document in documents
+        ]
+
+    return embed
+
+
+def test_ingestion_is_incremental_and_persistent(tmp_path):
+    calls = []
+    index = VectorIndex(str(tmp_path), dim=DIM)
+    documents = [Document(id=f"doc{i}", content=f"Document {i}") for i in range(5)]
+
+    assert index.upsert(documents, make_embed(calls)) == 5
+    assert index.upsert(documents, make_embed(calls)) == 0
+    changed = [Document(id="doc1", content="Document 1, updated"), Document(id="doc5", content="Document 5")]
+    assert index.upsert(documents + changed, make_embed(calls)) == 2
+    assert calls[5:] == ["doc1", "doc5"]
+
+    # A new process opens the index without embedding anything
+    reopened = VectorIndex(str(tmp_path))
+    assert len(reopened) == 6
+    assert isinstance(reopened._matrix, np.memmap)
+    query = make_embed([])([Document(content="Document 1, updated")])[0]
+    best = reopened.search(query, top_k=1)[0]
+    assert best.id == "doc1" and best.content == "Document 1, updated"
+    assert best.score == pytest.approx(1.0, abs=1e-5)
+
+    with pytest.raises(ValueError):
+        VectorIndex(str(tmp_path), dim=DIM + 1)
+
+
+def test_top_k_matches_brute_force_and_skips_deleted(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, DIM))
+    documents = [Document(id=str(i), content=f"text {i}") for i in range(200)]
+    index = VectorIndex(str(tmp_path), dim=DIM)
+    index.upsert(documents, lambda docs: [vectors[int(doc.id)] for doc in docs])
+
+    query = rng.normal(size=DIM)
+    normalised = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = [str(i) for i in np.argsort(-(normalised @ query))[:5]]
+    assert [document.id for document in index.search(query, top_k=5)] == expected
+
+    index.delete([expected[0]])
+    assert [document.id for document in index.search(query, top_k=4)] == expected[1:]
+    assert len(VectorIndex(str(tmp_path))) == 199
+
+
+def test_ann_search_recall(tmp_path):
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, DIM))
+    vectors = centers[rng.integers(0, 20, size=2000)] + 0.1 * rng.normal(size=(2000, DIM))
+    documents = [Document(id=str(i), content=f"text {i}") for i in range(2000)]
+    index = VectorIndex(str(tmp_path), dim=DIM, ann_min_documents=1000)
+    index.upsert(documents, lambda docs: [vectors[int(doc.id)] for doc in docs])
+    assert index.has_ann
+
+    exact = VectorIndex(str(tmp_path / "exact"), dim=DIM)
+    exact.upsert(documents, lambda docs: [vectors[int(doc.id)] for doc in docs])
+    assert not exact.has_ann
+
+    recalls = []
+    for query in rng.normal(size=(20, DIM)):
+        expected = {document.id for document in exact.search(query, top_k=10)}
+        found = {document.id for document in index.search(query, top_k=10, n_probe=10)}
+        recalls.append(len(expected & found) / 10)
+    assert np.mean(recalls) >= 0.9
+
+    # Documents added after the ANN structure was built are searchable too
+    index.upsert([Document(id="new", content="new")], lambda docs: [centers[0]])
+    assert VectorIndex(str(tmp_path)).search(centers[0], top_k=1)[0].id == "new"
+
+
+def test_retriever_component_sees_other_writers(tmp_path):
+    reader = VectorIndex(str(tmp_path), dim=DIM)
+    retriever = VectorIndexRetriever(index=reader, top_k=2)
+    assert retriever.run(query_embedding=[1.0] * DIM)["documents"] == []
+
+    writer = VectorIndex(str(tmp_path))
+    writer.upsert([Document(id="a", content="a")], lambda docs: [[1.0] * DIM])
+    assert [document.id for document in retriever.run(query_embedding=[1.0] * DIM)["documents"]] == ["a"]